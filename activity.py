@@ -0,0 +1,254 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from flask import current_app
+
+import db
+import queries
+from tenants import current_tenant
+
+# Student activity (the dashboard's "Recent Activity"). record() never
+# touches the database. It appends the event to the student's ring buffer
+# and to a bounded in-process queue. A writer thread drains the queue into
+# the append-only activity table, one transaction per batch and database,
+# so logins and uploads don't queue up behind each other for SQLite's write
+# lock. If the writer falls ACTIVITY_MAX_QUEUE events behind, new events are
+# dropped and counted rather than blocking requests. Whatever is still queued
+# is written when the process exits.
+#
+# The dashboard reads the ring buffer: the last ACTIVITY_RECENT events per
+# student, loaded from the table on first use and merged with what this
+# process recorded since. Buffers are per worker, so each reloads after
+# ACTIVITY_BUFFER_TTL seconds to pick up events recorded by other workers.
+
+logger = logging.getLogger(__name__)
+
+# kind -> (icon, title)
+KINDS = {
+    'login': ('fas fa-sign-in-alt', 'Signed In'),
+    'profile_pic': ('fas fa-camera', 'Profile Picture Updated'),
+    'marks': ('fas fa-chart-line', 'Marks Updated'),
+}
+
+INSERT_ACTIVITY = 'INSERT INTO activity (student_id, kind, detail, created_at) VALUES (?, ?, ?, ?)'
+
+
+class ActivityLog:
+    def __init__(self, registry, max_queue=10000, batch_size=500, flush_interval=0.2,
+                 recent=10, buffer_ttl=60, max_buffers=50000):
+        self.registry = registry
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recent_size = recent
+        self.buffer_ttl = buffer_ttl
+        self.max_buffers = max_buffers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._buffers = OrderedDict()  # (database, student_id) -> [loaded_at, deque of events]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self._writer = None
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # The writer starts with the first event rather than with the app:
+    # threads don't survive fork, so a worker forked from a preloaded app
+    # (gunicorn --preload) has to start its own
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name='activity-writer', daemon=True)
+                self._writer.start()
+
+    def _after_fork(self):
+        # Only the forking thread is copied into the child, so nothing here
+        # can still be held or drained by a thread; events the parent had
+        # queued are its own writer's to write
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._writer = None
+
+    # Events are (created_at, kind, detail) tuples, oldest first
+    def record(self, database, student_id, kind, detail=''):
+        if self._writer is None:
+            self._start_writer()
+        event = (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), kind, detail)
+        key = (database, student_id)
+        with self._lock:
+            self.recorded += 1
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                # Not loaded yet: the first read merges this with the table
+                buffer = self._buffers[key] = [None, deque(maxlen=self.recent_size)]
+                self._trim()
+            else:
+                self._buffers.move_to_end(key)
+            buffer[1].append(event)
+        try:
+            self._queue.put_nowait((database, student_id, event))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    # The student's latest events, newest first. load() returns their last
+    # rows from the table (oldest first) and only runs on a cold or stale
+    # buffer.
+    def recent(self, database, student_id, load):
+        key = (database, student_id)
+        now = time.monotonic()
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is not None and buffer[0] is not None and now - buffer[0] < self.buffer_ttl:
+                self._buffers.move_to_end(key)
+                return list(reversed(buffer[1]))
+
+        stored = load()
+        with self._lock:
+            buffer = self._buffers.get(key)
+            # Recorded here but maybe not written yet; events already written
+            # show up in both and are counted once
+            pending = buffer[1] if buffer is not None else ()
+            events = sorted(set(stored).union(pending))[-self.recent_size:]
+            self._buffers[key] = [now, deque(events, maxlen=self.recent_size)]
+            self._buffers.move_to_end(key)
+            self._trim()
+        return list(reversed(events))
+
+    def _trim(self):
+        while len(self._buffers) > self.max_buffers:
+            self._buffers.popitem(last=False)
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            self._drain(batch)
+            # Under load a full batch is already waiting; otherwise give a
+            # quiet period's events a moment to join this one
+            if len(batch) < self.batch_size and not self._stop.is_set():
+                self._stop.wait(self.flush_interval)
+                self._drain(batch)
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _drain(self, batch):
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _write(self, batch):
+        by_database = {}
+        for database, student_id, (created_at, kind, detail) in batch:
+            by_database.setdefault(database, []).append((student_id, kind, detail, created_at))
+        for database, rows in by_database.items():
+            pool = self.registry.get(database)
+            try:
+                conn = pool.acquire()
+                try:
+                    with conn:
+                        conn.executemany(INSERT_ACTIVITY, rows)
+                finally:
+                    pool.release(conn)
+            except Exception:
+                logger.exception('Could not write %d activity events to %s', len(rows), database)
+                with self._lock:
+                    self.failed += len(rows)
+                continue
+            with self._lock:
+                self.written += len(rows)
+                self.batches += 1
+
+    # Wait until everything recorded so far is written (or failed)
+    def flush(self):
+        self._queue.join()
+
+    def close(self, timeout=30):
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'recorded': self.recorded,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'batches': self.batches,
+                'buffers': len(self._buffers),
+            }
+
+
+def get_log(app=None):
+    app = app or current_app
+    return app.extensions['activity']
+
+
+def record(student_id, kind, detail=''):
+    get_log().record(current_tenant().database, student_id, kind, detail)
+
+
+def load_recent(conn, student_id, limit):
+    rows = conn.execute(queries.RECENT_ACTIVITY, (student_id, limit)).fetchall()
+    return [tuple(row) for row in reversed(rows)]
+
+
+def _ago(created_at, now):
+    seconds = (now - datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S')).total_seconds()
+    for unit, size in (('day', 86400), ('hour', 3600), ('minute', 60)):
+        if seconds >= size:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count != 1 else ''} ago"
+    return 'just now'
+
+
+# Ready for the dashboard template: icon, title, description and time
+def recent_activities(student_id):
+    log = get_log()
+    events = log.recent(current_tenant().database, student_id,
+                        lambda: load_recent(db.get_db(), student_id, log.recent_size))
+    now = datetime.now()
+    activities = []
+    for created_at, kind, detail in events:
+        icon, title = KINDS.get(kind, ('fas fa-circle', kind.replace('_', ' ').title()))
+        activities.append({'icon': icon, 'title': title, 'description': detail,
+                           'time': _ago(created_at, now)})
+    return activities
+
+
+def init_app(app):
+    app.config.setdefault('ACTIVITY_MAX_QUEUE', 10000)
+    app.config.setdefault('ACTIVITY_BATCH_SIZE', 500)
+    app.config.setdefault('ACTIVITY_FLUSH_INTERVAL', 0.2)
+    app.config.setdefault('ACTIVITY_RECENT', 10)
+    app.config.setdefault('ACTIVITY_BUFFER_TTL', 60)
+
+    log = ActivityLog(
+        db.get_registry(app),
+        max_queue=int(app.config['ACTIVITY_MAX_QUEUE']),
+        batch_size=int(app.config['ACTIVITY_BATCH_SIZE']),
+        flush_interval=float(app.config['ACTIVITY_FLUSH_INTERVAL']),
+        recent=int(app.config['ACTIVITY_RECENT']),
+        buffer_ttl=float(app.config['ACTIVITY_BUFFER_TTL']),
+    )
+    app.extensions['activity'] = log
+    atexit.register(log.close)
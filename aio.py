@@ -0,0 +1,33 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from flask import current_app
+
+# Support for the async views (Flask's async extra, i.e. asgiref). Under
+# WSGI an async view runs on a private event loop in its request thread.
+# Under ASGI (asgi.py) it runs on the server's shared loop, where a single
+# blocking sqlite3 call would stall every open connection. Either way,
+# database access and other blocking work goes through run_sync. That hands
+# it to a bounded thread pool (ASYNC_WORKERS) together with the request's
+# context, so session, g and get_db() work exactly as in a sync view.
+#
+# Await one run_sync at a time per request: the request's pooled
+# connection lives on g and is not safe to share between two calls running
+# at once.
+
+
+def _executor():
+    return current_app.extensions['async_executor']
+
+
+async def run_sync(fn, *args, **kwargs):
+    call = partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor(), call)
+
+
+def init_app(app):
+    app.config.setdefault('ASYNC_WORKERS', 8)
+    app.extensions['async_executor'] = ThreadPoolExecutor(
+        max_workers=int(app.config['ASYNC_WORKERS']), thread_name_prefix='async')
@@ -1,19 +1,137 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash
+import hmac
+import inspect
+import ipaddress
 import os
+import re
 import sqlite3
+import click
+import csv
+import io
 from functools import wraps
 from datetime import datetime, timedelta
-import time
+
+import activity
+import aio
+import cache
+import db
+import fees as fees_ledger
+import grades
+import images
+import metrics
+import migrations
+import notifications
+import passwords
+import pubsub
+import queries
+import reports
+import search
+import sessions
+import tenants
+import timetable
+from attendance import InvalidRegister, get_attendance_summary, rebuild_summary, record_register
+from db import get_db
+from static_pages import static_page
+from students import class_student_ids, current_student, dashboard_feed
 
 app = Flask(__name__)
-app.secret_key = 'your_secret_key_here'  # Change this to a secure secret key
+# Sessions live server-side, so rotating this doesn't log everyone out
+app.secret_key = os.environ.get('SECRET_KEY', 'your_secret_key_here')  # Change this to a secure secret key
+
+# Database settings
+app.config['DATABASE'] = os.environ.get('SCHOOL_DB', 'school.db')
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 8))
+# Schools served by this deployment (see tenants.py); without TENANTS_FILE
+# there is just the one school in DATABASE. At most DB_MAX_OPEN_TENANTS
+# databases keep connections open at a time.
+app.config['TENANTS_FILE'] = os.environ.get('TENANTS_FILE')
+app.config['TENANT_ROOT'] = os.environ.get('TENANT_ROOT', os.path.join(app.instance_path, 'tenants'))
+app.config['DB_MAX_OPEN_TENANTS'] = int(os.environ.get('DB_MAX_OPEN_TENANTS', 32))
+tenants.init_app(app)
+# Time and count every statement run on a pooled connection
+app.config['DB_CONNECTION_FACTORY'] = metrics.InstrumentedConnection
+db.init_app(app)
+
+# Request metrics at /metrics. SLOW_REQUEST_MS logs slow requests with their
+# SQL; PROFILE_SAMPLE_RATE profiles that fraction of requests.
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', 0))
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+metrics.init_app(app)
+# /metrics and /metrics/* are for admins, for scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>" and for clients in
+# METRICS_ALLOWED_NETWORKS (comma-separated, e.g. "10.0.0.0/8,::1"). Behind a
+# proxy, allowing loopback allows everyone unless TRUSTED_PROXIES is set.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['METRICS_ALLOWED_NETWORKS'] = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.environ.get('METRICS_ALLOWED_NETWORKS', '').split(',') if network.strip()]
+
+# Cache settings (CACHE_BACKEND=redis shares the cache across workers)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 300))
+cache.init_app(app)
+
+# Server-side sessions: the cookie only carries an opaque id
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'sqlite')
+sessions.init_app(app)
+
+# Server-sent events (EVENTS_BACKEND=redis fans out across workers)
+app.config['EVENTS_BACKEND'] = os.environ.get('EVENTS_BACKEND', 'memory')
+app.config['EVENTS_HEARTBEAT'] = int(os.environ.get('EVENTS_HEARTBEAT', 15))
+pubsub.init_app(app)
+# Set by gunicorn_events.conf.py: that server answers /api/events only
+app.config['SERVE_ONLY_EVENTS'] = os.environ.get('SERVE_ONLY_EVENTS') == '1'
+
+# Profile picture processing
+app.config['PROFILE_PIC_MAX_BYTES'] = int(os.environ.get('PROFILE_PIC_MAX_BYTES', 5 * 1024 * 1024))
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+images.init_app(app)
+# Werkzeug refuses bigger request bodies before parsing or spooling them;
+# the slack covers multipart framing and the other form and JSON posts
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get(
+    'MAX_CONTENT_LENGTH', app.config['PROFILE_PIC_MAX_BYTES'] + 1024 * 1024))
+
+# Password hashing pool and login throttling. LOGIN_LIMIT_PER_IP counts
+# failed logins per client address in LOGIN_LIMIT_WINDOW seconds.
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+app.config['LOGIN_LIMIT_PER_ROLL_NUMBER'] = int(os.environ.get('LOGIN_LIMIT_PER_ROLL_NUMBER', 5))
+app.config['LOGIN_LIMIT_PER_IP'] = int(os.environ.get('LOGIN_LIMIT_PER_IP', 30))
+app.config['LOGIN_LIMIT_WINDOW'] = int(os.environ.get('LOGIN_LIMIT_WINDOW', 60))
+passwords.init_app(app)
+
+# Behind nginx (or any reverse proxy) set TRUSTED_PROXIES to the number of
+# proxies in front of the app, so request.remote_addr, the scheme and the
+# host (which picks the school) come from their X-Forwarded-* headers
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    proxies = app.config['TRUSTED_PROXIES']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+# Student activity log: events are queued and written in batches (see
+# activity.py); the dashboard shows the last ACTIVITY_RECENT of them
+app.config['ACTIVITY_MAX_QUEUE'] = int(os.environ.get('ACTIVITY_MAX_QUEUE', 10000))
+app.config['ACTIVITY_RECENT'] = int(os.environ.get('ACTIVITY_RECENT', 10))
+activity.init_app(app)
+
+# Threads that async views hand their database work to (see aio.py)
+app.config['ASYNC_WORKERS'] = int(os.environ.get('ASYNC_WORKERS', 8))
+aio.init_app(app)
+
+# Largest register accepted by /teacher/attendance/bulk in one request
+app.config['ATTENDANCE_REGISTER_MAX_ROWS'] = int(os.environ.get('ATTENDANCE_REGISTER_MAX_ROWS', 20000))
+
+# Browser/proxy cache lifetime for the public pages
+app.config['STATIC_PAGE_MAX_AGE'] = int(os.environ.get('STATIC_PAGE_MAX_AGE', 300))
 
 # File upload settings
 UPLOAD_FOLDER = 'static/images/profile_pics'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Where the upload endpoints put pictures, under the school's static folder
+PROFILE_UPLOAD_DIRS = ('images/profile_pics', 'uploads/profiles')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -21,8 +139,17 @@ def allowed_file(filename):
 # Create uploads directory if it doesn't exist
 os.makedirs('static/uploads/profiles', exist_ok=True)
 
-# Login required decorator
+# Login required decorator (sync or async views)
 def login_required(f):
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def decorated_coroutine(*args, **kwargs):
+            if 'student_id' not in session:
+                flash('Please log in first.')
+                return redirect(url_for('student_login'))
+            return await f(*args, **kwargs)
+        return decorated_coroutine
+
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'student_id' not in session:
@@ -31,76 +158,73 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# Initialize database
+def metrics_access_allowed():
+    token = app.config['METRICS_TOKEN']
+    if token:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(credentials.strip().encode(), token.encode()):
+            return True
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        address = None
+    if address is not None and any(address in network for network in app.config['METRICS_ALLOWED_NETWORKS']):
+        return True
+    return 'admin_id' in session
+
+# Metrics access decorator (see METRICS_TOKEN above)
+def metrics_access_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not metrics_access_allowed():
+            return jsonify({'error': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+# New session id on login so a pre-login id can't be reused (no-op with
+# cookie sessions)
+def regenerate_session():
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+
+# Bring every school's schema up to date. This only runs pending
+# migrations, so it is cheap on every worker boot and never touches
+# existing data.
 def init_db():
-    conn = sqlite3.connect('school.db')
+    for tenant in tenants.get_directory(app):
+        conn = sqlite3.connect(tenant.database, timeout=30)
+        try:
+            migrations.migrate(conn)
+        finally:
+            conn.close()
+
+# Database the CLI commands work on: the default school, or the one named
+# by SCHOOL_TENANT (e.g. SCHOOL_TENANT=oakridge flask --app app seed)
+def cli_database():
+    slug = os.environ.get('SCHOOL_TENANT') or tenants.DEFAULT
+    tenant = tenants.get_directory(app).get(slug)
+    if tenant is None:
+        raise click.ClickException(f"Unknown tenant {slug!r}")
+    return tenant.database
+
+# Load demo data (run with: flask --app app seed)
+def seed_demo_data(conn):
     c = conn.cursor()
     
-    # Drop existing tables to start fresh
-    c.execute('DROP TABLE IF EXISTS student')
-    c.execute('DROP TABLE IF EXISTS notifications')
-    c.execute('DROP TABLE IF EXISTS assignments')
-    c.execute('DROP TABLE IF EXISTS attendance')
-    
-    # Create student table if not exists
-    c.execute('''CREATE TABLE IF NOT EXISTS student (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        roll_number TEXT UNIQUE NOT NULL,
-        class_name TEXT,
-        section TEXT,
-        email TEXT UNIQUE,
-        password_hash TEXT,
-        profile_pic TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Create notifications table if not exists
-    c.execute('''CREATE TABLE IF NOT EXISTS notifications (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        student_id INTEGER,
-        title TEXT NOT NULL,
-        message TEXT NOT NULL,
-        type TEXT DEFAULT 'info',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (student_id) REFERENCES student (id)
-    )''')
-    
-    # Create assignments table if not exists
-    c.execute('''CREATE TABLE IF NOT EXISTS assignments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        due_date DATE,
-        subject TEXT,
-        class_name TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Create attendance table if not exists
-    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        student_id INTEGER,
-        date DATE NOT NULL,
-        subject TEXT NOT NULL,
-        status TEXT NOT NULL CHECK(status IN ('present', 'absent')),
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (student_id) REFERENCES student (id)
-    )''')
-    
     # Create demo student
     demo_password = 'password123'
     demo_password_hash = generate_password_hash(demo_password)
     
-    c.execute('''INSERT INTO student (name, roll_number, class_name, section, email, password_hash)
+    c.execute('''INSERT OR IGNORE INTO student (name, roll_number, class_name, section, email, password_hash)
                 VALUES (?, ?, ?, ?, ?, ?)''',
                 ('Demo Student', 'DEMO001', '10', 'A', 'demo@example.com', demo_password_hash))
+    if c.rowcount == 0:
+        # Already seeded
+        return False
     
     # Add demo notifications
     student_id = c.lastrowid
-    c.execute('''INSERT INTO notifications (student_id, title, message, type)
-                VALUES (?, ?, ?, ?)''',
-                (student_id, 'Welcome!', 'Welcome to ST MARIAM\'S SCHOOL', 'success'))
+    notifications.notify_student(conn, student_id, 'Welcome!', 'Welcome to ST MARIAM\'S SCHOOL', 'success')
     
     # Add demo assignments
     today = datetime.now()
@@ -110,19 +234,174 @@ def init_db():
                  (today + timedelta(days=7)).strftime('%Y-%m-%d'),
                  'Mathematics', '10'))
     
+    # Add demo fee structure, invoices and payments
+    year = fees_ledger.academic_year()
+    demo_fees = [('Tuition Fee', 30000), ('Development Fee', 10000),
+                 ('Library Fee', 5000), ('Computer Lab Fee', 5000)]
+    c.executemany('''INSERT OR IGNORE INTO fee_structure (class_name, academic_year, fee_type, amount)
+                    VALUES (?, ?, ?, ?)''', [('10', year, fee_type, amount) for fee_type, amount in demo_fees])
+    for fee_type, amount in demo_fees:
+        fees_ledger.add_invoice(conn, student_id, amount,
+                                 (today + timedelta(days=15)).strftime('%Y-%m-%d'), fee_type, year)
+    for days_ago, mode in ((120, 'Bank Transfer'), (60, 'Online')):
+        fees_ledger.add_payment(conn, student_id, 15000,
+                                 (today - timedelta(days=days_ago)).strftime('%Y-%m-%d %H:%M:%S'), mode)
+    
+    # Add a demo exam with marks
+    c.execute('''INSERT INTO exam (name, class_name, academic_year, exam_date)
+                VALUES (?, ?, ?, ?)''',
+                ('Term 1', '10', year, (today - timedelta(days=30)).strftime('%Y-%m-%d')))
+    exam_id = c.lastrowid
+    c.executemany('''INSERT INTO mark (exam_id, student_id, subject, marks_obtained, total_marks)
+                    VALUES (?, ?, ?, ?, ?)''',
+                  [(exam_id, student_id, subject, marks, 100)
+                   for subject, marks in (('Mathematics', 92), ('Science', 88),
+                                          ('English', 90), ('Social Studies', 85))])
+    
+    # Add a demo bell schedule, staff, rooms and a week for class 10 A
+    periods = [('Period 1', '08:00', '08:45'), ('Period 2', '08:50', '09:35'),
+               ('Period 3', '09:40', '10:25'), ('Period 4', '10:45', '11:30'),
+               ('Period 5', '11:35', '12:20'), ('Period 6', '12:25', '13:10')]
+    c.executemany('INSERT INTO period (name, start_time, end_time) VALUES (?, ?, ?)', periods)
+    period_ids = [row[0] for row in c.execute('SELECT id FROM period ORDER BY start_time')]
+    subjects = [('Mathematics', 'Mr. Sharma', 'maths@example.com'), ('Science', 'Ms. Das', 'science@example.com'),
+                ('English', 'Mrs. Roy', 'english@example.com'), ('Social Studies', 'Mr. Khan', 'sst@example.com')]
+    c.executemany('INSERT OR IGNORE INTO teacher (name, email) VALUES (?, ?)',
+                  [(teacher, email) for _, teacher, email in subjects])
+    teacher_ids = {email: teacher_id for teacher_id, email in c.execute('SELECT id, email FROM teacher')}
+    c.executemany('INSERT OR IGNORE INTO room (name, capacity) VALUES (?, ?)',
+                  [('Room 10A', 40), ('Science Lab', 30)])
+    room_ids = dict(c.execute('SELECT name, id FROM room'))
+    conn.commit()
+    timetable.save_timetable(conn, '10', 'A', [
+        {'day': day, 'period_id': period_id, 'subject': subject, 'teacher_id': teacher_ids[email],
+         'room_id': room_ids['Science Lab' if subject == 'Science' else 'Room 10A']}
+        for day in range(6)
+        for period_id, (subject, _, email) in zip(period_ids, subjects[day % 4:] + subjects[:day % 4])
+    ])
+    
+    # ... and an upcoming exam with its date sheet
+    c.execute('''INSERT INTO exam (name, class_name, academic_year, exam_date)
+                VALUES (?, ?, ?, ?)''',
+                ('Term 2', '10', year, (today + timedelta(days=10)).strftime('%Y-%m-%d')))
+    timetable.save_exam_papers(conn, c.lastrowid, [
+        {'subject': subject, 'date': (today + timedelta(days=10 + i * 2)).strftime('%Y-%m-%d'),
+         'start': '09:00', 'end': '12:00', 'topic': topic, 'room_id': room_ids['Room 10A']}
+        for i, (subject, topic) in enumerate((('Mathematics', 'Algebra and Geometry'),
+                                               ('Science', 'Chapters 1-6'),
+                                               ('English', 'Literature and Grammar')))
+    ])
+    
     conn.commit()
-    conn.close()
+    grades.compute_exam_results(conn, exam_id)
+    return True
 
 # Initialize database
 init_db()
 
+@app.cli.command('migrate')
+def migrate_command():
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        applied = migrations.migrate(conn)
+        version = migrations.current_version(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"Applied migrations {applied}, schema is at version {version}")
+    else:
+        print(f"Schema is up to date (version {version})")
+
+@app.cli.command('check-plans')
+def check_plans_command():
+    # Fails (exit 1) if any hot query falls back to a full table scan
+    conn = sqlite3.connect(cli_database())
+    try:
+        failures = queries.check_query_plans(conn)
+    finally:
+        conn.close()
+    for name, plan in failures.items():
+        print(f"FULL SCAN in {name}:")
+        for detail in plan:
+            print(f"    {detail}")
+    if failures:
+        raise SystemExit(1)
+    print(f"All {len(queries.HOT_QUERIES)} hot queries use indexes.")
+
+@app.cli.command('rebuild-attendance')
+def rebuild_attendance_command():
+    # Recompute the attendance rollup from raw rows (backfill or repair)
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        with conn:
+            rebuild_summary(conn)
+        rows = conn.execute('SELECT COUNT(*) FROM attendance_summary').fetchone()[0]
+    finally:
+        conn.close()
+    print(f"Attendance summary rebuilt ({rows} rows).")
+
+@app.cli.command('reconcile-payments')
+@click.argument('statement', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--unmatched', type=click.Path(dir_okay=False), help='write unmatched rows to this CSV')
+def reconcile_payments_command(statement, batch_size, unmatched):
+    # Record payments from a bank statement CSV (date,amount,reference,roll_number[,mode])
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        counts = fees_ledger.reconcile_statement(conn, statement, batch_size, unmatched)
+    finally:
+        conn.close()
+    print(f"Matched {counts['matched']}, already recorded {counts['duplicate']}, unmatched {counts['unmatched']}")
+
+@app.cli.command('compute-results')
+@click.argument('exam_ids', nargs=-1, type=int)
+def compute_results_command(exam_ids):
+    # Rank every student of the given exams (all exams if none given)
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        exam_ids = exam_ids or [row[0] for row in conn.execute('SELECT id FROM exam')]
+        for exam_id in exam_ids:
+            students = grades.compute_exam_results(conn, exam_id)
+            print(f"Exam {exam_id}: ranked {students} students")
+    finally:
+        conn.close()
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    # Re-index notifications and assignments from scratch (repair)
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        documents = search.rebuild_index(conn)
+    finally:
+        conn.close()
+    print(f"Search index rebuilt ({documents} documents).")
+
+@app.cli.command('compile-timetables')
+def compile_timetables_command():
+    # Rebuild every class's compiled schedule (after edits made outside the app)
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        compiled = timetable.compile_all(conn)
+    finally:
+        conn.close()
+    print(f"Compiled {compiled} class schedules.")
+
+@app.cli.command('seed')
+def seed_command():
+    conn = sqlite3.connect(cli_database(), timeout=30)
+    try:
+        created = seed_demo_data(conn)
+    finally:
+        conn.close()
+    print("Demo data seeded." if created else "Demo data already present.")
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return static_page('index.html')
 
 @app.route('/home')
 def home():
-    return render_template('index.html')
+    return static_page('index.html')
 
 @app.route('/student/login', methods=['GET', 'POST'])
 def student_login():
@@ -130,118 +409,90 @@ def student_login():
         roll_number = request.form.get('roll_number')
         password = request.form.get('password')
         
-        conn = sqlite3.connect('school.db')
+        # Throttle per roll number and per client before doing any hashing
+        if not passwords.login_allowed(roll_number, request.remote_addr):
+            flash('Too many login attempts. Please wait a minute and try again.', 'error')
+            return render_template('student_login.html'), 429
+        
+        conn = get_db()
         c = conn.cursor()
         
         try:
             # Get student details
-            c.execute('SELECT * FROM student WHERE roll_number = ?', (roll_number,))
+            c.execute(queries.STUDENT_BY_ROLL_NUMBER, (roll_number,))
             student = c.fetchone()
             
             if student:
-                # Check password
-                if check_password_hash(student[6], password):  # password_hash is at index 6
+                # Check password (hashing runs on the bounded hashing pool)
+                if passwords.verify_password(student[6], password):  # password_hash is at index 6
+                    # Upgrade hashes made with older parameters. Best effort:
+                    # the password is already verified, so a busy pool only
+                    # postpones the upgrade to a later login
+                    if passwords.needs_rehash(student[6]):
+                        try:
+                            c.execute('UPDATE student SET password_hash = ? WHERE id = ?',
+                                      (passwords.hash_password(password), student[0]))
+                            conn.commit()
+                            cache.invalidate_student(student[0])
+                        except passwords.HashingBusy:
+                            pass
+                    regenerate_session()
                     session['student_id'] = student[0]  # id is at index 0
                     session['student_name'] = student[1]  # name is at index 1
-                    conn.close()
+                    activity.record(student[0], 'login', f'From {request.remote_addr}')
                     return redirect(url_for('student_dashboard'))
             
+            passwords.login_failed(request.remote_addr)
             flash('Invalid roll number or password. Please try again.', 'error')
-        except Exception as e:
-            print(f"Login error: {str(e)}")
+        except passwords.HashingBusy:
+            flash('The server is busy right now. Please try again in a moment.', 'error')
+            return render_template('student_login.html'), 503
+        except Exception:
+            app.logger.exception('Login error')
             flash('An error occurred during login. Please try again.', 'error')
-        finally:
-            conn.close()
     
     return render_template('student_login.html')
 
 @app.route('/student/dashboard')
 @login_required
 def student_dashboard():
-    # Use direct SQL query
-    conn = sqlite3.connect('school.db')
-    c = conn.cursor()
-    
-    # Get student data
-    c.execute('SELECT * FROM student WHERE id = ?', (session['student_id'],))
-    student_data = c.fetchone()
-    
-    # Get notifications
-    c.execute('SELECT * FROM notifications WHERE student_id = ? ORDER BY created_at DESC LIMIT 5',
-              (session['student_id'],))
-    notifications = [
-        {
-            'title': row[2],
-            'message': row[3],
-            'type': row[4],
-            'created_at': datetime.strptime(row[5], '%Y-%m-%d %H:%M:%S').strftime('%b %d, %Y')
-        }
-        for row in c.fetchall()
-    ]
-    
-    # Get upcoming assignments
-    c.execute('''SELECT * FROM assignments 
-                WHERE class_name = ? 
-                AND due_date >= date('now')
-                ORDER BY due_date ASC LIMIT 5''',
-              (student_data[3],))
-    assignments = [
-        {
-            'title': row[1],
-            'description': row[2],
-            'due_date': datetime.strptime(row[3], '%Y-%m-%d').strftime('%b %d, %Y'),
-            'subject': row[4]
-        }
-        for row in c.fetchall()
-    ]
-    
-    conn.close()
+    student_data = current_student()
     
     if student_data:
+        conn = get_db()
+        # Notifications, class assignments and the unread count in one query,
+        # cached until a broadcast, assignment or read receipt reaches them
+        feed = cache.cached(cache.feed_key(student_data.id), lambda: dashboard_feed(conn, student_data.id))
+        fee_summary = fees_ledger.get_fee_summary(conn, student_data.id, student_data.class_name)
         student = {
-            'id': student_data[0],
-            'name': student_data[1],
-            'roll_no': student_data[2],
-            'class_name': student_data[3],
-            'section': student_data[4],
-            'email': student_data[5],
-            'profile_pic': student_data[7] or 'images/profile-placeholder.jpg',
+            'id': student_data.id,
+            'name': student_data.name,
+            'roll_no': student_data.roll_number,
+            'class_name': student_data.class_name,
+            'section': student_data.section,
+            'email': student_data.email,
+            'profile_pic': student_data.profile_pic_or_placeholder,
+            'profile_pic_srcset': images.profile_srcset(student_data.profile_pic),
             'attendance': 92,  # Sample attendance percentage
-            'fees_paid': 45000,  # Sample fees paid
-            'total_fees': 60000,  # Sample total fees
+            'fees_paid': fee_summary['paid_fees'],
+            'total_fees': fee_summary['total_fees'],
         }
         
         # Add dashboard data
         context = {
             'student': student,
+            'notifications': feed['notifications'],
+            'unread_notifications': feed['unread'],
+            'assignments': feed['assignments'],
             'upcoming_tests': [
                 {
-                    'date': datetime.now() + timedelta(days=i*3),
-                    'subject': f'Subject {i+1}',
-                    'topic': f'Topic {i+1}'
+                    'date': datetime.strptime(paper['date'], '%Y-%m-%d'),
+                    'subject': paper['subject'],
+                    'topic': paper['topic']
                 }
-                for i in range(3)
+                for paper in timetable.upcoming_exams(class_schedule(student_data))
             ],
-            'recent_activities': [
-                {
-                    'icon': 'fas fa-book',
-                    'title': 'Assignment Submitted',
-                    'description': 'Mathematics Assignment',
-                    'time': '2 hours ago'
-                },
-                {
-                    'icon': 'fas fa-trophy',
-                    'title': 'Achievement Unlocked',
-                    'description': 'Perfect Attendance This Week',
-                    'time': '1 day ago'
-                },
-                {
-                    'icon': 'fas fa-chart-line',
-                    'title': 'Test Score',
-                    'description': 'Scored 95% in Science Test',
-                    'time': '2 days ago'
-                }
-            ]
+            'recent_activities': activity.recent_activities(student_data.id)
         }
         
         return render_template('student_dashboard.html', **context)
@@ -253,9 +504,14 @@ def student_logout():
     session.clear()  # Clear all session data
     return redirect(url_for('index'))
 
+# Uploads are async views: parsing the form and saving the file run on the
+# async pool, so under ASGI the body arrives without holding a thread
 @app.route('/upload_profile_pic', methods=['POST'])
 @login_required
-def upload_profile_pic():
+async def upload_profile_pic():
+    return await aio.run_sync(_upload_profile_pic)
+
+def _upload_profile_pic():
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -264,38 +520,40 @@ def upload_profile_pic():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
-        # Create upload folder if it doesn't exist
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        student_id = session['student_id']
         
-        # Get student info from database
-        conn = sqlite3.connect('school.db')
-        c = conn.cursor()
-        c.execute('SELECT roll_number FROM student WHERE id = ?', (session['student_id'],))
-        student_data = c.fetchone()
-        
-        if student_data:
-            # Create unique filename
-            filename = f"profile_{student_data[0]}_{secure_filename(file.filename)}"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            
-            # Save file
-            file.save(filepath)
+        if current_student():
+            # Point the student at the new picture once its thumbnails exist
+            def set_profile_pic(profile_pic):
+                conn = get_db()
+                conn.execute('UPDATE student SET profile_pic = ? WHERE id = ?', (profile_pic, student_id))
+                conn.commit()
+                cache.invalidate_student(student_id)
             
-            # Update student profile pic in database
-            profile_pic = f'images/profile_pics/{filename}'
-            c.execute('UPDATE student SET profile_pic = ? WHERE id = ?', (profile_pic, session['student_id']))
-            conn.commit()
-            conn.close()
+            try:
+                dest_dir = os.path.join(tenants.current_tenant().static_folder, 'images/profile_pics')
+                upload = images.process_upload(file, dest_dir, 'images/profile_pics', set_profile_pic)
+            except images.UploadTooLarge:
+                return jsonify({'error': 'File is too large'}), 413
+            except images.InvalidImage:
+                return jsonify({'error': 'Invalid image file'}), 400
             
+            activity.record(student_id, 'profile_pic', 'New profile picture uploaded')
             return jsonify({
                 'success': True,
-                'image_url': url_for('static', filename=f'images/profile_pics/{filename}')
+                'processing': not upload.ready,
+                'status_url': url_for('upload_status', digest=upload.digest),
+                'image_url': url_for('static', filename=upload.path)
             })
     
     return jsonify({'error': 'Invalid file type'}), 400
 
 @app.route('/upload_profile', methods=['POST'])
-def upload_profile():
+@login_required
+async def upload_profile():
+    return await aio.run_sync(_upload_profile)
+
+def _upload_profile():
     if 'profile_pic' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -304,153 +562,224 @@ def upload_profile():
         return jsonify({'error': 'No selected file'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        # Add timestamp to filename to make it unique
-        filename = f"{int(time.time())}_{filename}"
-        file_path = os.path.join('static/uploads/profiles', filename)
-        file.save(file_path)
+        student_id = session['student_id']
         
-        # Update student profile picture in database
-        student_id = session.get('student_id')
-        if student_id:
-            conn = sqlite3.connect('school.db')
-            c = conn.cursor()
-            c.execute("UPDATE student SET profile_pic = ? WHERE id = ?", 
-                     (f'uploads/profiles/{filename}', student_id))
+        # Update student profile picture in database once it is processed
+        def set_profile_pic(profile_pic):
+            conn = get_db()
+            conn.execute("UPDATE student SET profile_pic = ? WHERE id = ?", 
+                         (profile_pic, student_id))
             conn.commit()
-            conn.close()
-            
-        return jsonify({'success': True, 'filename': filename}), 200
+            cache.invalidate_student(student_id)
+        
+        try:
+            dest_dir = os.path.join(tenants.current_tenant().static_folder, 'uploads/profiles')
+            upload = images.process_upload(file, dest_dir, 'uploads/profiles', set_profile_pic)
+        except images.UploadTooLarge:
+            return jsonify({'error': 'File is too large'}), 413
+        except images.InvalidImage:
+            return jsonify({'error': 'Invalid image file'}), 400
+        
+        activity.record(student_id, 'profile_pic', 'New profile picture uploaded')
+        filename = os.path.basename(upload.path)
+        return jsonify({'success': True, 'processing': not upload.ready, 'filename': filename,
+                        'status_url': url_for('upload_status', digest=upload.digest)}), 200
     
     return jsonify({'error': 'File type not allowed'}), 400
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({'error': 'File is too large'}), 413
+
+# Poll after an upload answered processing: true. 'failed' means the image
+# could not be processed and the old picture stays.
+@app.route('/upload_status/<digest>')
+def upload_status(digest):
+    if not re.fullmatch(r'[0-9a-f]{32}', digest):
+        return jsonify({'error': 'Unknown upload'}), 404
+    static_folder = tenants.current_tenant().static_folder
+    statuses = {images.upload_status(os.path.join(static_folder, folder), digest)
+                for folder in PROFILE_UPLOAD_DIRS}
+    status = next(s for s in ('ready', 'failed', 'processing') if s in statuses)
+    return jsonify({'status': status})
+
 @app.route('/about')
 def about():
-    return render_template('about.html')
+    return static_page('about.html')
 
 @app.route('/gallery')
 def gallery():
-    return render_template('gallery.html')
+    return static_page('gallery.html')
 
 @app.route('/events')
 def events():
-    return render_template('events.html')
+    return static_page('events.html')
 
 @app.route('/announcements')
 def announcements():
-    return render_template('announcements.html')
+    return static_page('announcements.html')
 
 @app.route('/contact')
 def contact():
-    return render_template('contact.html')
+    return static_page('contact.html')
 
 @app.route('/fees')
 @login_required
 def fees():
-    conn = sqlite3.connect('school.db')
-    c = conn.cursor()
+    student_data = current_student()
     
-    # Get student data
-    c.execute('SELECT * FROM student WHERE id = ?', (session['student_id'],))
-    student_data = c.fetchone()
+    conn = get_db()
+    payment_history, next_cursor = fees_ledger.payment_page(conn, student_data.id)
     
-    # Sample fees data (in a real app, this would come from the database)
     fees_data = {
         'student': {
-            'name': student_data[1],
-            'class': student_data[3],
-            'section': student_data[4],
-            'roll_number': student_data[2]
+            'name': student_data.name,
+            'class': student_data.class_name,
+            'section': student_data.section,
+            'roll_number': student_data.roll_number
         },
-        'current_year': '2024-2025',
-        'total_fees': 50000,
-        'paid_fees': 30000,
-        'pending_fees': 20000,
-        'due_date': (datetime.now() + timedelta(days=15)).strftime('%Y-%m-%d'),
-        'payment_history': [
-            {
-                'date': (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d'),
-                'amount': 15000,
-                'receipt_no': 'REC001',
-                'mode': 'Online',
-                'status': 'Paid'
-            },
-            {
-                'date': (datetime.now() - timedelta(days=120)).strftime('%Y-%m-%d'),
-                'amount': 15000,
-                'receipt_no': 'REC002',
-                'mode': 'Bank Transfer',
-                'status': 'Paid'
-            }
-        ],
-        'fee_structure': [
-            {'type': 'Tuition Fee', 'amount': 30000},
-            {'type': 'Development Fee', 'amount': 10000},
-            {'type': 'Library Fee', 'amount': 5000},
-            {'type': 'Computer Lab Fee', 'amount': 5000}
-        ]
+        'payment_history': payment_history,
+        'payment_history_next': next_cursor,
+        **fees_ledger.get_fee_summary(conn, student_data.id, student_data.class_name)
     }
     
-    conn.close()
     return render_template('fees.html', fees=fees_data)
 
+@app.route('/api/fees/payments')
+@login_required
+def fee_payments():
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', fees_ledger.PAGE_SIZE, type=int), 100)
+    payments, next_cursor = fees_ledger.payment_page(get_db(), session['student_id'], before, limit)
+    return jsonify({'payments': payments, 'next_cursor': next_cursor})
+
+@app.route('/api/notifications')
+@login_required
+async def notification_list():
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', notifications.PAGE_SIZE, type=int), 100)
+    student_id = session['student_id']
+
+    def fetch():
+        conn = get_db()
+        items, next_cursor = notifications.notification_page(conn, student_id, before, limit)
+        return items, next_cursor, notifications.unread_count(conn, student_id)
+
+    items, next_cursor, unread = await aio.run_sync(fetch)
+    return jsonify({'notifications': items, 'next_cursor': next_cursor, 'unread': unread})
+
+@app.route('/api/notifications/read', methods=['POST'])
+@login_required
+async def notification_read():
+    data = await aio.run_sync(request.get_json, silent=True) or {}
+    message_ids = data.get('ids')
+    if message_ids is not None:
+        try:
+            message_ids = [int(message_id) for message_id in message_ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ids must be a list of notification ids'}), 400
+    student_id = session['student_id']
+
+    def mark():
+        conn = get_db()
+        return notifications.mark_read(conn, student_id, message_ids), notifications.unread_count(conn, student_id)
+
+    changed, unread = await aio.run_sync(mark)
+    if changed:
+        cache.invalidate_feeds(student_id)
+    return jsonify({'marked': changed, 'unread': unread})
+
+# Full-text search over the student's notifications and class assignments:
+# ?q=...&kind=notification|assignment&limit=&cursor=, best match first
+@app.route('/api/search')
+@login_required
+def api_search():
+    student = current_student()
+    if student is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    kind = request.args.get('kind') or None
+    if kind is not None and kind not in search.KINDS:
+        return jsonify({'error': 'kind must be notification or assignment'}), 400
+    limit = max(1, min(request.args.get('limit', search.PAGE_SIZE, type=int), 100))
+    try:
+        items, next_cursor = search.search(get_db(), student.id, student.class_name, request.args.get('q', ''),
+                                           kind, request.args.get('cursor'), limit)
+    except search.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'results': items, 'next_cursor': next_cursor})
+
+@app.route('/api/search/suggest')
+@login_required
+def api_search_suggest():
+    student = current_student()
+    if student is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    return jsonify({'suggestions': search.suggest(get_db(), student.id, student.class_name,
+                                                  request.args.get('q', ''))})
+
+# Live updates for the dashboard and attendance pages: new notifications,
+# assignments for the student's class and attendance changes
+# Everything but the stream belongs on the threaded workers, where it can't
+# stall the gevent hub
+@app.before_request
+def only_event_streams():
+    if app.config['SERVE_ONLY_EVENTS'] and request.endpoint != 'event_stream':
+        return jsonify({'error': 'Not found'}), 404
+
+@app.route('/api/events')
+@login_required
+def event_stream():
+    student_data = current_student()
+    if not student_data:
+        return jsonify({'error': 'Unknown student'}), 404
+    
+    broker = pubsub.get_broker()
+    subscription = broker.subscribe([pubsub.school_channel(),
+                                      pubsub.class_channel(student_data.class_name),
+                                      pubsub.student_channel(student_data.id)])
+    if subscription is None:
+        return jsonify({'error': 'Too many open streams'}), 503, {'Retry-After': '30'}
+    
+    body = pubsub.stream(broker, subscription, app.config['EVENTS_HEARTBEAT'])
+    return Response(body, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # don't let nginx buffer the stream
+    })
+
 @app.route('/attendance')
 @login_required
 def attendance():
     return render_template('attendance.html')
 
+# Precomputed by the ranking job, so a miss is a couple of key lookups.
+# Mark edits drop the whole class, since ranks move for everyone.
+def student_results(student_id):
+    return cache.cached(cache.results_key(student_id),
+                        lambda: grades.get_student_results(get_db(), student_id))
+
 @app.route('/results')
 @login_required
 def results():
-    # Use direct SQL query
-    conn = sqlite3.connect('school.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM student WHERE id = ?', (session['student_id'],))
-    student_data = c.fetchone()
-    conn.close()
+    student_data = current_student()
     
     if student_data:
         student = {
-            'id': student_data[0],
-            'name': student_data[1],
-            'roll_number': student_data[2],
-            'class_name': student_data[3],
-            'section': student_data[4]
+            'id': student_data.id,
+            'name': student_data.name,
+            'roll_number': student_data.roll_number,
+            'class_name': student_data.class_name,
+            'section': student_data.section
         }
         
-        # Add dummy results data
+        result = student_results(student_data.id)
         context = {
             'student': student,
-            'results': [
-                {
-                    'subject': 'Mathematics',
-                    'marks_obtained': 92,
-                    'total_marks': 100,
-                    'grade': 'A+'
-                },
-                {
-                    'subject': 'Science',
-                    'marks_obtained': 88,
-                    'total_marks': 100,
-                    'grade': 'A'
-                },
-                {
-                    'subject': 'English',
-                    'marks_obtained': 90,
-                    'total_marks': 100,
-                    'grade': 'A+'
-                },
-                {
-                    'subject': 'Social Studies',
-                    'marks_obtained': 85,
-                    'total_marks': 100,
-                    'grade': 'A'
-                }
-            ],
-            'total_marks': 355,
-            'percentage': 88.75,
-            'grade': 'A',
-            'rank': 5
+            'exam': result['exam'] if result else None,
+            'results': result['subjects'] if result else [],
+            'total_marks': result['total_marks'] if result else 0,
+            'percentage': result['percentage'] if result else 0,
+            'grade': result['grade'] if result else None,
+            'rank': result['rank'] if result else None
         }
         return render_template('results.html', **context)
     return redirect(url_for('student_login'))
@@ -458,19 +787,16 @@ def results():
 @app.route('/analysis')
 @login_required
 def analysis():
-    conn = sqlite3.connect('school.db')
-    c = conn.cursor()
+    student_data = current_student()
     
-    # Get student data
-    c.execute('SELECT * FROM student WHERE id = ?', (session['student_id'],))
-    student_data = c.fetchone()
+    result = student_results(student_data.id)
     
-    # Sample analysis data (in a real app, this would come from the database)
+    # Attendance figures are still sample data
     analysis_data = {
         'student': {
-            'name': student_data[1],
-            'class': student_data[3],
-            'section': student_data[4]
+            'name': student_data.name,
+            'class': student_data.class_name,
+            'section': student_data.section
         },
         'attendance': {
             'present': 85,
@@ -484,31 +810,51 @@ def analysis():
             ]
         },
         'academics': {
-            'overall_grade': 'A',
-            'percentage': 85.5,
+            'overall_grade': result['grade'] if result else None,
+            'percentage': result['percentage'] if result else 0,
             'subjects': [
-                {'name': 'Mathematics', 'marks': 92, 'grade': 'A+'},
-                {'name': 'Science', 'marks': 88, 'grade': 'A'},
-                {'name': 'English', 'marks': 85, 'grade': 'A'},
-                {'name': 'Social Studies', 'marks': 82, 'grade': 'A-'},
-                {'name': 'Computer Science', 'marks': 95, 'grade': 'A+'}
+                {'name': row['subject'], 'marks': row['marks_obtained'], 'grade': row['grade']}
+                for row in (result['subjects'] if result else [])
             ]
         },
         'performance': {
-            'class_rank': 5,
-            'total_students': 50,
-            'percentile': 90,
-            'improvement': '+5%'
+            'class_rank': result['rank'] if result else None,
+            'total_students': result['class_size'] if result else 0,
+            'percentile': result['percentile'] if result else None,
+            'improvement': f"{result['improvement']:+g}%" if result and result['improvement'] is not None else None
         }
     }
     
-    conn.close()
     return render_template('analysis.html', analysis=analysis_data)
 
+# The compiled week and date sheet of the student's class, one key lookup
+def class_schedule(student):
+    return cache.cached(cache.schedule_key(student.class_name, student.section),
+                        lambda: timetable.get_schedule(get_db(), student.class_name, student.section))
+
 @app.route('/routine')
 @login_required
 def routine():
-    return render_template('routine.html')
+    student = current_student()
+    if student is None:
+        return redirect(url_for('student_login'))
+    schedule = class_schedule(student)
+    return render_template('routine.html', student=student, week=schedule['week'],
+                           exams=timetable.upcoming_exams(schedule, limit=None))
+
+@app.route('/routine.ics')
+@login_required
+def routine_ical():
+    student = current_student()
+    if student is None:
+        return redirect(url_for('student_login'))
+    tenant = tenants.current_tenant()
+    uid_domain = tenant.hosts[0] if tenant.hosts else f'{tenant.slug}.school'
+    body = timetable.to_ical(class_schedule(student), student.class_name, student.section,
+                             tenant.name, uid_domain)
+    return Response(body, mimetype='text/calendar', headers={
+        'Content-Disposition': f'attachment; filename="routine-{student.class_name}-{student.section}.ics"'
+    })
 
 @app.route('/syllabus')
 @login_required
@@ -522,11 +868,11 @@ def documents():
 
 @app.route('/leadership')
 def leadership():
-    return render_template('leadership.html')
+    return static_page('leadership.html')
 
 @app.route('/students')
 def students():
-    return render_template('students.html')
+    return static_page('students.html')
 
 @app.route('/teacher/login', methods=['GET', 'POST'])
 def teacher_login():
@@ -536,6 +882,7 @@ def teacher_login():
         
         # For demo, use hardcoded teacher credentials
         if email == "teacher@example.com" and password == "teacher123":
+            regenerate_session()
             session['teacher_id'] = 1
             session['is_teacher'] = True
             flash('Welcome back, Teacher!', 'success')
@@ -552,6 +899,110 @@ def teacher_dashboard():
         return redirect(url_for('teacher_login'))
     return render_template('teacher_dashboard.html')
 
+@app.route('/teacher/marks', methods=['POST'])
+def teacher_update_mark():
+    if 'teacher_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        exam_id = int(data['exam_id'])
+        student_id = int(data['student_id'])
+        subject = str(data['subject'])
+        marks_obtained = int(data['marks_obtained'])
+        total_marks = int(data.get('total_marks', 100))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'exam_id, student_id, subject and marks_obtained are required'}), 400
+    if not 0 <= marks_obtained <= total_marks:
+        return jsonify({'error': 'marks_obtained must be between 0 and total_marks'}), 400
+    
+    conn = get_db()
+    # Marks only go into the ranking of the student's own class
+    row = conn.execute('''SELECT e.class_name, s.id, s.class_name FROM exam e
+                          LEFT JOIN student s ON s.id = ? WHERE e.id = ?''', (student_id, exam_id)).fetchone()
+    if row is None:
+        return jsonify({'error': 'Unknown exam'}), 404
+    exam_class, known_student, student_class = row
+    if known_student is None:
+        return jsonify({'error': 'Unknown student'}), 404
+    if student_class != exam_class:
+        return jsonify({'error': f'Student is not in class {exam_class}'}), 400
+    grades.update_mark(conn, exam_id, student_id, subject, marks_obtained, total_marks)
+    cache.invalidate_results(*class_student_ids(conn, exam_class))
+    activity.record(student_id, 'marks', f'{subject}: {marks_obtained}/{total_marks}')
+    return jsonify({'success': True})
+
+@app.route('/teacher/assignments', methods=['POST'])
+def teacher_add_assignment():
+    if 'teacher_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        title = str(data['title']).strip()
+        subject = str(data['subject']).strip()
+        class_name = str(data['class_name']).strip()
+        due_date = datetime.strptime(str(data['due_date']), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except (KeyError, ValueError):
+        return jsonify({'error': 'title, subject, class_name and due_date (YYYY-MM-DD) are required'}), 400
+    description = str(data.get('description') or '')
+    
+    conn = get_db()
+    with conn:
+        c = conn.execute('''INSERT INTO assignments (title, description, due_date, subject, class_name)
+                            VALUES (?, ?, ?, ?, ?)''', (title, description, due_date, subject, class_name))
+    cache.invalidate_feeds(*class_student_ids(conn, class_name))
+    pubsub.publish(pubsub.class_channel(class_name), 'assignment', {
+        'id': c.lastrowid,
+        'title': title,
+        'description': description,
+        'due_date': datetime.strptime(due_date, '%Y-%m-%d').strftime('%b %d, %Y'),
+        'subject': subject
+    })
+    return jsonify({'success': True, 'id': c.lastrowid})
+
+# Record a whole register at once. JSON:
+#   {"date": "2024-07-01", "subject": "Mathematics", "class_name": "10",
+#    "records": [{"roll_number": "S000001", "status": "present"}, ...]}
+# where each record may carry its own date and subject, or CSV with the
+# columns roll_number,date,subject,status (date, subject and class_name may
+# also come from the query string). All rows are written or none are.
+@app.route('/teacher/attendance/bulk', methods=['POST'])
+def teacher_attendance_bulk():
+    if 'teacher_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    if request.mimetype in ('text/csv', 'application/csv'):
+        defaults = request.args
+        reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+        records = [(row.get('roll_number'), row.get('date') or defaults.get('date'),
+                    row.get('subject') or defaults.get('subject'), row.get('status'))
+                   for row in reader]
+        class_name = defaults.get('class_name')
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('records'), list):
+            return jsonify({'error': 'Send JSON with a records list, or text/csv'}), 400
+        records = [(str(row.get('roll_number') or ''), row.get('date') or data.get('date'),
+                    row.get('subject') or data.get('subject'), row.get('status'))
+                   for row in data['records'] if isinstance(row, dict)]
+        class_name = data.get('class_name')
+    
+    if not records:
+        return jsonify({'error': 'The register is empty'}), 400
+    if len(records) > app.config['ATTENDANCE_REGISTER_MAX_ROWS']:
+        return jsonify({'error': f"At most {app.config['ATTENDANCE_REGISTER_MAX_ROWS']} rows per request"}), 413
+    
+    try:
+        changed = record_register(get_db(), records, class_name)
+    except InvalidRegister as e:
+        return jsonify({'error': 'Nothing was recorded', 'rows': e.errors}), 400
+    
+    cache.invalidate_attendance(*changed)
+    for student_id, dates in changed.items():
+        pubsub.publish(pubsub.student_channel(student_id), 'attendance', {'dates': sorted(dates)})
+    return jsonify({'success': True, 'rows': len(records), 'students': len(changed)})
+
 @app.route('/teacher/logout')
 def teacher_logout():
     session.pop('teacher_id', None)
@@ -567,6 +1018,7 @@ def admin_login():
         
         # For demo, use hardcoded admin credentials
         if email == "admin@example.com" and password == "admin123":
+            regenerate_session()
             session['admin_id'] = 1
             session['is_admin'] = True
             flash('Welcome back, Admin!', 'success')
@@ -583,6 +1035,105 @@ def admin_dashboard():
         return redirect(url_for('admin_login'))
     return render_template('admin_dashboard.html')
 
+@app.route('/admin/notifications', methods=['POST'])
+def admin_broadcast():
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    data = request.get_json(silent=True) or {}
+    title = (data.get('title') or '').strip()
+    message = (data.get('message') or '').strip()
+    if not title or not message:
+        return jsonify({'error': 'title and message are required'}), 400
+    student_ids = data.get('student_ids')
+    if student_ids is not None:
+        try:
+            student_ids = [int(student_id) for student_id in student_ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'student_ids must be a list of student ids'}), 400
+    
+    message_type = data.get('type') or 'info'
+    class_name = data.get('class_name')
+    conn = get_db()
+    message_id, delivered = notifications.broadcast(conn, title, message, message_type,
+                                                    class_name=class_name, student_ids=student_ids)
+    cache.invalidate_feeds(*(student_ids if student_ids is not None else class_student_ids(conn, class_name)))
+    
+    payload = {'id': message_id, 'title': title, 'message': message, 'type': message_type}
+    if student_ids is not None:
+        for student_id in student_ids:
+            pubsub.publish(pubsub.student_channel(student_id), 'notification', payload)
+    elif class_name is not None:
+        pubsub.publish(pubsub.class_channel(class_name), 'notification', payload)
+    else:
+        pubsub.publish(pubsub.school_channel(), 'notification', payload)
+    return jsonify({'success': True, 'id': message_id, 'delivered': delivered})
+
+# Replace a class's weekly timetable:
+#   {"entries": [{"day": 0, "period_id": 1, "subject": "Mathematics",
+#                 "teacher_id": 1, "room_id": 1}, ...]}
+# day 0 is Monday. A teacher or room already booked by another class at an
+# overlapping time is a 409 listing every clash; nothing is saved.
+@app.route('/admin/timetable/<class_name>/<section>', methods=['PUT'])
+def admin_save_timetable(class_name, section):
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    entries = (request.get_json(silent=True) or {}).get('entries')
+    if not isinstance(entries, list):
+        return jsonify({'error': 'entries must be a list'}), 400
+    try:
+        timetable.save_timetable(get_db(), class_name, section, entries)
+    except timetable.TimetableClash as e:
+        return jsonify({'error': 'Timetable clashes', 'clashes': e.clashes}), 409
+    except timetable.InvalidTimetable as e:
+        return jsonify({'error': str(e)}), 400
+    cache.invalidate_schedules((class_name, section))
+    return jsonify({'success': True, 'entries': len(entries)})
+
+# Replace an exam's date sheet:
+#   {"papers": [{"subject": "Science", "date": "2024-11-04", "start": "09:00",
+#                "end": "12:00", "topic": "Chapters 1-5", "room_id": 2}, ...]}
+@app.route('/admin/exams/<int:exam_id>/papers', methods=['PUT'])
+def admin_save_exam_papers(exam_id):
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    papers = (request.get_json(silent=True) or {}).get('papers')
+    if not isinstance(papers, list):
+        return jsonify({'error': 'papers must be a list'}), 400
+    try:
+        compiled = timetable.save_exam_papers(get_db(), exam_id, papers)
+    except timetable.InvalidTimetable as e:
+        return jsonify({'error': str(e)}), 400
+    cache.invalidate_schedules(*compiled)
+    return jsonify({'success': True, 'papers': len(papers)})
+
+# Streamed exports: /admin/reports/<attendance|fees|payments|results>
+# ?format=csv|ndjson&class_name=&section=&from=YYYY-MM-DD&to=YYYY-MM-DD
+@app.route('/admin/reports/<name>')
+def admin_report(name):
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in reports.FORMATS:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    try:
+        body = reports.export(db.get_pool(), name, request.args, fmt)
+    except reports.UnknownReport:
+        return jsonify({'error': 'Unknown report'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    mimetype, extension = reports.FORMATS[fmt]
+    filename = f"{name}-{datetime.now().strftime('%Y%m%d')}.{extension}"
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/admin/logout')
 def admin_logout():
     session.pop('admin_id', None)
@@ -591,82 +1142,65 @@ def admin_logout():
     return redirect(url_for('index'))
 
 @app.route('/get_attendance_data')
-def get_attendance_data():
+async def get_attendance_data():
     if 'student_id' not in session:
         return jsonify({'error': 'Not logged in'}), 401
 
     student_id = session['student_id']
-    conn = sqlite3.connect('school.db')
-    c = conn.cursor()
+    return jsonify(await aio.run_sync(cache.cached, cache.attendance_key(student_id),
+                                      lambda: get_attendance_summary(get_db(), student_id)))
 
-    # Get monthly attendance data
-    c.execute("""
-        SELECT strftime('%m', date) as month,
-               SUM(CASE WHEN status = 'present' THEN 1 ELSE 0 END) as present_count,
-               SUM(CASE WHEN status = 'absent' THEN 1 ELSE 0 END) as absent_count
-        FROM attendance
-        WHERE student_id = ?
-        AND date >= date('now', '-1 year')
-        GROUP BY month
-        ORDER BY month
-    """, (student_id,))
-    
-    monthly_data = c.fetchall()
-    
-    # Get subject-wise attendance
-    c.execute("""
-        SELECT subject,
-               COUNT(*) as total_classes,
-               SUM(CASE WHEN status = 'present' THEN 1 ELSE 0 END) as present_count
-        FROM attendance
-        WHERE student_id = ?
-        GROUP BY subject
-    """, (student_id,))
-    
-    subject_data = c.fetchall()
-    
-    # Get overall attendance
-    c.execute("""
-        SELECT COUNT(*) as total_days,
-               SUM(CASE WHEN status = 'present' THEN 1 ELSE 0 END) as present_days
-        FROM attendance
-        WHERE student_id = ?
-    """, (student_id,))
-    
-    overall_data = c.fetchone()
-    
-    conn.close()
-    
-    # Format the data
-    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    monthly_formatted = {
-        'labels': months,
-        'present': [0] * 12,
-        'absent': [0] * 12
-    }
-    
-    for month, present, absent in monthly_data:
-        month_idx = int(month) - 1
-        monthly_formatted['present'][month_idx] = present
-        monthly_formatted['absent'][month_idx] = absent
-    
-    subject_formatted = [{
-        'subject': subject,
-        'percentage': round((present_count / total_classes) * 100, 1)
-    } for subject, total_classes, present_count in subject_data]
-    
-    total_days, present_days = overall_data
-    attendance_rate = round((present_days / total_days) * 100, 1) if total_days > 0 else 0
-    
-    return jsonify({
-        'monthly': monthly_formatted,
-        'subjects': subject_formatted,
-        'overall': {
-            'total_days': total_days,
-            'present_days': present_days,
-            'attendance_rate': attendance_rate
-        }
-    })
+# Prometheus scrape target
+metrics.get_metrics(app).add_gauge('school_db_pool_in_use', 'Pooled connections checked out.',
+                                   lambda: sum(pool.stats()['in_use'] for pool in db.get_registry(app).pools()))
+metrics.get_metrics(app).add_gauge('school_db_pool_open', 'Pooled connections open.',
+                                   lambda: db.get_registry(app).stats()['connections'])
+metrics.get_metrics(app).add_gauge('school_db_tenant_pools', 'Tenant databases with open pools.',
+                                   lambda: db.get_registry(app).stats()['pools'])
+metrics.get_metrics(app).add_gauge('school_event_streams', 'Open /api/events streams.',
+                                   lambda: pubsub.get_broker(app).stats()['subscribers'])
+
+@app.route('/metrics')
+@metrics_access_required
+def prometheus_metrics():
+    return Response(metrics.get_metrics(app).render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/pool')
+@metrics_access_required
+def pool_metrics():
+    stats = db.get_pool().stats()
+    stats['tenants'] = db.get_registry().stats()
+    return jsonify(stats)
+
+@app.route('/metrics/login')
+@metrics_access_required
+def login_metrics():
+    stats = passwords.get_hashing_pool().stats()
+    stats['throttled'] = {name: throttle.throttled
+                          for name, throttle in app.extensions['login_throttles'].items()}
+    return jsonify(stats)
+
+@app.route('/metrics/sessions')
+@metrics_access_required
+def session_metrics():
+    if not hasattr(app.session_interface, 'stats'):
+        return jsonify({'backend': 'cookie'})
+    return jsonify(app.session_interface.stats())
+
+@app.route('/metrics/events')
+@metrics_access_required
+def event_metrics():
+    return jsonify(pubsub.get_broker(app).stats())
+
+@app.route('/metrics/activity')
+@metrics_access_required
+def activity_metrics():
+    return jsonify(activity.get_log(app).stats())
+
+@app.route('/metrics/cache')
+@metrics_access_required
+def cache_metrics():
+    return jsonify(cache.get_cache(app).stats())
 
 if __name__ == '__main__':
     app.run(debug=True)
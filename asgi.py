@@ -0,0 +1,63 @@
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import app
+
+# ASGI entry point, e.g.
+#
+#   uvicorn asgi:application --workers 4
+#
+# The server reads each request body on its event loop before the app sees
+# it, so a phone uploading a photo over a slow connection no longer holds a
+# worker thread for the whole upload. Sync views then run on the loop's
+# thread pool and async views on the loop itself (see aio.py). Keep
+# /api/events on the gevent worker: a stream pins one of the pool's threads
+# for as long as it is open.
+
+
+class _Instance(WsgiToAsgiInstance):
+    # asgiref runs every request on one shared thread (thread_sensitive).
+    # Flask keeps request state in contextvars, so requests can run side by
+    # side on the loop's default executor instead. __call__ reads the body
+    # and awaits run_wsgi_app(body); this serves it the way asgiref does,
+    # through build_environ, start_response and sync_send.
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._serve, thread_sensitive=False)(body)
+
+    def _serve(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:  # too many duplicate headers
+            self.sync_send({'type': 'http.response.start', 'status': 400,
+                            'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request'})
+            return
+        bytes_sent = 0
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in response:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                # Never send more than the Content-Length the app declared
+                if self.response_content_length is not None:
+                    output = output[:self.response_content_length - bytes_sent]
+                self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+                bytes_sent += len(output)
+                if bytes_sent == self.response_content_length:
+                    break
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class _WsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _Instance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+application = _WsgiToAsgi(app)
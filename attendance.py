@@ -0,0 +1,188 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+
+import queries
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+# attendance_summary is kept current by triggers on attendance (migration 3).
+# These rebuild it from the raw rows, for backfills or after bulk loads.
+REBUILD_SUMMARY = '''
+    INSERT INTO attendance_summary (student_id, month, subject, present_count, absent_count)
+    SELECT student_id, strftime('%Y-%m', date), subject,
+           SUM(status = 'present'), SUM(status = 'absent')
+    FROM attendance
+    {where}
+    GROUP BY student_id, strftime('%Y-%m', date), subject
+'''
+
+
+def rebuild_summary(conn, student_id=None):
+    if student_id is None:
+        conn.execute('DELETE FROM attendance_summary')
+        conn.execute(REBUILD_SUMMARY.format(where=''))
+    else:
+        rebuild_students(conn, [student_id])
+
+
+# Rebuild for a set of students, a few hundred ids per statement
+def rebuild_students(conn, student_ids, chunk_size=500):
+    student_ids = list(student_ids)
+    for i in range(0, len(student_ids), chunk_size):
+        ids = json.dumps(student_ids[i:i + chunk_size])
+        in_ids = 'student_id IN (SELECT value FROM json_each(?))'
+        conn.execute(f'DELETE FROM attendance_summary WHERE {in_ids}', (ids,))
+        conn.execute(REBUILD_SUMMARY.format(where=f'WHERE {in_ids}'), (ids,))
+
+
+# Above this many touched students a full rebuild beats per-student ones
+FULL_REBUILD_THRESHOLD = 1000
+
+# One mark per student, date and subject (unique since migration 8); entering
+# a register again corrects it rather than duplicating it
+UPSERT_ATTENDANCE = '''INSERT INTO attendance (student_id, date, subject, status)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT (student_id, date, subject) DO UPDATE SET status = excluded.status
+                       WHERE status != excluded.status'''
+
+
+# Offline bulk loads (init_db seeding and CSV imports). Runs the caller's
+# inserts in one IMMEDIATE transaction with the rollup triggers dropped, then
+# rebuilds the rollup once for the student ids the caller added to the
+# yielded set. Triggers are restored before commit, so other connections
+# never see them missing. Not for the request path: the DDL costs more than
+# the triggers save on anything register-sized, and every schema change
+# invalidates the pooled connections' statement caches.
+@contextmanager
+def bulk_attendance_write(conn):
+    touched = set()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        triggers = conn.execute('''SELECT name, sql FROM sqlite_master
+                                   WHERE type = 'trigger' AND tbl_name = 'attendance'
+                                   AND name LIKE 'attendance_summary_%' ''').fetchall()
+        for name, _ in triggers:
+            conn.execute(f'DROP TRIGGER {name}')
+
+        yield touched
+
+        if len(touched) > FULL_REBUILD_THRESHOLD:
+            rebuild_summary(conn)
+        elif touched:
+            rebuild_students(conn, touched)
+        for _, sql in triggers:
+            conn.execute(sql)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+# Monthly, subject-wise and overall attendance for one student, all from a
+# single read of the rollup (one row per month and subject).
+def get_attendance_summary(conn, student_id):
+    rows = conn.execute(queries.ATTENDANCE_SUMMARY, (student_id,)).fetchall()
+    first_month = conn.execute("SELECT strftime('%Y-%m', 'now', '-11 months')").fetchone()[0]
+
+    monthly = {
+        'labels': MONTHS,
+        'present': [0] * 12,
+        'absent': [0] * 12
+    }
+    subjects = {}
+    total_days = present_days = 0
+
+    for month, subject, present, absent in rows:
+        if month >= first_month:
+            month_idx = int(month[5:7]) - 1
+            monthly['present'][month_idx] += present
+            monthly['absent'][month_idx] += absent
+
+        subject_present, subject_total = subjects.get(subject, (0, 0))
+        subjects[subject] = (subject_present + present, subject_total + present + absent)
+
+        present_days += present
+        total_days += present + absent
+
+    subject_formatted = [{
+        'subject': subject,
+        'percentage': round((present / total) * 100, 1)
+    } for subject, (present, total) in sorted(subjects.items()) if total]
+
+    attendance_rate = round((present_days / total_days) * 100, 1) if total_days > 0 else 0
+
+    return {
+        'monthly': monthly,
+        'subjects': subject_formatted,
+        'overall': {
+            'total_days': total_days,
+            'present_days': present_days,
+            'attendance_rate': attendance_rate
+        }
+    }
+
+
+class InvalidRegister(ValueError):
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} invalid row(s)')
+        self.errors = errors
+
+
+# Write a class register of (roll_number, date, subject, status) rows. Roll
+# numbers are resolved in one query, and if any row is invalid nothing is
+# written. Returns {student_id: set of dates} for what was recorded.
+def record_register(conn, records, class_name=None, max_errors=50):
+    errors = []
+    rows = []
+    for line, (roll_number, date, subject, status) in enumerate(records, start=1):
+        roll_number = (roll_number or '').strip()
+        subject = (subject or '').strip()
+        status = (status or '').strip().lower()
+        try:
+            date = datetime.strptime((date or '').strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            errors.append({'row': line, 'error': 'date must be YYYY-MM-DD'})
+        else:
+            if not roll_number or not subject:
+                errors.append({'row': line, 'error': 'roll_number and subject are required'})
+            elif status not in ('present', 'absent'):
+                errors.append({'row': line, 'error': "status must be 'present' or 'absent'"})
+            else:
+                rows.append((line, roll_number, date, subject, status))
+        if len(errors) >= max_errors:
+            break
+    if errors:
+        raise InvalidRegister(errors)
+
+    roll_numbers = json.dumps(sorted({row[1] for row in rows}))
+    students = {roll_number: (student_id, student_class)
+                for roll_number, student_id, student_class in conn.execute(
+                    '''SELECT roll_number, id, class_name FROM student
+                       WHERE roll_number IN (SELECT value FROM json_each(?))''', (roll_numbers,))}
+
+    params = []
+    changed = {}
+    for line, roll_number, date, subject, status in rows:
+        student = students.get(roll_number)
+        if student is None:
+            errors.append({'row': line, 'error': f'unknown roll number {roll_number}'})
+        elif class_name is not None and student[1] != class_name:
+            errors.append({'row': line, 'error': f'{roll_number} is not in class {class_name}'})
+        else:
+            params.append((student[0], date, subject, status))
+            changed.setdefault(student[0], set()).add(date)
+        if len(errors) >= max_errors:
+            break
+    if errors:
+        raise InvalidRegister(errors)
+
+    # The rollup triggers keep attendance_summary current row by row
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany(UPSERT_ATTENDANCE, params)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return changed
@@ -0,0 +1,619 @@
+import argparse
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _fill_attendance(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO attendance (student_id, date, subject, status) VALUES (?, date('now', ?), 'Mathematics', 'present')",
+        ((i // 365 + 1, f'-{i % 365} days') for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def _count_attendance(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM attendance').fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Worker cold start: time a fresh interpreter importing app.py against
+# databases of growing size. The time should stay flat and no rows should
+# disappear across boots.
+def bench_startup(args):
+    env = dict(os.environ)
+    print(f"{'rows':>10} {'median ms':>10} {'max ms':>10} {'kept':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = os.path.join(tmp, f'startup_{rows}.db')
+            env['SCHOOL_DB'] = path
+            subprocess.run([sys.executable, '-c', 'import app'], cwd=BASE_DIR, env=env, check=True)
+            _fill_attendance(path, rows)
+
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, '-c', 'import app'], cwd=BASE_DIR, env=env, check=True)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            kept = _count_attendance(path) == rows
+            print(f"{rows:>10} {statistics.median(timings):>10.1f} {max(timings):>10.1f} {str(kept):>6}")
+
+
+# Password verification throughput of the hashing pool for different worker
+# counts, driven by as many concurrent clients as a busy login morning
+def bench_login(args):
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.security import check_password_hash, generate_password_hash
+    from passwords import HashingPool
+
+    pwhash = generate_password_hash('password123', args.method)
+    print(f"{'workers':>8} {'logins/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for workers in args.workers:
+        pool = HashingPool(workers=workers, max_queue=args.logins, timeout=600)
+
+        def login(_):
+            start = time.perf_counter()
+            pool.run(check_password_hash, pwhash, 'password123')
+            return (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.clients) as clients:
+            latencies = sorted(clients.map(login, range(args.logins)))
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{workers:>8} {args.logins / elapsed:>10.1f} {statistics.median(latencies):>8.1f} {p95:>8.1f}")
+
+
+# The original per-pixel gradient, kept only as the benchmark baseline
+def _legacy_gradient(width, height):
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(image)
+    for y in range(height):
+        r = int((y / height) * 0)
+        g = int((y / height) * 100)
+        b = int((y / height) * 255)
+        for x in range(width):
+            draw.point((x, y), fill=(r, g, b))
+    return image
+
+
+def bench_placeholders(args):
+    from setup_images import generate_placeholders, gradient_background
+
+    print(f"{'size':>10} {'legacy ms':>10} {'new ms':>8} {'same':>5}")
+    for width, height in ((32, 32), (200, 200), (300, 400), (400, 500)):
+        start = time.perf_counter()
+        legacy = _legacy_gradient(width, height)
+        legacy_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        new = gradient_background(width, height)
+        new_ms = (time.perf_counter() - start) * 1000
+        print(f"{f'{width}x{height}':>10} {legacy_ms:>10.1f} {new_ms:>8.2f} {str(legacy.tobytes() == new.tobytes()):>5}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        specs = [(os.path.join(tmp, f'p{i}.jpg'), 400, 500, f'P{i}') for i in range(args.count)]
+        manifest = os.path.join(tmp, 'manifest.json')
+        for label in ('cold', 'warm'):
+            start = time.perf_counter()
+            created = generate_placeholders(specs, manifest)
+            print(f"{label} run: {created} generated in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+# Per-request cost of each session backend: a route that reads the session,
+# one that writes it, and a public route that never touches it
+def bench_sessions(args):
+    from flask import Flask, session
+    import db
+    import migrations
+    import sessions
+    import tenants
+
+    print(f"{'backend':>16} {'read us':>9} {'write us':>9} {'public us':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend, cache_ttl in (('cookie', 0), ('sqlite', 0), ('sqlite', 5)):
+            app = Flask(__name__)
+            app.secret_key = 'bench'
+            app.config.update(DATABASE=os.path.join(tmp, f'{backend}{cache_ttl}.db'),
+                              SESSION_BACKEND=backend, SESSION_CACHE_TTL=cache_ttl)
+            tenants.init_app(app)
+            db.init_app(app)
+            sessions.init_app(app)
+            conn = sqlite3.connect(app.config['DATABASE'])
+            migrations.migrate(conn)
+            conn.close()
+
+            @app.route('/read')
+            def read():
+                return str(session.get('student_id'))
+
+            @app.route('/write')
+            def write():
+                session['counter'] = session.get('counter', 0) + 1
+                return 'ok'
+
+            @app.route('/public')
+            def public():
+                return 'ok'
+
+            client = app.test_client()
+            client.get('/write')
+            timings = {}
+            for path in ('/read', '/write', '/public'):
+                start = time.perf_counter()
+                for _ in range(args.requests):
+                    client.get(path)
+                timings[path] = (time.perf_counter() - start) / args.requests * 1e6
+            label = backend if backend == 'cookie' else f'{backend} ttl={cache_ttl}'
+            print(f"{label:>16} {timings['/read']:>9.1f} {timings['/write']:>9.1f} {timings['/public']:>10.1f}")
+
+
+# Thousands of idle /api/events streams held open over HTTP by the
+# events server (gunicorn_events.conf.py: one gevent worker). Students log in,
+# each opens several streams (tabs and phones) and leaves them idle; the
+# bench reports the worker's memory per open stream, checks heartbeats keep
+# flowing, and times how long an admin broadcast takes to reach every stream.
+# Needs Linux (/proc) and the packages in requirements.txt.
+def bench_events(args):
+    import asyncio
+    import json
+    import loadtest
+
+    def worker_pids(pid):
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+
+    async def open_stream(cookie, opened, received, heartbeats):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET /api/events HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n'
+                     f'Accept: text/event-stream\r\n\r\n'.encode())
+        status = await reader.readline()
+        if b' 200 ' not in status:
+            raise RuntimeError(f'/api/events answered {status.decode().strip()}')
+        while await reader.readline() not in (b'\r\n', b''):
+            pass
+        event = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'retry:'):
+                opened.release()
+            elif line.startswith(b': keepalive'):
+                heartbeats[0] += 1
+            elif line.startswith(b'event: '):
+                event = line[7:].strip()
+            elif line.startswith(b'data: ') and event == b'notification':
+                received.setdefault(json.loads(line[6:])['id'], []).append(time.perf_counter())
+
+    def admin_login():
+        admin = loadtest.User('127.0.0.1', port, None)
+        admin.request('POST', '/admin/login', 'email=admin%40example.com&password=admin123',
+                      {'Content-Type': 'application/x-www-form-urlencoded'})
+        return admin
+
+    async def run():
+        opened = asyncio.Semaphore(0)
+        received = {}
+        heartbeats = [0]
+        tasks = []
+        # Connect in waves so the listen backlog never overflows
+        for n in range(args.clients):
+            tasks.append(asyncio.create_task(
+                open_stream(cookies[n % len(cookies)], opened, received, heartbeats)))
+            if n % 200 == 199:
+                for _ in range(200):
+                    await asyncio.wait_for(opened.acquire(), 60)
+        for _ in range(args.clients % 200):
+            await asyncio.wait_for(opened.acquire(), 60)
+        rss = sum(_anon_rss_kb(pid) for pid in worker_pids(process.pid))
+        print(f"{args.clients} idle streams open, worker heap {rss / 1024:.0f} MB "
+              f"({(rss - idle_rss) / args.clients:.1f} KB per stream)")
+
+        heartbeats[0] = 0
+        await asyncio.sleep(args.heartbeat * 2.5)
+        print(f"heartbeats while idle: {heartbeats[0]} ({heartbeats[0] / args.clients:.1f} per stream)")
+
+        loop = asyncio.get_running_loop()
+        admin = await loop.run_in_executor(None, admin_login)
+        body = json.dumps({'title': 'Announcement', 'message': 'x' * 200})
+        latencies = []
+        for _ in range(args.publishes):
+            start = time.perf_counter()
+            status = await loop.run_in_executor(None, admin.request, 'POST', '/admin/notifications',
+                                                body, {'Content-Type': 'application/json'})
+            if status != 200:
+                raise RuntimeError(f'/admin/notifications answered {status}')
+            while True:
+                arrived = [times for times in received.values() if len(times) >= args.clients]
+                if arrived:
+                    break
+                await asyncio.sleep(0.001)
+            latencies.append((max(arrived[0]) - start) * 1000)
+            received.clear()
+
+        latencies.sort()
+        print(f"broadcast to {args.clients} streams: p50 {statistics.median(latencies):.1f} ms, "
+              f"max {latencies[-1]:.1f} ms over {args.publishes} publishes")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'events.db')
+        loadtest.seed_database(database, args.students, 1, 42)
+        conn = sqlite3.connect(database)
+        roll_numbers = [row[0] for row in conn.execute('SELECT roll_number FROM student LIMIT ?',
+                                                       (args.students,))]
+        conn.close()
+
+        # Room for the streams plus the logins and broadcasts
+        process, port = loadtest.start_server(database, 'gevent', settings={
+            'EVENTS_HEARTBEAT': str(args.heartbeat),
+            'GUNICORN_WORKER_CONNECTIONS': str(args.clients + 100),
+        })
+        try:
+            cookies = []
+            for roll_number in roll_numbers:
+                user = loadtest.User('127.0.0.1', port, roll_number)
+                if not loadtest.login(user, {}):
+                    raise RuntimeError(f'login failed for {roll_number}')
+                cookies.append('; '.join(f'{name}={value}' for name, value in user.cookies.items()))
+            idle_rss = sum(_anon_rss_kb(pid) for pid in worker_pids(process.pid))
+            asyncio.run(run())
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def _anon_rss_kb(pid='self'):
+    # Anonymous (heap) memory only: pages of the mmap'ed database file are
+    # the OS page cache, not worker memory
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1])
+    return 0
+
+
+# Stream a school-wide attendance export of a million-row database and
+# check the worker's heap never grows past a memory ceiling. Exits non-zero
+# if it does, so it can gate a CI run. Needs Linux (/proc/self/status).
+def bench_reports(args):
+    import db
+    import reports
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'reports.db')
+        students = -(-args.rows // (args.days * 4))
+        subprocess.run([sys.executable, 'init_db.py', '--database', path, 'seed', '--students', str(students),
+                        '--days', str(args.days)], cwd=BASE_DIR, check=True, stdout=subprocess.DEVNULL)
+        pool = db.ConnectionPool(path, size=1)
+        pool.release(pool.acquire())
+
+        for fmt in ('csv', 'ndjson'):
+            baseline_kb = peak_kb = _anon_rss_kb()
+            start = time.perf_counter()
+            rows = size = 0
+            for chunk in reports.export(pool, 'attendance', {}, fmt):
+                size += len(chunk)
+                rows += chunk.count('\n')
+                peak_kb = max(peak_kb, _anon_rss_kb())
+            elapsed = time.perf_counter() - start
+            grown_mb = (peak_kb - baseline_kb) / 1024
+            ok = grown_mb <= args.ceiling_mb
+            print(f"{fmt:>7}: {rows:,} lines, {size / 1e6:.0f} MB in {elapsed:.1f}s "
+                  f"({rows / elapsed:,.0f} rows/s), peak heap +{grown_mb:.1f} MB "
+                  f"{'ok' if ok else f'OVER {args.ceiling_mb} MB'}")
+            if not ok:
+                sys.exit(1)
+        pool.close()
+
+
+# Search latency over a synthetic corpus: Zipf-distributed words in
+# assignments and notifications spread across classes, queried as a student
+# of one class with common, rare, multi-word, prefix and paged searches.
+def bench_search(args):
+    import itertools
+    import random
+    import migrations
+    import search
+
+    rng = random.Random(42)
+    syllables = ['ba', 'ke', 'lo', 'mi', 'nu', 'ra', 'si', 'to', 'vu', 'ze', 'dra', 'pli', 'qua', 'sto']
+    vocabulary = sorted({''.join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(20000)})
+    rng.shuffle(vocabulary)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    classes = [str(n) for n in range(1, 13)]
+
+    def text(words):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=words))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'search.db')
+        conn = sqlite3.connect(path)
+        migrations.migrate(conn)
+        conn.execute("INSERT INTO student (name, roll_number, class_name, section, email) "
+                     "VALUES ('Bench Student', 'B001', '10', 'A', 'bench@example.com')")
+
+        messages = args.documents // 10
+        start = time.perf_counter()
+        with conn:
+            conn.executemany('INSERT INTO assignments (title, description, due_date, subject, class_name) '
+                             "VALUES (?, ?, date('now'), ?, ?)",
+                             ((text(4), text(30), rng.choice(('Mathematics', 'Science', 'English')),
+                               rng.choice(classes)) for _ in range(args.documents - messages)))
+            conn.executemany('INSERT INTO message (title, body, class_name) VALUES (?, ?, ?)',
+                             ((text(4), text(20), rng.choice(classes + [None])) for _ in range(messages)))
+            conn.execute('''INSERT INTO notification_delivery (student_id, message_id)
+                            SELECT 1, id FROM message WHERE class_name = '10' OR class_name IS NULL''')
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+        elapsed = time.perf_counter() - start
+        print(f"indexed {args.documents:,} documents in {elapsed:.1f}s "
+              f"({args.documents / elapsed:,.0f} docs/s), "
+              f"{os.path.getsize(path) / 1e6:.0f} MB on disk")
+
+        cases = {
+            'common word': lambda: vocabulary[rng.randrange(10)],
+            'mid word': lambda: vocabulary[rng.randrange(100, 1000)],
+            'rare word': lambda: vocabulary[rng.randrange(5000, len(vocabulary))],
+            'two words': lambda: f'{vocabulary[rng.randrange(50)]} {vocabulary[rng.randrange(50, 500)]}',
+            'prefix (2 chars)': lambda: rng.choice(syllables),
+            'prefix (4 chars)': lambda: vocabulary[rng.randrange(200)][:4],
+        }
+        print(f"{'query':>18} {'p50 ms':>8} {'p95 ms':>8} {'page 5 p50':>11} {'suggest p50':>12}")
+        for name, make in cases.items():
+            first, fifth, suggest = [], [], []
+            for _ in range(args.queries):
+                q = make()
+                t = time.perf_counter()
+                items, cursor = search.search(conn, 1, '10', q)
+                first.append((time.perf_counter() - t) * 1000)
+                t = time.perf_counter()
+                for _ in range(4):
+                    if cursor is None:
+                        break
+                    items, cursor = search.search(conn, 1, '10', q, cursor=cursor)
+                fifth.append((time.perf_counter() - t) * 1000 / 4)
+                t = time.perf_counter()
+                search.suggest(conn, 1, '10', q)
+                suggest.append((time.perf_counter() - t) * 1000)
+            p95 = statistics.quantiles(first, n=20)[-1]
+            print(f"{name:>18} {statistics.median(first):>8.1f} {p95:>8.1f} "
+                  f"{statistics.median(fifth):>11.1f} {statistics.median(suggest):>12.1f}")
+        conn.close()
+
+
+def _tenant_writer(path, seconds, start_at, results):
+    import db
+    conn = sqlite3.connect(path, timeout=30)
+    for name, value in db.DEFAULT_PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    while time.time() < start_at:
+        time.sleep(0.001)
+    writes = 0
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        # One small transaction, like a teacher posting an assignment
+        with conn:
+            conn.execute("INSERT INTO assignments (title, description, due_date, subject, class_name) "
+                         "VALUES ('Worksheet', 'Exercises 1-10', date('now'), 'Mathematics', '10')")
+        writes += 1
+    conn.close()
+    results.put(writes)
+
+
+# Write throughput with N concurrent writers, each on its own tenant database
+# versus all sharing one file. SQLite serialises writers per file, so the
+# shared database stays flat while sharded throughput grows with the
+# writers until the cores run out.
+def bench_tenants(args):
+    import multiprocessing
+    import migrations
+
+    print(f"{os.cpu_count()} CPU(s)")
+    print(f"{'writers':>8} {'sharded w/s':>12} {'shared w/s':>11} {'sharded scaling':>16}")
+    with tempfile.TemporaryDirectory() as tmp:
+        def database(name):
+            path = os.path.join(tmp, f'{name}.db')
+            conn = sqlite3.connect(path)
+            migrations.migrate(conn)
+            conn.close()
+            return path
+
+        single = None
+        shared = database('shared')
+        for writers in args.writers:
+            rates = []
+            for paths in ([database(f'tenant{writers}_{n}') for n in range(writers)], [shared] * writers):
+                results = multiprocessing.Queue()
+                start_at = time.time() + 0.5
+                processes = [multiprocessing.Process(target=_tenant_writer,
+                                                     args=(path, args.seconds, start_at, results))
+                             for path in paths]
+                for process in processes:
+                    process.start()
+                total = sum(results.get() for _ in processes)
+                for process in processes:
+                    process.join()
+                rates.append(total / args.seconds)
+            single = single or rates[0] / writers
+            print(f"{writers:>8} {rates[0]:>12,.0f} {rates[1]:>11,.0f} "
+                  f"{rates[0] / single:>15.2f}x")
+        if max(args.writers) > (os.cpu_count() or 1):
+            print(f"note: more writers than CPUs, sharded scaling tops out at {os.cpu_count()}x here")
+
+
+# WSGI vs ASGI under the loadtest 'mobile' mix: JSON polling while some
+# users upload over slow links. Both servers get the same number of request
+# threads; under WSGI each trickling upload holds one, under ASGI the body
+# is read on the event loop.
+def bench_asgi(args):
+    import loadtest
+
+    reports = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'asgi.db')
+        loadtest.seed_database(database, args.students, 30, 42)
+        for server in ('wsgi', 'asgi'):
+            process, port = loadtest.start_server(database, server, args.threads)
+            try:
+                reports[server] = loadtest.run_load('127.0.0.1', port, args.mix, args.users, args.seconds,
+                                                    args.students, 2, 42)
+            finally:
+                process.terminate()
+                process.wait()
+
+    print(f"{args.users} users, {args.threads} request threads, mix '{args.mix}'")
+    print(f"{'route':<24} {'wsgi rps':>9} {'p50 ms':>8} {'p99 ms':>8} {'asgi rps':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for label in sorted(reports['wsgi'].keys() | reports['asgi'].keys()):
+        row = f"{label:<24}"
+        for server in ('wsgi', 'asgi'):
+            stats = reports[server].get(label, {'rps': 0, 'p50_ms': 0, 'p99_ms': 0})
+            row += f" {stats['rps']:>9.1f} {stats['p50_ms']:>8.1f} {stats['p99_ms']:>8.1f}"
+        print(row)
+
+
+# Cost of recording activity on the request path: a committed INSERT per
+# event vs handing it to the batched writer. Several threads record at once,
+# like request threads logging logins; reports per-call latency and the
+# time until every event is in the table.
+def bench_activity(args):
+    import threading
+    import activity
+    import db
+    import migrations
+
+    def run(record, events, threads):
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(n):
+            mine = []
+            for i in range(events // threads):
+                started = time.perf_counter()
+                record(i % 500 + 1)
+                mine.append(time.perf_counter() - started)
+            with lock:
+                latencies.extend(mine)
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return latencies, started
+
+    print(f"{'mode':<8} {'threads':>7} {'p50 us':>8} {'p99 us':>9} {'events/s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for threads in args.threads:
+            for mode in ('direct', 'batched'):
+                path = os.path.join(tmp, f'{mode}{threads}.db')
+                conn = sqlite3.connect(path)
+                migrations.migrate(conn)
+                conn.close()
+                registry = db.PoolRegistry(lambda database: db.ConnectionPool(database, size=threads + 1))
+                pool = registry.get(path)
+                if mode == 'direct':
+                    def record(student_id):
+                        conn = pool.acquire()
+                        try:
+                            with conn:
+                                conn.execute(activity.INSERT_ACTIVITY,
+                                             (student_id, 'login', 'bench', '2024-01-01 00:00:00'))
+                        finally:
+                            pool.release(conn)
+                    latencies, started = run(record, args.events, threads)
+                else:
+                    log = activity.ActivityLog(registry, max_queue=args.events)
+                    latencies, started = run(lambda student_id: log.record(path, student_id, 'login', 'bench'),
+                                             args.events, threads)
+                    log.flush()
+                    log.close()
+                elapsed = time.perf_counter() - started
+                registry.close()
+                latencies.sort()
+                print(f"{mode:<8} {threads:>7} {latencies[len(latencies) // 2] * 1e6:>8.0f} "
+                      f"{latencies[int(len(latencies) * 0.99)] * 1e6:>9.0f} {len(latencies) / elapsed:>10,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='School portal benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    startup = sub.add_parser('startup', help='worker cold start time vs database size')
+    startup.add_argument('--rows', type=int, nargs='+', default=[0, 100000, 1000000])
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    login = sub.add_parser('login', help='login throughput vs hashing worker count')
+    login.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    login.add_argument('--logins', type=int, default=64)
+    login.add_argument('--clients', type=int, default=32)
+    login.add_argument('--method', default='pbkdf2:sha256:600000')
+    login.set_defaults(func=bench_login)
+
+    placeholders = sub.add_parser('placeholders', help='placeholder image generation')
+    placeholders.add_argument('--count', type=int, default=32)
+    placeholders.set_defaults(func=bench_placeholders)
+
+    session_parser = sub.add_parser('sessions', help='per-request session overhead by backend')
+    session_parser.add_argument('--requests', type=int, default=2000)
+    session_parser.set_defaults(func=bench_sessions)
+
+    events_parser = sub.add_parser('events', help='idle SSE streams over HTTP on a gevent worker')
+    events_parser.add_argument('--clients', type=int, default=5000, help='open /api/events streams')
+    events_parser.add_argument('--students', type=int, default=50, help='students the streams log in as')
+    events_parser.add_argument('--publishes', type=int, default=20)
+    events_parser.add_argument('--heartbeat', type=int, default=1)
+    events_parser.set_defaults(func=bench_events)
+
+    reports_parser = sub.add_parser('reports', help='memory ceiling of streamed report exports')
+    reports_parser.add_argument('--rows', type=int, default=1000000)
+    reports_parser.add_argument('--days', type=int, default=250)
+    reports_parser.add_argument('--ceiling-mb', type=float, default=50)
+    reports_parser.set_defaults(func=bench_reports)
+
+    search_parser = sub.add_parser('search', help='full-text search latency over a large corpus')
+    search_parser.add_argument('--documents', type=int, default=1000000)
+    search_parser.add_argument('--queries', type=int, default=50)
+    search_parser.set_defaults(func=bench_search)
+
+    tenants_parser = sub.add_parser('tenants', help='write throughput, one database per tenant vs shared')
+    tenants_parser.add_argument('--writers', type=int, nargs='+', default=[1, 2, 4, 8])
+    tenants_parser.add_argument('--seconds', type=float, default=3.0)
+    tenants_parser.set_defaults(func=bench_tenants)
+
+    asgi_parser = sub.add_parser('asgi', help='JSON latency with slow uploads, WSGI vs ASGI')
+    asgi_parser.add_argument('--users', type=int, default=16)
+    asgi_parser.add_argument('--threads', type=int, default=8, help='request threads for both servers')
+    asgi_parser.add_argument('--seconds', type=float, default=15)
+    asgi_parser.add_argument('--students', type=int, default=500)
+    asgi_parser.add_argument('--mix', default='mobile')
+    asgi_parser.set_defaults(func=bench_asgi)
+
+    activity_parser = sub.add_parser('activity', help='recording activity: per-event commits vs batched writer')
+    activity_parser.add_argument('--events', type=int, default=20000)
+    activity_parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    activity_parser.set_defaults(func=bench_activity)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
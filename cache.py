@@ -0,0 +1,211 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from tenants import current_tenant
+
+try:
+    import redis
+except ImportError:  # optional backend
+    redis = None
+
+MISSING = object()
+
+
+class LRUCache:
+    # In-process cache with a size bound and per-entry TTL
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class RedisCache:
+    # Shared across workers, so an invalidation in one process is seen by all.
+    # Redis does its own eviction; we only count hits and misses here.
+    def __init__(self, url='redis://localhost:6379/0', ttl=300, prefix='school:'):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis requires the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl if ttl is None else ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'redis',
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': 0,
+            }
+
+
+# Cache keys. Everything is scoped to one student or one class so writes can
+# drop exactly what they affect.
+def student_key(student_id):
+    return f'student:{student_id}'
+
+
+def attendance_key(student_id):
+    return f'attendance:{student_id}'
+
+
+def schedule_key(class_name, section):
+    return f'schedule:{class_name}:{section}'
+
+
+def feed_key(student_id):
+    return f'feed:{student_id}'
+
+
+def results_key(student_id):
+    return f'results:{student_id}'
+
+
+class TenantCaches:
+    # A separate cache per school, so one busy tenant can't evict another's
+    # entries and keys never collide across tenants
+    def __init__(self, create):
+        self._create = create
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def get(self, slug):
+        cache = self._caches.get(slug)
+        if cache is None:
+            with self._lock:
+                cache = self._caches.get(slug)
+                if cache is None:
+                    cache = self._caches[slug] = self._create(slug)
+        return cache
+
+
+# The current tenant's cache
+def get_cache(app=None):
+    app = app or current_app
+    return app.extensions['caches'].get(current_tenant(app).slug)
+
+
+def cached(key, compute, ttl=None):
+    cache = get_cache()
+    value = cache.get(key)
+    if value is MISSING:
+        value = compute()
+        cache.set(key, value, ttl)
+    return value
+
+
+# Invalidation hooks for the write paths
+def invalidate_student(student_id):
+    get_cache().delete(student_key(student_id))
+
+
+def invalidate_attendance(*student_ids):
+    get_cache().delete(*(attendance_key(student_id) for student_id in student_ids))
+
+
+def invalidate_feeds(*student_ids):
+    get_cache().delete(*(feed_key(student_id) for student_id in student_ids))
+
+
+def invalidate_results(*student_ids):
+    get_cache().delete(*(results_key(student_id) for student_id in student_ids))
+
+
+def invalidate_schedules(*classes):
+    get_cache().delete(*(schedule_key(class_name, section) for class_name, section in classes))
+
+
+def init_app(app):
+    app.config.setdefault('CACHE_BACKEND', 'memory')
+    app.config.setdefault('CACHE_MAXSIZE', 4096)
+    app.config.setdefault('CACHE_TTL', 300)
+    app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+    def create(slug):
+        if app.config['CACHE_BACKEND'] == 'redis':
+            prefix = 'school:' if slug == 'default' else f'school:{slug}:'
+            return RedisCache(app.config['CACHE_REDIS_URL'], ttl=int(app.config['CACHE_TTL']), prefix=prefix)
+        return LRUCache(maxsize=int(app.config['CACHE_MAXSIZE']), ttl=int(app.config['CACHE_TTL']))
+
+    app.extensions['caches'] = TenantCaches(create)
+    # Fail at boot, not on the first request, if the backend is unusable
+    get_cache(app)
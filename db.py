@@ -0,0 +1,264 @@
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g
+
+from tenants import current_tenant
+
+# Pragmas applied to every pooled connection. WAL lets readers keep going
+# while a writer commits, which is what stalls us on busy mornings.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,       # negative means KiB, so ~20MB page cache
+    'mmap_size': 268435456,     # 256MB memory mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, database, size=8, timeout=10.0, pragmas=None, cached_statements=256,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.cached_statements = cached_statements
+        self.factory = factory
+
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = {}
+        self.closed = False
+
+        # Metrics
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.timeouts = 0
+        self.leaks = 0
+
+    def _connect(self):
+        # sqlite3 keeps a per-connection cache of compiled statements keyed by
+        # SQL text, so reusing connections also reuses prepared statements.
+        conn = sqlite3.connect(self.database, timeout=self.timeout,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements,
+                               factory=self.factory)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                waited = time.perf_counter() - start
+                with self._lock:
+                    self.waits += 1
+                    self.wait_time += waited
+                    self.max_wait_time = max(self.max_wait_time, waited)
+
+        with self._lock:
+            self.checkouts += 1
+            self._in_use[id(conn)] = time.monotonic()
+        return conn
+
+    def release(self, conn):
+        with self._lock:
+            self._in_use.pop(id(conn), None)
+        if self.closed:
+            # Handed back after the registry closed this pool
+            self._discard(conn)
+            return
+
+        # A connection handed back mid-transaction means a view forgot to
+        # commit or hit an exception; roll back so the next user starts clean.
+        if conn.in_transaction:
+            with self._lock:
+                self.leaks += 1
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                self._discard(conn)
+                return
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def busy(self):
+        with self._lock:
+            return bool(self._in_use)
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': len(self._in_use),
+                'idle': self._idle.qsize(),
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time_total_ms': round(self.wait_time * 1000, 3),
+                'wait_time_max_ms': round(self.max_wait_time * 1000, 3),
+                'timeouts': self.timeouts,
+                'leaks': self.leaks,
+                'oldest_checkout_s': round(max((now - t for t in self._in_use.values()), default=0), 3),
+            }
+
+
+class PoolRegistry:
+    # One pool per database file (i.e. per tenant), created on first use.
+    # At most max_open pools keep connections open; past that the least
+    # recently used pool with nothing checked out is closed. Its connections
+    # are reopened on the tenant's next request.
+    def __init__(self, create, max_open=32):
+        self._create = create
+        self.max_open = max_open
+        self._pools = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evictions = 0
+
+    def get(self, database):
+        with self._lock:
+            pool = self._pools.get(database)
+            if pool is not None:
+                self._pools.move_to_end(database)
+                return pool
+            pool = self._pools[database] = self._create(database)
+            self.opened += 1
+            self._evict()
+        return pool
+
+    def _evict(self):
+        # Oldest first; busy pools are skipped, so the limit can be exceeded
+        # briefly while every pool is serving a request
+        for database in list(self._pools)[:-1]:
+            if len(self._pools) <= self.max_open:
+                break
+            pool = self._pools[database]
+            if not pool.busy():
+                del self._pools[database]
+                pool.close()
+                self.evictions += 1
+
+    def pools(self):
+        with self._lock:
+            return list(self._pools.values())
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), OrderedDict()
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        pools = self.pools()
+        return {
+            'pools': len(pools),
+            'max_open': self.max_open,
+            'opened': self.opened,
+            'evictions': self.evictions,
+            'connections': sum(pool.stats()['open'] for pool in pools),
+        }
+
+
+def get_registry(app=None):
+    app = app or current_app
+    return app.extensions['db_pools']
+
+
+# The current tenant's pool
+def get_pool(app=None):
+    return get_registry(app).get(current_tenant(app).database)
+
+
+# One pooled connection per request, stored on g and handed back in teardown
+# to the pool it came from
+def get_db():
+    if 'db' not in g:
+        g.db_pool = get_pool()
+        g.db = g.db_pool.acquire()
+    return g.db
+
+
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        g.pop('db_pool').release(conn)
+
+
+def init_app(app):
+    app.config.setdefault('DATABASE', 'school.db')
+    app.config.setdefault('DB_POOL_SIZE', 8)
+    app.config.setdefault('DB_POOL_TIMEOUT', 10.0)
+    app.config.setdefault('DB_STATEMENT_CACHE', 256)
+    app.config.setdefault('DB_PRAGMAS', DEFAULT_PRAGMAS)
+    app.config.setdefault('DB_CONNECTION_FACTORY', sqlite3.Connection)
+    app.config.setdefault('DB_MAX_OPEN_TENANTS', 32)
+
+    def create(database):
+        return ConnectionPool(
+            database,
+            size=int(app.config['DB_POOL_SIZE']),
+            timeout=float(app.config['DB_POOL_TIMEOUT']),
+            pragmas=app.config['DB_PRAGMAS'],
+            cached_statements=int(app.config['DB_STATEMENT_CACHE']),
+            factory=app.config['DB_CONNECTION_FACTORY'],
+        )
+
+    app.extensions['db_pools'] = PoolRegistry(create, max_open=int(app.config['DB_MAX_OPEN_TENANTS']))
+    app.teardown_appcontext(close_db)
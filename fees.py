@@ -0,0 +1,195 @@
+import csv
+import hashlib
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import queries
+
+PAGE_SIZE = 20
+
+
+class InvalidAmount(ValueError):
+    pass
+
+
+# Academic years run April to March, e.g. '2024-2025'
+def academic_year(day=None):
+    day = day or datetime.now()
+    start = day.year if day.month >= 4 else day.year - 1
+    return f'{start}-{start + 1}'
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        raise InvalidAmount(value)
+    if amount <= 0 or amount != amount.to_integral_value():
+        raise InvalidAmount(value)
+    return int(amount)
+
+
+# The write helpers below don't commit: callers wrap them in `with conn:` so
+# the ledger row and the fee_balance projection land in the same transaction.
+
+def add_invoice(conn, student_id, amount, due_date, description, year):
+    conn.execute('''INSERT INTO invoice (student_id, academic_year, description, amount, due_date)
+                    VALUES (?, ?, ?, ?, ?)''', (student_id, year, description, amount, due_date))
+    conn.execute('''INSERT INTO fee_balance (student_id, academic_year, total_invoiced)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (student_id, academic_year) DO UPDATE SET
+                        total_invoiced = total_invoiced + excluded.total_invoiced''',
+                 (student_id, year, amount))
+
+
+# Returns the new payment id, or None if the bank reference was already recorded
+def add_payment(conn, student_id, amount, paid_at, mode, reference=None, receipt_no=None):
+    year = academic_year(datetime.strptime(paid_at[:10], '%Y-%m-%d'))
+    c = conn.execute('''INSERT OR IGNORE INTO payment
+                        (student_id, academic_year, amount, paid_at, mode, reference, receipt_no)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (student_id, year, amount, paid_at, mode, reference, receipt_no))
+    if c.rowcount == 0:
+        return None
+    conn.execute('''INSERT INTO fee_balance (student_id, academic_year, total_paid, last_payment_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (student_id, academic_year) DO UPDATE SET
+                        total_paid = total_paid + excluded.total_paid,
+                        last_payment_at = max(coalesce(last_payment_at, ''), excluded.last_payment_at)''',
+                 (student_id, year, amount, paid_at))
+    return c.lastrowid
+
+
+def create_invoice(conn, student_id, amount, due_date, description, year=None):
+    with conn:
+        add_invoice(conn, student_id, amount, due_date, description, year or academic_year())
+
+
+# Invoice every student of a class for each line of its fee structure
+def issue_class_invoices(conn, class_name, due_date, year=None):
+    year = year or academic_year()
+    with conn:
+        structure = conn.execute(queries.FEE_STRUCTURE, (class_name, year)).fetchall()
+        students = [row[0] for row in conn.execute('SELECT id FROM student WHERE class_name = ?', (class_name,))]
+        for student_id in students:
+            for fee_type, amount in structure:
+                add_invoice(conn, student_id, amount, due_date, fee_type, year)
+    return len(students)
+
+
+def record_payment(conn, student_id, amount, mode, paid_at=None, reference=None, receipt_no=None):
+    paid_at = paid_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with conn:
+        return add_payment(conn, student_id, parse_amount(amount), paid_at, mode, reference, receipt_no)
+
+
+def receipt_number(payment_id, receipt_no):
+    return receipt_no or f'REC{payment_id:06d}'
+
+
+# Newest first, keyed on payment id so every page is an index range scan no
+# matter how deep the student pages
+def payment_page(conn, student_id, before=None, limit=PAGE_SIZE):
+    if before is None:
+        rows = conn.execute(queries.PAYMENTS_FIRST_PAGE, (student_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(queries.PAYMENTS_PAGE, (student_id, before, limit + 1)).fetchall()
+    payments = [
+        {
+            'id': payment_id,
+            'date': paid_at[:10],
+            'amount': amount,
+            'receipt_no': receipt_number(payment_id, receipt_no),
+            'mode': mode,
+            'status': 'Paid'
+        }
+        for payment_id, amount, paid_at, mode, receipt_no in rows[:limit]
+    ]
+    next_cursor = payments[-1]['id'] if len(rows) > limit else None
+    return payments, next_cursor
+
+
+def get_fee_summary(conn, student_id, class_name, year=None):
+    year = year or academic_year()
+    balance = conn.execute(queries.FEE_BALANCE, (student_id, year)).fetchone()
+    total_fees, paid_fees = balance if balance else (0, 0)
+    pending_fees = max(total_fees - paid_fees, 0)
+    due_date = None
+    if pending_fees:
+        due_date = conn.execute(queries.NEXT_INVOICE_DUE, (student_id, year)).fetchone()[0]
+    structure = conn.execute(queries.FEE_STRUCTURE, (class_name, year)).fetchall()
+    return {
+        'current_year': year,
+        'total_fees': total_fees,
+        'paid_fees': paid_fees,
+        'pending_fees': pending_fees,
+        'due_date': due_date,
+        'fee_structure': [{'type': fee_type, 'amount': amount} for fee_type, amount in structure]
+    }
+
+
+# Identifies a statement file by content, whatever it is named
+def _statement_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+# Match a bank statement (date,amount,reference,roll_number[,mode]) against
+# students and record the payments. The file is read as a stream and
+# committed every batch_size rows; references already on file are skipped,
+# so re-running a statement is safe. A row with a blank reference gets one
+# made from the file's hash and its line number: re-importing the same file
+# skips it, while identical rows within one statement all go through.
+def reconcile_statement(conn, path, batch_size=1000, unmatched_path=None):
+    student_ids = dict(conn.execute('SELECT roll_number, id FROM student'))
+    statement = _statement_digest(path)
+    counts = {'matched': 0, 'duplicate': 0, 'unmatched': 0}
+
+    unmatched_file = open(unmatched_path, 'w', newline='') if unmatched_path else None
+    unmatched_writer = None
+    try:
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            if unmatched_file:
+                unmatched_writer = csv.DictWriter(unmatched_file, fieldnames=reader.fieldnames)
+                unmatched_writer.writeheader()
+
+            pending = 0
+            conn.execute('BEGIN')
+            for record in reader:
+                student_id = student_ids.get((record.get('roll_number') or '').strip())
+                try:
+                    amount = parse_amount(record['amount'])
+                    paid_at = datetime.strptime(record['date'].strip()[:10], '%Y-%m-%d').strftime('%Y-%m-%d')
+                except (InvalidAmount, ValueError):
+                    student_id = None
+                if student_id is None:
+                    counts['unmatched'] += 1
+                    if unmatched_writer:
+                        unmatched_writer.writerow(record)
+                    continue
+
+                reference = ((record.get('reference') or '').strip()
+                             or f'statement:{statement}:{reader.line_num}')
+                mode = (record.get('mode') or 'Bank Transfer').strip()
+                if add_payment(conn, student_id, amount, paid_at, mode, reference) is None:
+                    counts['duplicate'] += 1
+                else:
+                    counts['matched'] += 1
+
+                pending += 1
+                if pending >= batch_size:
+                    conn.commit()
+                    conn.execute('BEGIN')
+                    pending = 0
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if unmatched_file:
+            unmatched_file.close()
+    return counts
@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+
+import queries
+
+# (minimum percentage, grade), checked top down
+GRADE_SCALE = [(90, 'A+'), (80, 'A'), (70, 'B+'), (60, 'B'), (50, 'C'), (40, 'D'), (0, 'F')]
+
+
+def grade_for(percentage):
+    for minimum, grade in GRADE_SCALE:
+        if percentage >= minimum:
+            return grade
+    return 'F'
+
+
+def _percentage(obtained, total):
+    return round(obtained * 100.0 / total, 2) if total else 0
+
+
+def _percentile(below, class_size):
+    return round(below * 100.0 / class_size, 1) if class_size else 0
+
+
+def _refresh_subject_stats(conn, exam_id, subject=None):
+    where = 'WHERE exam_id = ?' + (' AND subject = ?' if subject is not None else '')
+    params = (exam_id,) if subject is None else (exam_id, subject)
+    conn.execute(f'''INSERT OR REPLACE INTO subject_stats
+                     (exam_id, subject, average, highest, lowest, students)
+                     SELECT exam_id, subject, round(AVG(marks_obtained), 2),
+                            MAX(marks_obtained), MIN(marks_obtained), COUNT(*)
+                     FROM mark {where}
+                     GROUP BY exam_id, subject''', params)
+
+
+# BEGIN IMMEDIATE takes the write lock before the totals are read, so two
+# teachers editing the same exam can't both work from the old totals
+@contextmanager
+def _write_transaction(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+# Batch job: rank, percentile, grade and subject stats for every student of
+# an exam. Totals come from one grouped read, ranking is a single sort, and
+# results are written back with one executemany.
+def compute_exam_results(conn, exam_id):
+    with _write_transaction(conn):
+        return _compute_exam_results(conn, exam_id)
+
+
+def _compute_exam_results(conn, exam_id):
+    totals = conn.execute('''SELECT student_id, SUM(marks_obtained), SUM(total_marks)
+                             FROM mark WHERE exam_id = ? GROUP BY student_id''', (exam_id,)).fetchall()
+    totals.sort(key=lambda row: row[1], reverse=True)
+    class_size = len(totals)
+
+    rows = []
+    i = 0
+    while i < class_size:
+        # Students with equal totals share a rank (1, 2, 2, 4, ...)
+        j = i
+        while j < class_size and totals[j][1] == totals[i][1]:
+            j += 1
+        below = class_size - j
+        for student_id, obtained, total in totals[i:j]:
+            percentage = _percentage(obtained, total)
+            rows.append((exam_id, student_id, obtained, total, percentage, grade_for(percentage),
+                         i + 1, below, _percentile(below, class_size), class_size))
+        i = j
+
+    conn.execute('DELETE FROM result WHERE exam_id = ?', (exam_id,))
+    conn.executemany('''INSERT INTO result
+                        (exam_id, student_id, total_obtained, total_marks, percentage, grade,
+                         rank, students_below, percentile, class_size)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    conn.execute('DELETE FROM subject_stats WHERE exam_id = ?', (exam_id,))
+    _refresh_subject_stats(conn, exam_id)
+    return class_size
+
+
+# A teacher edits one mark. Only the students whose rank or percentile can
+# move (totals between the old and new total) are touched, instead of
+# re-ranking the whole class.
+def update_mark(conn, exam_id, student_id, subject, marks_obtained, total_marks=100):
+    with _write_transaction(conn):
+        _update_mark(conn, exam_id, student_id, subject, marks_obtained, total_marks)
+
+
+def _update_mark(conn, exam_id, student_id, subject, marks_obtained, total_marks):
+    existing = conn.execute('SELECT marks_obtained, total_marks FROM mark WHERE exam_id = ? AND student_id = ? AND subject = ?',
+                            (exam_id, student_id, subject)).fetchone()
+    result = conn.execute('SELECT total_obtained, total_marks, class_size FROM result WHERE exam_id = ? AND student_id = ?',
+                          (exam_id, student_id)).fetchone()
+
+    if existing is None or result is None:
+        # New subject or new student changes totals or class size: recompute
+        conn.execute('''INSERT OR REPLACE INTO mark (exam_id, student_id, subject, marks_obtained, total_marks)
+                        VALUES (?, ?, ?, ?, ?)''', (exam_id, student_id, subject, marks_obtained, total_marks))
+        _compute_exam_results(conn, exam_id)
+        return
+
+    old_marks, old_subject_total = existing
+    old_total, old_max, class_size = result
+    new_total = old_total + marks_obtained - old_marks
+    new_max = old_max + total_marks - old_subject_total
+
+    conn.execute('UPDATE mark SET marks_obtained = ?, total_marks = ? WHERE exam_id = ? AND student_id = ? AND subject = ?',
+                 (marks_obtained, total_marks, exam_id, student_id, subject))
+
+    if new_total > old_total:
+        # Others in [old, new) now have one more student above them, and
+        # others in (old, new] lose one student below them
+        conn.execute('''UPDATE result SET rank = rank + 1 WHERE exam_id = ? AND student_id != ?
+                        AND total_obtained >= ? AND total_obtained < ?''',
+                     (exam_id, student_id, old_total, new_total))
+        conn.execute('''UPDATE result SET students_below = students_below - 1,
+                            percentile = round((students_below - 1) * 100.0 / class_size, 1)
+                        WHERE exam_id = ? AND student_id != ?
+                        AND total_obtained > ? AND total_obtained <= ?''',
+                     (exam_id, student_id, old_total, new_total))
+    elif new_total < old_total:
+        conn.execute('''UPDATE result SET rank = rank - 1 WHERE exam_id = ? AND student_id != ?
+                        AND total_obtained >= ? AND total_obtained < ?''',
+                     (exam_id, student_id, new_total, old_total))
+        conn.execute('''UPDATE result SET students_below = students_below + 1,
+                            percentile = round((students_below + 1) * 100.0 / class_size, 1)
+                        WHERE exam_id = ? AND student_id != ?
+                        AND total_obtained > ? AND total_obtained <= ?''',
+                     (exam_id, student_id, new_total, old_total))
+
+    above, below = conn.execute('''SELECT SUM(total_obtained > ?), SUM(total_obtained < ?)
+                                   FROM result WHERE exam_id = ? AND student_id != ?''',
+                                (new_total, new_total, exam_id, student_id)).fetchone()
+    percentage = _percentage(new_total, new_max)
+    conn.execute('''UPDATE result SET total_obtained = ?, total_marks = ?, percentage = ?, grade = ?,
+                        rank = ?, students_below = ?, percentile = ?
+                    WHERE exam_id = ? AND student_id = ?''',
+                 (new_total, new_max, percentage, grade_for(percentage), (above or 0) + 1, below or 0,
+                  _percentile(below or 0, class_size), exam_id, student_id))
+    _refresh_subject_stats(conn, exam_id, subject)
+
+
+# Latest published result for a student plus their subject marks, or None
+def get_student_results(conn, student_id):
+    latest = conn.execute(queries.LATEST_RESULTS, (student_id,)).fetchall()
+    if not latest:
+        return None
+    (exam_id, exam_name, obtained, total, percentage, grade, rank, percentile, class_size) = latest[0]
+    improvement = None
+    if len(latest) > 1:
+        improvement = round(percentage - latest[1][4], 2)
+
+    marks = conn.execute(queries.STUDENT_MARKS, (exam_id, student_id)).fetchall()
+    return {
+        'exam': exam_name,
+        'subjects': [
+            {
+                'subject': subject,
+                'marks_obtained': marks_obtained,
+                'total_marks': subject_total,
+                'grade': grade_for(_percentage(marks_obtained, subject_total))
+            }
+            for subject, marks_obtained, subject_total in marks
+        ],
+        'total_marks': obtained,
+        'max_marks': total,
+        'percentage': percentage,
+        'grade': grade,
+        'rank': rank,
+        'percentile': percentile,
+        'class_size': class_size,
+        'improvement': improvement,
+    }
@@ -0,0 +1,12 @@
+import os
+
+# Production server settings; gunicorn reads this file from the working
+# directory (gunicorn app:app). Threaded workers serve the app: password
+# hashing, image resizing and the SQLite work of every view run on real
+# threads. /api/events streams are served by gunicorn_events.conf.py.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
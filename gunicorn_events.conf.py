@@ -0,0 +1,22 @@
+import os
+
+# The /api/events server (gunicorn -c gunicorn_events.conf.py app:app).
+# gevent workers hold each idle stream as a greenlet instead of a thread, so
+# one worker keeps thousands of them open. Route only /api/events here, e.g.
+# in nginx:
+#
+#   location /api/events { proxy_pass http://127.0.0.1:8001; proxy_buffering off; }
+#
+# Everything else stays on the threaded workers of gunicorn.conf.py: once
+# gevent has monkey-patched threading, a password hash, an image resize or a
+# slow query would block the worker's hub and every stream on it. The app
+# answers 404 to other paths here (SERVE_ONLY_EVENTS). Both servers need
+# EVENTS_BACKEND=redis so the app's publishes reach these workers.
+
+bind = os.environ.get('GUNICORN_EVENTS_BIND', '127.0.0.1:8001')
+workers = int(os.environ.get('EVENTS_WORKERS', 1))
+worker_class = 'gevent'
+# Open streams per worker
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 5000))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+raw_env = [f"SERVE_ONLY_EVENTS={os.environ.get('SERVE_ONLY_EVENTS', '1')}"]
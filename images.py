@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g, url_for
+
+from tenants import current_tenant
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # uploads are still accepted, just not resized
+    Image = None
+
+# Widths generated for every profile picture, each as JPEG and WebP
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+MAX_DIMENSION = 1024
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+_HASHED_NAME = re.compile(r'^(?P<prefix>.*/)?(?P<digest>[0-9a-f]{32})\.jpg$')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidImage(Exception):
+    pass
+
+
+class ProcessedUpload:
+    def __init__(self, digest, path, ready):
+        self.digest = digest
+        self.path = path        # relative to static/, what goes in student.profile_pic
+        self.ready = ready      # False while the worker is still producing it
+
+
+def _executor():
+    return current_app.extensions['image_executor']
+
+
+# Copy the upload to a private temp file in chunks, hashing as we go and
+# giving up as soon as it exceeds the cap
+def _stream_to_disk(file, max_bytes):
+    tmp_dir = os.path.join(current_app.instance_path, 'uploads')
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest()[:32]
+
+
+def _save_variants(tmp_path, dest_dir, digest):
+    with Image.open(tmp_path) as source:
+        # Apply the EXIF rotation, then copy pixels only so no metadata
+        # (GPS, camera serials...) survives into the public files
+        image = ImageOps.exif_transpose(source)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    main = image.copy()
+    main.thumbnail((MAX_DIMENSION, MAX_DIMENSION))
+    for size in THUMBNAIL_SIZES:
+        thumb = image.copy()
+        thumb.thumbnail((size, size))
+        thumb.save(os.path.join(dest_dir, f'{digest}_{size}.webp'), 'WEBP', quality=80, method=4)
+        thumb.save(os.path.join(dest_dir, f'{digest}_{size}.jpg'), 'JPEG', quality=85, optimize=True)
+    main.save(os.path.join(dest_dir, f'{digest}.webp'), 'WEBP', quality=80, method=4)
+    # Written last: its presence means the whole set is ready
+    main.save(os.path.join(dest_dir, f'{digest}.jpg'), 'JPEG', quality=85, optimize=True)
+
+
+# Left next to the variants when processing fails, so upload_status() can
+# tell the client instead of leaving it waiting on a picture that never comes
+def _failed_marker(dest_dir, digest):
+    return os.path.join(dest_dir, f'{digest}.failed')
+
+
+def _process(app, tenant, tmp_path, dest_dir, digest, path, on_ready):
+    try:
+        _save_variants(tmp_path, dest_dir, digest)
+    except Exception:
+        logger.exception('Image processing failed for %s', digest)
+        with open(_failed_marker(dest_dir, digest), 'w'):
+            pass
+        return
+    finally:
+        os.remove(tmp_path)
+    with app.app_context():
+        g.tenant = tenant
+        try:
+            on_ready(path)
+        except Exception:
+            logger.exception('Callback failed for processed image %s', digest)
+
+
+def _store_unprocessed(tmp_path, dest_dir, digest):
+    os.replace(tmp_path, os.path.join(dest_dir, f'{digest}.jpg'))
+
+
+# Stream an uploaded image to disk and hand resizing to the worker pool.
+# on_ready(path) runs inside an app context once the public files exist,
+# which is immediately for content we have already processed before.
+def process_upload(file, dest_dir, url_prefix, on_ready):
+    os.makedirs(dest_dir, exist_ok=True)
+    max_bytes = current_app.config['PROFILE_PIC_MAX_BYTES']
+    tmp_path, digest = _stream_to_disk(file, max_bytes)
+    if Image is not None:
+        # Only parses the header, the full decode happens in the worker,
+        # so a small file claiming huge dimensions never reaches it
+        try:
+            with Image.open(tmp_path) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            os.remove(tmp_path)
+            raise UploadTooLarge()
+        except Exception:
+            os.remove(tmp_path)
+            raise InvalidImage()
+        if width * height > current_app.config['PROFILE_PIC_MAX_PIXELS']:
+            os.remove(tmp_path)
+            raise UploadTooLarge()
+    upload = ProcessedUpload(digest, f'{url_prefix}/{digest}.jpg', ready=False)
+
+    if os.path.exists(os.path.join(dest_dir, f'{digest}.jpg')):
+        # Same bytes were uploaded before, reuse the existing variants
+        os.remove(tmp_path)
+        upload.ready = True
+        on_ready(upload.path)
+    elif Image is None:
+        _store_unprocessed(tmp_path, dest_dir, digest)
+        upload.ready = True
+        on_ready(upload.path)
+    else:
+        # Same bytes may have failed before; this is a fresh attempt
+        if os.path.exists(_failed_marker(dest_dir, digest)):
+            os.remove(_failed_marker(dest_dir, digest))
+        app = current_app._get_current_object()
+        _executor().submit(_process, app, current_tenant(), tmp_path, dest_dir, digest, upload.path, on_ready)
+    return upload
+
+
+# 'ready', 'processing' or 'failed' for an upload's digest
+def upload_status(dest_dir, digest):
+    if os.path.exists(os.path.join(dest_dir, f'{digest}.jpg')):
+        return 'ready'
+    if os.path.exists(_failed_marker(dest_dir, digest)):
+        return 'failed'
+    return 'processing'
+
+
+# srcset for a processed profile picture, e.g. in a template:
+#   <img src="{{ url_for('static', filename=student.profile_pic) }}"
+#        srcset="{{ profile_srcset(student.profile_pic) }}" sizes="128px">
+def profile_srcset(profile_pic, fmt='jpg'):
+    match = _HASHED_NAME.match(profile_pic or '')
+    if not match:
+        return ''
+    prefix = match.group('prefix') or ''
+    digest = match.group('digest')
+    return ', '.join(f"{url_for('static', filename=f'{prefix}{digest}_{size}.{fmt}')} {size}w"
+                     for size in THUMBNAIL_SIZES)
+
+
+def init_app(app):
+    app.config.setdefault('PROFILE_PIC_MAX_BYTES', 5 * 1024 * 1024)
+    app.config.setdefault('PROFILE_PIC_MAX_PIXELS', 6000 * 6000)
+    if Image is not None:
+        # Backstop for anything decoded without going through process_upload
+        Image.MAX_IMAGE_PIXELS = app.config['PROFILE_PIC_MAX_PIXELS']
+    app.config.setdefault('IMAGE_WORKERS', 2)
+    app.extensions['image_executor'] = ThreadPoolExecutor(
+        max_workers=int(app.config['IMAGE_WORKERS']), thread_name_prefix='images')
+    app.jinja_env.globals['profile_srcset'] = profile_srcset
@@ -1,69 +1,195 @@
+import argparse
+import csv
+import itertools
+import os
+import random
 import sqlite3
+import sys
+import time
 from datetime import datetime, timedelta
-import random
-import os
 
-def init_db():
-    # Create database directory if it doesn't exist
-    os.makedirs('instance', exist_ok=True)
-    
-    conn = sqlite3.connect('instance/school.db')
-    c = conn.cursor()
-
-    # Drop existing tables
-    c.execute('DROP TABLE IF EXISTS student')
-    c.execute('DROP TABLE IF EXISTS attendance')
-    
-    # Create student table
-    c.execute('''CREATE TABLE IF NOT EXISTS student (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )''')
-    
-    # Create attendance table
-    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        student_id INTEGER,
-        subject TEXT NOT NULL,
-        date DATE NOT NULL,
-        status TEXT NOT NULL CHECK(status IN ('present', 'absent')),
-        FOREIGN KEY (student_id) REFERENCES student (id)
-    )''')
-
-    # Insert demo student
-    c.execute("""INSERT INTO student (name, email, password) 
-                VALUES (?, ?, ?)""", 
-                ('John Doe', 'john@example.com', 'password123'))
-    
-    student_id = c.lastrowid
-
-    # Generate attendance data for the past year
-    subjects = ['Mathematics', 'Science', 'English', 'History']
-    
-    # Generate data for the past 12 months
-    current_date = datetime.now()
-    start_date = current_date - timedelta(days=365)
-    
-    while start_date <= current_date:
-        # Skip weekends
-        if start_date.weekday() < 5:  # Monday = 0, Sunday = 6
+from werkzeug.security import generate_password_hash
+
+import migrations
+from attendance import UPSERT_ATTENDANCE, InvalidRegister, bulk_attendance_write
+
+DEFAULT_SUBJECTS = ['Mathematics', 'Science', 'English', 'History']
+CLASSES = [str(n) for n in range(1, 13)]
+SECTIONS = ['A', 'B', 'C', 'D']
+
+# Bulk loads trade durability for speed: a crash mid-load just means
+# running the load again.
+BULK_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -200000,
+    'temp_store': 'MEMORY',
+}
+
+def connect(database):
+    conn = sqlite3.connect(database, timeout=30)
+    for name, value in BULK_PRAGMAS.items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    migrations.migrate(conn)
+    return conn
+
+def batched(rows, size):
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# Most recent `days` weekdays, oldest first
+def school_days(days, end=None):
+    current = end or datetime.now()
+    dates = []
+    while len(dates) < days:
+        if current.weekday() < 5:  # Monday = 0, Sunday = 6
+            dates.append(current.strftime('%Y-%m-%d'))
+        current -= timedelta(days=1)
+    dates.reverse()
+    return dates
+
+# Create (or reuse) students S000001..SNNNNNN and return their ids. They all
+# share one password hash, hashing per student would dominate the load time.
+def seed_students(conn, count, password='password123'):
+    password_hash = generate_password_hash(password)
+    rows = ((f'Student {n}', f'S{n:06d}', CLASSES[n % len(CLASSES)], SECTIONS[n % len(SECTIONS)],
+             f's{n:06d}@example.com', password_hash)
+            for n in range(1, count + 1))
+    conn.executemany('''INSERT OR IGNORE INTO student (name, roll_number, class_name, section, email, password_hash)
+                        VALUES (?, ?, ?, ?, ?, ?)''', rows)
+    return [row[0] for row in conn.execute(
+        'SELECT id FROM student WHERE roll_number BETWEEN ? AND ? ORDER BY id',
+        ('S000001', f'S{count:06d}'))]
+
+# Attendance rows are generated lazily so memory stays flat at any scale.
+# Student-major order keeps inserts into the (student_id, date, ...) index
+# close to appends.
+def generate_attendance(student_ids, subjects, dates, absence_rate, rng):
+    for student_id in student_ids:
+        for day in dates:
             for subject in subjects:
-                # Generate attendance with 95% probability of being present
-                status = 'present' if random.random() < 0.95 else 'absent'
-                
-                c.execute("""INSERT INTO attendance 
-                            (student_id, subject, date, status) 
-                            VALUES (?, ?, ?, ?)""",
-                         (student_id, subject, start_date.strftime('%Y-%m-%d'), status))
-        
-        start_date += timedelta(days=1)
-
-    conn.commit()
-    conn.close()
+                status = 'absent' if rng.random() < absence_rate else 'present'
+                yield (student_id, day, subject, status)
+
+def insert_attendance(conn, rows, batch_size):
+    count = 0
+    for batch in batched(rows, batch_size):
+        conn.executemany(UPSERT_ATTENDANCE, batch)
+        count += len(batch)
+    return count
+
+def seed(database, students, subjects, days, absence_rate, rng_seed, batch_size):
+    conn = connect(database)
+    start = time.perf_counter()
+    try:
+        with bulk_attendance_write(conn) as touched:
+            student_ids = seed_students(conn, students)
+            touched.update(student_ids)
+            rows = generate_attendance(student_ids, subjects, school_days(days),
+                                       absence_rate, random.Random(rng_seed))
+            count = insert_attendance(conn, rows, batch_size)
+    finally:
+        conn.close()
+    report(count, time.perf_counter() - start)
+
+REGISTER_COLUMNS = ('roll_number', 'date', 'subject', 'status')
+
+# One register row as an attendance row, or ValueError saying what is wrong
+def parse_register_row(record, student_ids, subjects=None):
+    roll_number = (record.get('roll_number') or '').strip()
+    subject = (record.get('subject') or '').strip()
+    status = (record.get('status') or '').strip().lower()
+    try:
+        date = datetime.strptime((record.get('date') or '').strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError('date must be YYYY-MM-DD')
+    student_id = student_ids.get(roll_number)
+    if student_id is None:
+        raise ValueError(f'unknown roll number {roll_number!r}')
+    if not subject or (subjects and subject not in subjects):
+        raise ValueError(f'unknown subject {subject!r}')
+    if status not in ('present', 'absent'):
+        raise ValueError("status must be 'present' or 'absent'")
+    return (student_id, date, subject, status)
+
+# Import a register with columns roll_number,date,subject,status (header row
+# required). The file is checked in a first pass and nothing is written if
+# any row is bad: InvalidRegister lists the first max_errors by line number.
+# Pass subjects to reject anything else, e.g. a misspelt subject name.
+def import_csv(database, path, batch_size, subjects=None, max_errors=50):
+    conn = connect(database)
+    start = time.perf_counter()
+    try:
+        student_ids = dict(conn.execute('SELECT roll_number, id FROM student'))
+
+        errors = []
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            missing = [column for column in REGISTER_COLUMNS if column not in (reader.fieldnames or [])]
+            if missing:
+                raise InvalidRegister([{'row': 1, 'error': f"header is missing {', '.join(missing)}"}])
+            for record in reader:
+                try:
+                    parse_register_row(record, student_ids, subjects)
+                except ValueError as e:
+                    errors.append({'row': reader.line_num, 'error': str(e)})
+                    if len(errors) >= max_errors:
+                        break
+        if errors:
+            raise InvalidRegister(errors)
+
+        def rows(reader, touched):
+            for record in reader:
+                row = parse_register_row(record, student_ids, subjects)
+                touched.add(row[0])
+                yield row
+
+        with open(path, newline='') as f, bulk_attendance_write(conn) as touched:
+            count = insert_attendance(conn, rows(csv.DictReader(f), touched), batch_size)
+    finally:
+        conn.close()
+    report(count, time.perf_counter() - start)
+
+def report(count, elapsed):
+    rate = count / elapsed if elapsed else 0
+    print(f"Inserted {count} attendance rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed or import attendance data')
+    parser.add_argument('--database', default=os.environ.get('SCHOOL_DB', 'school.db'))
+    parser.add_argument('--batch-size', type=int, default=50000)
+    sub = parser.add_subparsers(dest='command')
+
+    seed_parser = sub.add_parser('seed', help='generate a synthetic school (default)')
+    seed_parser.add_argument('--students', type=int, default=50)
+    seed_parser.add_argument('--subjects', nargs='+', default=DEFAULT_SUBJECTS)
+    seed_parser.add_argument('--days', type=int, default=250, help='school days per student')
+    seed_parser.add_argument('--absence-rate', type=float, default=0.05)
+    seed_parser.add_argument('--seed', type=int, default=42, help='RNG seed')
+
+    import_parser = sub.add_parser('import-csv', help='import an attendance register')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--subjects', nargs='+', help='only accept these subjects')
+
+    # Running without a command seeds the default small school
+    parser.set_defaults(command='seed', students=50, subjects=DEFAULT_SUBJECTS, days=250,
+                        absence_rate=0.05, seed=42)
+
+    args = parser.parse_args()
+    if args.command == 'import-csv':
+        try:
+            import_csv(args.database, args.path, args.batch_size, args.subjects)
+        except InvalidRegister as e:
+            for error in e.errors:
+                print(f"{args.path}:{error['row']}: {error['error']}", file=sys.stderr)
+            sys.exit(f'Nothing imported ({e})')
+    else:
+        seed(args.database, args.students, args.subjects, args.days, args.absence_rate,
+             args.seed, args.batch_size)
 
 if __name__ == '__main__':
-    init_db()
-    print("Database initialized successfully!")
+    main()
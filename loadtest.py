@@ -0,0 +1,450 @@
+import argparse
+import http.client
+import io
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PASSWORD = 'password123'  # what init_db seeds every student with
+
+# Pages served without logging in (/syllabus and /documents need a student
+# and are tasks of their own)
+PUBLIC_PAGES = ['/', '/home', '/about', '/gallery', '/events', '/announcements', '/contact',
+                '/leadership', '/students']
+
+
+# One virtual user: a keep-alive connection plus its own cookies
+class User:
+    def __init__(self, host, port, roll_number):
+        self.host = host
+        self.port = port
+        self.roll_number = roll_number
+        self.cookies = {}
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            raise
+        for name, value in response.getheaders():
+            if name.lower() == 'set-cookie':
+                cookie = value.split(';', 1)[0]
+                key, _, val = cookie.partition('=')
+                if val and 'expires=thu, 01 jan 1970' not in value.lower():
+                    self.cookies[key.strip()] = val
+                else:
+                    self.cookies.pop(key.strip(), None)
+        if response.getheader('Connection', '').lower() == 'close':
+            self.conn.close()
+        return response.status
+
+
+def _ok(status):
+    return 200 <= status < 400
+
+
+# Tasks: (label, callable(user, state) -> True on success). Labels are the
+# endpoint names, which is what baselines are keyed on.
+
+def login(user, state):
+    user.cookies.clear()
+    status = user.request('POST', '/student/login',
+                          urlencode({'roll_number': user.roll_number, 'password': PASSWORD}),
+                          {'Content-Type': 'application/x-www-form-urlencoded'})
+    return status == 302  # success redirects to the dashboard
+
+
+# Pages behind the student login: a redirect means the session was lost
+def get(path):
+    def task(user, state):
+        return user.request('GET', path) == 200
+    return task
+
+
+def public_page(user, state):
+    return _ok(user.request('GET', state['rng'].choice(PUBLIC_PAGES)))
+
+
+def _sample_jpeg():
+    from PIL import Image
+    image = Image.new('RGB', (640, 640), (30, 90, 160))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def _upload_body(state):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="photo.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + state['jpeg'] + f'\r\n--{boundary}--\r\n'.encode()
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+def upload_profile_pic(user, state):
+    body, headers = _upload_body(state)
+    return _ok(user.request('POST', '/upload_profile_pic', body, headers))
+
+
+# The same upload from a phone on a poor connection: the body trickles in
+# over about SLOW_UPLOAD_SECONDS
+SLOW_UPLOAD_SECONDS = 2.0
+SLOW_UPLOAD_CHUNKS = 8
+
+
+def upload_profile_pic_slow(user, state):
+    body, headers = _upload_body(state)
+    size = -(-len(body) // SLOW_UPLOAD_CHUNKS)
+
+    def trickle():
+        for i in range(0, len(body), size):
+            time.sleep(SLOW_UPLOAD_SECONDS / SLOW_UPLOAD_CHUNKS)
+            yield body[i:i + size]
+
+    headers['Content-Length'] = str(len(body))
+    return _ok(user.request('POST', '/upload_profile_pic', trickle(), headers))
+
+
+def mark_notifications_read(user, state):
+    return _ok(user.request('POST', '/api/notifications/read', '{}', {'Content-Type': 'application/json'}))
+
+
+TASKS = {
+    'student_login': login,
+    'student_dashboard': get('/student/dashboard'),
+    'get_attendance_data': get('/get_attendance_data'),
+    'fees': get('/fees'),
+    'fee_payments': get('/api/fees/payments'),
+    'notification_list': get('/api/notifications'),
+    'notification_read': mark_notifications_read,
+    'attendance': get('/attendance'),
+    'results': get('/results'),
+    'analysis': get('/analysis'),
+    'routine': get('/routine'),
+    'syllabus': get('/syllabus'),
+    'documents': get('/documents'),
+    'upload_profile_pic': upload_profile_pic,
+    'upload_profile_pic_slow': upload_profile_pic_slow,
+    'public_page': public_page,
+}
+
+# Mix name -> (log in first?, [(task, weight)])
+MIXES = {
+    'login-storm': (False, [('student_login', 1)]),
+    'dashboard': (True, [('student_dashboard', 6), ('get_attendance_data', 3), ('notification_list', 1)]),
+    'attendance-poll': (True, [('get_attendance_data', 1)]),
+    'uploads': (True, [('upload_profile_pic', 1)]),
+    # Phones polling JSON while some of them upload over slow links
+    'mobile': (True, [('get_attendance_data', 12), ('notification_list', 4), ('notification_read', 1),
+                      ('upload_profile_pic_slow', 1)]),
+    'public': (False, [('public_page', 1)]),
+    'mixed': (True, [('student_dashboard', 20), ('get_attendance_data', 20), ('public_page', 20),
+                     ('notification_list', 8), ('fees', 5), ('fee_payments', 5), ('results', 5),
+                     ('attendance', 4), ('analysis', 3), ('routine', 3), ('notification_read', 2),
+                     ('syllabus', 1), ('documents', 1), ('student_login', 3), ('upload_profile_pic', 2)]),
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def run_load(host, port, mix, users, duration, students, ramp, rng_seed):
+    needs_login, weights = MIXES[mix]
+    labels = [label for label, _ in weights]
+    counts = [weight for _, weight in weights]
+    results = []  # one {label: [latencies, errors]} per user, merged at the end
+    start_gate = threading.Barrier(users + 1)
+    jpeg = _sample_jpeg() if any(label.startswith('upload_profile_pic') for label in labels) else None
+
+    def virtual_user(n):
+        rng = random.Random(rng_seed + n)
+        user = User(host, port, f'S{n % students + 1:06d}')
+        state = {'rng': rng, 'jpeg': jpeg}
+        stats = {}
+        results.append(stats)
+        start_gate.wait()
+        time.sleep(ramp * n / users)
+        if needs_login:
+            login(user, state)
+        while time.perf_counter() < deadline:
+            label = rng.choices(labels, counts)[0]
+            started = time.perf_counter()
+            try:
+                ok = TASKS[label](user, state)
+            except (http.client.HTTPException, OSError):
+                ok = False
+            elapsed = time.perf_counter() - started
+            entry = stats.setdefault(label, [[], 0])
+            entry[0].append(elapsed)
+            if not ok:
+                entry[1] += 1
+
+    threads = [threading.Thread(target=virtual_user, args=(n,), daemon=True) for n in range(users)]
+    for thread in threads:
+        thread.start()
+    deadline = time.perf_counter() + ramp + duration
+    start_gate.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - began
+
+    merged = {}
+    for stats in results:
+        for label, (latencies, errors) in stats.items():
+            entry = merged.setdefault(label, [[], 0])
+            entry[0].extend(latencies)
+            entry[1] += errors
+
+    report = {}
+    for label, (latencies, errors) in sorted(merged.items()):
+        latencies.sort()
+        report[label] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'rps': round(len(latencies) / wall, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"{'route':<22} {'reqs':>7} {'errors':>7} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, row in report.items():
+        print(f"{label:<22} {row['requests']:>7} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f}")
+
+
+# A route regresses when its p95 is more than `tolerance` above the baseline
+# (plus slack_ms, so sub-millisecond routes don't flap) or its error rate
+# grows by more than a percentage point
+def compare(report, baseline, tolerance, slack_ms):
+    failures = []
+    for label, base in baseline['routes'].items():
+        row = report.get(label)
+        if row is None:
+            continue
+        limit = base['p95_ms'] * (1 + tolerance) + slack_ms
+        if row['p95_ms'] > limit:
+            failures.append(f"{label}: p95 {row['p95_ms']:.1f} ms > {limit:.1f} ms "
+                            f"(baseline {base['p95_ms']:.1f} ms)")
+        base_rate = base['errors'] / base['requests'] if base['requests'] else 0
+        rate = row['errors'] / row['requests'] if row['requests'] else 0
+        if rate > base_rate + 0.01:
+            failures.append(f"{label}: error rate {rate:.1%} (baseline {base_rate:.1%})")
+    return failures
+
+
+def seed_database(path, students, days, rng_seed):
+    from init_db import DEFAULT_SUBJECTS, seed
+    seed(path, students, DEFAULT_SUBJECTS, days, 0.05, rng_seed, 50000)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on {host}:{port} did not start')
+
+
+# Internal: the app under werkzeug's threaded server, in its own process so
+# the load generator doesn't compete with it for the GIL
+# --threads N caps the threads that run requests, like a gthread worker or
+# an ASGI server's thread pool; 0 means the WSGI server starts a thread per
+# connection and the ASGI server uses asyncio's default pool.
+def serve(args):
+    import passwords
+    from app import app
+
+    # Every virtual user logs in from 127.0.0.1, so lift the login throttle
+    app.extensions['login_throttles'] = {
+        name: passwords.LoginThrottle(10 ** 9, 60) for name in ('roll_number', 'ip')}
+    if args.server == 'asgi':
+        _serve_asgi(args.port, args.threads)
+    else:
+        _serve_wsgi(app, args.port, args.threads)
+
+
+def _serve_wsgi(app, port, threads):
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+    WSGIRequestHandler.log_request = lambda *a, **kw: None
+    if not threads:
+        WSGIRequestHandler.protocol_version = 'HTTP/1.1'  # keep-alive
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+        return
+
+    # A fixed pool of request threads. Connections close after each response
+    # (HTTP/1.0) so an idle keep-alive connection doesn't hold a thread.
+    class PooledWSGIServer(BaseWSGIServer):
+        pool = ThreadPoolExecutor(threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    PooledWSGIServer('127.0.0.1', port, app).serve_forever()
+
+
+def _serve_asgi(port, threads):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    import uvicorn
+    from asgi import application
+
+    async def main():
+        if threads:
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(threads))
+        config = uvicorn.Config(application, host='127.0.0.1', port=port, log_level='warning', access_log=False)
+        await uvicorn.Server(config).serve()
+
+    asyncio.run(main())
+
+
+# server 'gevent' is the event stream server from gunicorn_events.conf.py
+# (threads doesn't apply), here serving the whole app: with the in-memory
+# event backend, logins and broadcasts have to reach the process holding the
+# streams. The login throttle is lifted through its settings instead.
+# settings are extra environment variables for the app.
+def start_server(database, server='wsgi', threads=0, settings=None):
+    port = _free_port()
+    env = dict(os.environ, SCHOOL_DB=database, SESSION_BACKEND='sqlite', **(settings or {}))
+    if server == 'gevent':
+        env.update(LOGIN_LIMIT_PER_ROLL_NUMBER=str(10 ** 9), LOGIN_LIMIT_PER_IP=str(10 ** 9),
+                   SERVE_ONLY_EVENTS='0')
+        command = [sys.executable, '-m', 'gunicorn', '--config', os.path.join(BASE_DIR, 'gunicorn_events.conf.py'),
+                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    else:
+        command = [sys.executable, os.path.join(BASE_DIR, 'loadtest.py'), 'serve',
+                   '--port', str(port), '--server', server, '--threads', str(threads)]
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env)
+    try:
+        _wait_for('127.0.0.1', port)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process, port
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if args.url:
+            parts = urlsplit(args.url)
+            host, port = parts.hostname, parts.port or 80
+        else:
+            database = args.database or os.path.join(tmp, 'load.db')
+            if not args.database or not os.path.exists(database):
+                print(f"Seeding {args.students} students x {args.days} days into {database}")
+                seed_database(database, args.students, args.days, args.seed)
+            host = '127.0.0.1'
+            server, port = start_server(database, args.server, args.threads)
+        try:
+            _wait_for(host, port)
+            print(f"Mix '{args.mix}': {args.users} users for {args.duration}s")
+            report = run_load(host, port, args.mix, args.users, args.duration,
+                              args.students, args.ramp, args.seed)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    print_report(report)
+    config = {'mix': args.mix, 'users': args.users, 'students': args.students, 'days': args.days}
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(dict(config, routes=report), f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        mismatched = [key for key, value in config.items() if baseline.get(key) != value]
+        if mismatched:
+            print(f"Warning: baseline was recorded with different {', '.join(mismatched)}")
+        failures = compare(report, baseline, args.tolerance, args.slack_ms)
+        if failures:
+            print('REGRESSIONS:')
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the school portal')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = sub.add_parser('run', help='seed a dataset, start the app and drive a traffic mix')
+    run_parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    run_parser.add_argument('--users', type=int, default=20)
+    run_parser.add_argument('--duration', type=float, default=30, help='seconds of load after ramp-up')
+    run_parser.add_argument('--ramp', type=float, default=2, help='seconds to start all users')
+    run_parser.add_argument('--students', type=int, default=1000)
+    run_parser.add_argument('--days', type=int, default=60, help='attendance days per student')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--database', help='reuse (or create) this database instead of a temporary one')
+    run_parser.add_argument('--url', help='drive an already running server instead of starting one')
+    run_parser.add_argument('--server', choices=['wsgi', 'asgi', 'gevent'], default='wsgi')
+    run_parser.add_argument('--threads', type=int, default=0, help='request threads (0: unbounded)')
+    run_parser.add_argument('--save-baseline', metavar='PATH')
+    run_parser.add_argument('--baseline', metavar='PATH', help='fail if a route regressed against PATH')
+    run_parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 growth (0.25 = 25%%)')
+    run_parser.add_argument('--slack-ms', type=float, default=5.0)
+    run_parser.set_defaults(func=run)
+
+    serve_parser = sub.add_parser('serve', help=argparse.SUPPRESS)
+    serve_parser.add_argument('--port', type=int, required=True)
+    serve_parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    serve_parser.add_argument('--threads', type=int, default=0)
+    serve_parser.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
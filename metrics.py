@@ -0,0 +1,296 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from flask import before_render_template, current_app, g, request, template_rendered
+
+# Request latency, SQL and template timing, exported in the Prometheus text
+# format. Everything is kept per worker process; Prometheus sums workers.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+MAX_CAPTURED_QUERIES = 50
+
+slow_log = logging.getLogger('school.slow_requests')
+profile_log = logging.getLogger('school.profile')
+
+# The QueryLog of the request running in this thread (or greenlet), if any
+_query_log = contextvars.ContextVar('query_log', default=None)
+
+
+class QueryLog:
+    def __init__(self, capture=False):
+        self.count = 0
+        self.time = 0.0
+        self.capture = capture
+        self.statements = []
+
+    def record(self, sql, elapsed):
+        self.count += 1
+        self.time += elapsed
+        if self.capture and len(self.statements) < MAX_CAPTURED_QUERIES:
+            self.statements.append((' '.join(sql.split()), elapsed))
+
+
+def _timed(method):
+    def wrapper(self, sql, *args):
+        log = _query_log.get()
+        if log is None:
+            return method(self, sql, *args)
+        start = time.perf_counter()
+        try:
+            return method(self, sql, *args)
+        finally:
+            log.record(sql, time.perf_counter() - start)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+
+# Connection factory for the pool. Statements are timed up to the first row;
+# a large fetchall after execute isn't included.
+class InstrumentedCursor(sqlite3.Cursor):
+    execute = _timed(sqlite3.Cursor.execute)
+    executemany = _timed(sqlite3.Cursor.executemany)
+    executescript = _timed(sqlite3.Cursor.executescript)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute doesn't go through cursor(), so route the
+    # shortcuts explicitly
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter()     # (endpoint, method, status) -> count
+        self.latency = {}             # (endpoint, method) -> Histogram
+        self.sql_queries = {}         # endpoint -> Histogram of statements per request
+        self.sql_time = {}            # endpoint -> Histogram of SQL seconds per request
+        self.render_time = {}         # template -> Histogram
+        self.slow_requests = 0
+        self._gauges = []
+
+    def _histogram(self, table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def observe_request(self, endpoint, method, status, duration, query_log):
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            self._histogram(self.latency, (endpoint, method), LATENCY_BUCKETS).observe(duration)
+            self._histogram(self.sql_queries, endpoint, QUERY_COUNT_BUCKETS).observe(query_log.count)
+            self._histogram(self.sql_time, endpoint, LATENCY_BUCKETS).observe(query_log.time)
+
+    def observe_render(self, template, duration):
+        with self._lock:
+            self._histogram(self.render_time, template, LATENCY_BUCKETS).observe(duration)
+
+    # collect() returns the current value; called on every scrape
+    def add_gauge(self, name, help, collect):
+        self._gauges.append((name, help, collect))
+
+    def render(self):
+        lines = []
+
+        def histogram(name, help, table, label_names):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for key, hist in sorted(table.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = _labels(**dict(zip(label_names, key)))
+                cumulative = 0
+                for bound, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'{name}_sum{{{labels}}} {hist.sum}')
+                lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+        with self._lock:
+            lines.append('# HELP school_http_requests_total Requests handled, by endpoint and status.')
+            lines.append('# TYPE school_http_requests_total counter')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                labels = _labels(endpoint=endpoint, method=method, status=status)
+                lines.append(f'school_http_requests_total{{{labels}}} {count}')
+            histogram('school_http_request_duration_seconds', 'Request latency.',
+                      self.latency, ('endpoint', 'method'))
+            histogram('school_sql_queries_per_request', 'SQL statements executed per request.',
+                      self.sql_queries, ('endpoint',))
+            histogram('school_sql_seconds_per_request', 'Time spent in SQL per request.',
+                      self.sql_time, ('endpoint',))
+            histogram('school_template_render_seconds', 'Jinja render time.',
+                      self.render_time, ('template',))
+            lines.append('# HELP school_slow_requests_total Requests slower than SLOW_REQUEST_MS.')
+            lines.append('# TYPE school_slow_requests_total counter')
+            lines.append(f'school_slow_requests_total {self.slow_requests}')
+
+        for name, help, collect in self._gauges:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {collect()}')
+        return '\n'.join(lines) + '\n'
+
+
+class StackSampler:
+    # Default profiler: a side thread looks at the request thread's stack
+    # every `interval` seconds. stop() returns collapsed stacks, one
+    # "outer;inner count" line each, ready for flamegraph.pl or speedscope.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return '\n'.join(f'{stack} {count}' for stack, count in self.samples.most_common())
+
+
+def get_metrics(app=None):
+    app = app or current_app
+    return app.extensions['metrics']
+
+
+# Swap in another profiler (e.g. pyinstrument): factory() must return an
+# object with start() and stop() -> printable report
+def set_profiler(app, factory):
+    app.extensions['metrics_profiler'] = factory
+
+
+def _before_request():
+    app = current_app._get_current_object()
+    profiler = None
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        profiler = app.extensions['metrics_profiler']()
+        profiler.start()
+    g.metrics_start = time.perf_counter()
+    g.metrics_render_time = 0.0
+    g.metrics_profiler = profiler
+    _query_log.set(QueryLog(capture=bool(app.config['SLOW_REQUEST_MS'])))
+
+
+def _after_request(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+# Teardown rather than after_request so the session save is counted too
+def _teardown_request(exc=None):
+    start = g.pop('metrics_start', None)
+    query_log = _query_log.get()
+    _query_log.set(None)
+    if start is None or query_log is None:
+        return
+    duration = time.perf_counter() - start
+    app = current_app._get_current_object()
+    endpoint = request.endpoint or '<unmatched>'
+    status = g.pop('metrics_status', 500)
+    metrics = get_metrics(app)
+    metrics.observe_request(endpoint, request.method, status, duration, query_log)
+
+    report = None
+    profiler = g.pop('metrics_profiler', None)
+    if profiler is not None:
+        report = profiler.stop()
+        profile_log.info('%s %s %.1fms\n%s', request.method, request.path, duration * 1000, report)
+
+    threshold = app.config['SLOW_REQUEST_MS']
+    if threshold and duration * 1000 >= threshold:
+        with metrics._lock:
+            metrics.slow_requests += 1
+        slow_log.warning(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': status,
+            'ms': round(duration * 1000, 1),
+            'sql_count': query_log.count,
+            'sql_ms': round(query_log.time * 1000, 1),
+            'render_ms': round(g.get('metrics_render_time', 0.0) * 1000, 1),
+            'queries': [{'sql': sql, 'ms': round(elapsed * 1000, 2)} for sql, elapsed in query_log.statements],
+            'profiled': report is not None,
+        }))
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('metrics_render_starts', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get('metrics_render_starts')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    g.metrics_render_time = g.get('metrics_render_time', 0.0) + duration
+    get_metrics(sender).observe_render(template.name or '<string>', duration)
+
+
+def init_app(app):
+    app.config.setdefault('SLOW_REQUEST_MS', 0)        # 0 disables the slow request log
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)  # fraction of requests to profile
+    app.config.setdefault('PROFILE_INTERVAL_MS', 5)
+
+    interval = app.config['PROFILE_INTERVAL_MS'] / 1000.0
+    app.extensions['metrics'] = Metrics()
+    app.extensions.setdefault('metrics_profiler', lambda: StackSampler(interval))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
@@ -0,0 +1,411 @@
+import sqlite3
+
+# Forward-only schema migrations. Each entry is (version, description, steps)
+# where a step is either an SQL string or a callable taking the connection.
+# Never edit a migration that has shipped; append a new one instead.
+MIGRATIONS = [
+    (1, 'initial schema', [
+        '''CREATE TABLE IF NOT EXISTS student (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            roll_number TEXT UNIQUE NOT NULL,
+            class_name TEXT,
+            section TEXT,
+            email TEXT UNIQUE,
+            password_hash TEXT,
+            profile_pic TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            type TEXT DEFAULT 'info',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES student (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            due_date DATE,
+            subject TEXT,
+            class_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER,
+            date DATE NOT NULL,
+            subject TEXT NOT NULL,
+            status TEXT NOT NULL CHECK(status IN ('present', 'absent')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES student (id)
+        )''',
+    ]),
+    (2, 'indexes for dashboard and attendance queries', [
+        # Covers every attendance aggregate for a student without touching the table
+        'CREATE INDEX IF NOT EXISTS idx_attendance_student_date ON attendance (student_id, date, status, subject)',
+        'CREATE INDEX IF NOT EXISTS idx_notifications_student_created ON notifications (student_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_assignments_class_due ON assignments (class_name, due_date)',
+    ]),
+    (3, 'attendance rollup maintained by triggers', [
+        '''CREATE TABLE IF NOT EXISTS attendance_summary (
+            student_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            present_count INTEGER NOT NULL DEFAULT 0,
+            absent_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (student_id, month, subject)
+        ) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS attendance_summary_insert AFTER INSERT ON attendance
+        BEGIN
+            INSERT INTO attendance_summary (student_id, month, subject, present_count, absent_count)
+            VALUES (NEW.student_id, strftime('%Y-%m', NEW.date), NEW.subject,
+                    NEW.status = 'present', NEW.status = 'absent')
+            ON CONFLICT (student_id, month, subject) DO UPDATE SET
+                present_count = present_count + excluded.present_count,
+                absent_count = absent_count + excluded.absent_count;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS attendance_summary_delete AFTER DELETE ON attendance
+        BEGIN
+            UPDATE attendance_summary SET
+                present_count = present_count - (OLD.status = 'present'),
+                absent_count = absent_count - (OLD.status = 'absent')
+            WHERE student_id = OLD.student_id AND month = strftime('%Y-%m', OLD.date)
+            AND subject = OLD.subject;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS attendance_summary_update
+        AFTER UPDATE OF student_id, date, subject, status ON attendance
+        BEGIN
+            UPDATE attendance_summary SET
+                present_count = present_count - (OLD.status = 'present'),
+                absent_count = absent_count - (OLD.status = 'absent')
+            WHERE student_id = OLD.student_id AND month = strftime('%Y-%m', OLD.date)
+            AND subject = OLD.subject;
+            INSERT INTO attendance_summary (student_id, month, subject, present_count, absent_count)
+            VALUES (NEW.student_id, strftime('%Y-%m', NEW.date), NEW.subject,
+                    NEW.status = 'present', NEW.status = 'absent')
+            ON CONFLICT (student_id, month, subject) DO UPDATE SET
+                present_count = present_count + excluded.present_count,
+                absent_count = absent_count + excluded.absent_count;
+        END''',
+        # Backfill from existing rows
+        '''INSERT OR REPLACE INTO attendance_summary (student_id, month, subject, present_count, absent_count)
+        SELECT student_id, strftime('%Y-%m', date), subject,
+               SUM(status = 'present'), SUM(status = 'absent')
+        FROM attendance
+        GROUP BY student_id, strftime('%Y-%m', date), subject''',
+    ]),
+    (4, 'fees ledger with running balances', [
+        '''CREATE TABLE IF NOT EXISTS fee_structure (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            class_name TEXT NOT NULL,
+            academic_year TEXT NOT NULL,
+            fee_type TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            UNIQUE (class_name, academic_year, fee_type)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS invoice (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            academic_year TEXT NOT NULL,
+            description TEXT,
+            amount INTEGER NOT NULL,
+            due_date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES student (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS payment (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            academic_year TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            paid_at TIMESTAMP NOT NULL,
+            mode TEXT,
+            reference TEXT UNIQUE,
+            receipt_no TEXT UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (student_id) REFERENCES student (id)
+        )''',
+        # Running totals per student and year, written in the same
+        # transaction as every invoice and payment
+        '''CREATE TABLE IF NOT EXISTS fee_balance (
+            student_id INTEGER NOT NULL,
+            academic_year TEXT NOT NULL,
+            total_invoiced INTEGER NOT NULL DEFAULT 0,
+            total_paid INTEGER NOT NULL DEFAULT 0,
+            last_payment_at TIMESTAMP,
+            PRIMARY KEY (student_id, academic_year)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_invoice_student_due ON invoice (student_id, academic_year, due_date)',
+        'CREATE INDEX IF NOT EXISTS idx_payment_student ON payment (student_id, id)',
+    ]),
+    (5, 'exams, marks and precomputed results', [
+        '''CREATE TABLE IF NOT EXISTS exam (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            class_name TEXT NOT NULL,
+            academic_year TEXT,
+            exam_date DATE,
+            published INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS mark (
+            exam_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            marks_obtained INTEGER NOT NULL,
+            total_marks INTEGER NOT NULL DEFAULT 100,
+            PRIMARY KEY (exam_id, student_id, subject),
+            FOREIGN KEY (exam_id) REFERENCES exam (id),
+            FOREIGN KEY (student_id) REFERENCES student (id)
+        ) WITHOUT ROWID''',
+        # Written by the ranking job (grades.py), read as-is by the views
+        '''CREATE TABLE IF NOT EXISTS result (
+            exam_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            total_obtained INTEGER NOT NULL,
+            total_marks INTEGER NOT NULL,
+            percentage REAL NOT NULL,
+            grade TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            students_below INTEGER NOT NULL,
+            percentile REAL NOT NULL,
+            class_size INTEGER NOT NULL,
+            PRIMARY KEY (exam_id, student_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS subject_stats (
+            exam_id INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            average REAL,
+            highest INTEGER,
+            lowest INTEGER,
+            students INTEGER,
+            PRIMARY KEY (exam_id, subject)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_exam_class_date ON exam (class_name, exam_date)',
+        'CREATE INDEX IF NOT EXISTS idx_result_exam_total ON result (exam_id, total_obtained)',
+        'CREATE INDEX IF NOT EXISTS idx_result_student ON result (student_id, exam_id)',
+    ]),
+    (6, 'server-side session store', [
+        '''CREATE TABLE IF NOT EXISTS session_store (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_session_store_expires ON session_store (expires_at)',
+    ]),
+    (7, 'broadcast notifications with per-student delivery state', [
+        '''CREATE TABLE IF NOT EXISTS message (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            body TEXT NOT NULL,
+            type TEXT DEFAULT 'info',
+            class_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS notification_delivery (
+            student_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            read_at TIMESTAMP,
+            PRIMARY KEY (student_id, message_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS notification_counter (
+            student_id INTEGER PRIMARY KEY,
+            unread INTEGER NOT NULL DEFAULT 0
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_notification_delivery_message ON notification_delivery (message_id)',
+        # Carry over the old one-row-per-student notifications
+        '''INSERT INTO message (id, title, body, type, created_at)
+           SELECT id, title, message, type, created_at FROM notifications''',
+        '''INSERT INTO notification_delivery (student_id, message_id)
+           SELECT student_id, id FROM notifications WHERE student_id IS NOT NULL''',
+        '''INSERT INTO notification_counter (student_id, unread)
+           SELECT student_id, COUNT(*) FROM notification_delivery GROUP BY student_id''',
+    ]),
+    (8, 'one attendance mark per student, date and subject', [
+        # Keep the latest of any duplicates; the delete trigger fixes the rollup
+        '''DELETE FROM attendance WHERE id NOT IN (
+               SELECT MAX(id) FROM attendance GROUP BY student_id, date, subject)''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_unique ON attendance (student_id, date, subject)',
+    ]),
+    (9, 'students by class, section and roll number', [
+        'CREATE INDEX IF NOT EXISTS idx_student_class ON student (class_name, section, roll_number)',
+    ]),
+    (10, 'timetable, exam date sheets and compiled class schedules', [
+        '''CREATE TABLE IF NOT EXISTS teacher (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS room (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            capacity INTEGER
+        )''',
+        # Times are 'HH:MM', so they sort and compare as text
+        '''CREATE TABLE IF NOT EXISTS period (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS timetable_entry (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            class_name TEXT NOT NULL,
+            section TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            period_id INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            teacher_id INTEGER,
+            room_id INTEGER,
+            FOREIGN KEY (period_id) REFERENCES period (id),
+            FOREIGN KEY (teacher_id) REFERENCES teacher (id),
+            FOREIGN KEY (room_id) REFERENCES room (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS exam_paper (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            exam_id INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            topic TEXT,
+            paper_date DATE NOT NULL,
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            room_id INTEGER,
+            FOREIGN KEY (exam_id) REFERENCES exam (id),
+            FOREIGN KEY (room_id) REFERENCES room (id)
+        )''',
+        # Written by the timetable compiler (timetable.py), read as-is by the views
+        '''CREATE TABLE IF NOT EXISTS compiled_schedule (
+            class_name TEXT NOT NULL,
+            section TEXT NOT NULL,
+            data TEXT NOT NULL,
+            compiled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (class_name, section)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_timetable_entry_class ON timetable_entry (class_name, section, day)',
+        'CREATE INDEX IF NOT EXISTS idx_exam_paper_exam ON exam_paper (exam_id, paper_date)',
+    ]),
+    (11, 'full-text search over notifications and assignments', [
+        # rowid is message.id * 2 or assignments.id * 2 + 1; scope is 'all' or
+        # 'c' + hex(class_name) so class scoping happens inside the MATCH
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title, body, subject, scope, date UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )''',
+        # Titles weigh most, then subjects; scope never affects the score
+        "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0, 0.0)')",
+        '''CREATE TRIGGER IF NOT EXISTS message_search_insert AFTER INSERT ON message BEGIN
+               INSERT INTO search_index (rowid, title, body, subject, scope, date)
+               VALUES (NEW.id * 2, NEW.title, NEW.body, '',
+                       CASE WHEN NEW.class_name IS NULL THEN 'all' ELSE 'c' || lower(hex(NEW.class_name)) END,
+                       NEW.created_at);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS message_search_update AFTER UPDATE ON message BEGIN
+               DELETE FROM search_index WHERE rowid = OLD.id * 2;
+               INSERT INTO search_index (rowid, title, body, subject, scope, date)
+               VALUES (NEW.id * 2, NEW.title, NEW.body, '',
+                       CASE WHEN NEW.class_name IS NULL THEN 'all' ELSE 'c' || lower(hex(NEW.class_name)) END,
+                       NEW.created_at);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS message_search_delete AFTER DELETE ON message BEGIN
+               DELETE FROM search_index WHERE rowid = OLD.id * 2;
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS assignment_search_insert AFTER INSERT ON assignments BEGIN
+               INSERT INTO search_index (rowid, title, body, subject, scope, date)
+               VALUES (NEW.id * 2 + 1, NEW.title, coalesce(NEW.description, ''), coalesce(NEW.subject, ''),
+                       CASE WHEN NEW.class_name IS NULL THEN 'all' ELSE 'c' || lower(hex(NEW.class_name)) END,
+                       NEW.due_date);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS assignment_search_update AFTER UPDATE ON assignments BEGIN
+               DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+               INSERT INTO search_index (rowid, title, body, subject, scope, date)
+               VALUES (NEW.id * 2 + 1, NEW.title, coalesce(NEW.description, ''), coalesce(NEW.subject, ''),
+                       CASE WHEN NEW.class_name IS NULL THEN 'all' ELSE 'c' || lower(hex(NEW.class_name)) END,
+                       NEW.due_date);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS assignment_search_delete AFTER DELETE ON assignments BEGIN
+               DELETE FROM search_index WHERE rowid = OLD.id * 2 + 1;
+           END''',
+        '''INSERT INTO search_index (rowid, title, body, subject, scope, date)
+           SELECT id * 2, title, body, '', CASE WHEN class_name IS NULL THEN 'all'
+                                                 ELSE 'c' || lower(hex(class_name)) END, created_at
+           FROM message''',
+        '''INSERT INTO search_index (rowid, title, body, subject, scope, date)
+           SELECT id * 2 + 1, title, coalesce(description, ''), coalesce(subject, ''),
+                  CASE WHEN class_name IS NULL THEN 'all' ELSE 'c' || lower(hex(class_name)) END, due_date
+           FROM assignments''',
+    ]),
+    (12, 'student activity log', [
+        # Append-only; written in batches by activity.py
+        '''CREATE TABLE IF NOT EXISTS activity (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            detail TEXT NOT NULL DEFAULT '',
+            created_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (student_id) REFERENCES student (id)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_activity_student ON activity (student_id, id)',
+    ]),
+    (13, 'blank payment references stored as NULL', [
+        "UPDATE payment SET reference = NULL WHERE trim(reference) = ''",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+
+def current_version(conn):
+    try:
+        row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn, target=None):
+    # Returns the list of versions applied. When the database is already up to
+    # date this is a single indexed lookup, so worker boot stays constant time.
+    target = LATEST_VERSION if target is None else target
+    if current_version(conn) >= target:
+        return []
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    applied = []
+    try:
+        # BEGIN IMMEDIATE takes the write lock up front so workers booting
+        # together don't race each other through the same migration.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            _ensure_version_table(conn)
+            version = current_version(conn)
+            for number, description, steps in MIGRATIONS:
+                if number <= version or number > target:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                             (number, description))
+                applied.append(number)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
@@ -0,0 +1,90 @@
+from datetime import datetime
+
+import queries
+
+PAGE_SIZE = 20
+
+
+# A broadcast is one message row plus one small delivery row per recipient,
+# fanned out with a single INSERT ... SELECT rather than an INSERT per
+# student. Unread counters are bumped in the same statement style. Pass
+# student_ids, or class_name, or neither for the whole school.
+def broadcast(conn, title, message, type='info', class_name=None, student_ids=None):
+    if student_ids is not None:
+        placeholders = ','.join('?' * len(student_ids))
+        recipients = f'SELECT id FROM student WHERE id IN ({placeholders})'
+        params = tuple(student_ids)
+    elif class_name is not None:
+        recipients = 'SELECT id FROM student WHERE class_name = ?'
+        params = (class_name,)
+    else:
+        recipients = 'SELECT id FROM student WHERE 1'
+        params = ()
+
+    with conn:
+        c = conn.execute('''INSERT INTO message (title, body, type, class_name)
+                            VALUES (?, ?, ?, ?)''', (title, message, type, class_name))
+        message_id = c.lastrowid
+        delivered = conn.execute(f'''INSERT INTO notification_delivery (student_id, message_id)
+                                     SELECT id, ? FROM ({recipients})''',
+                                 (message_id,) + params).rowcount
+        conn.execute('''INSERT INTO notification_counter (student_id, unread)
+                         SELECT student_id, 1 FROM notification_delivery
+                         WHERE message_id = ?
+                         ON CONFLICT (student_id) DO UPDATE SET unread = unread + 1''',
+                     (message_id,))
+    return message_id, delivered
+
+
+def notify_student(conn, student_id, title, message, type='info'):
+    return broadcast(conn, title, message, type, student_ids=[student_id])[0]
+
+
+def unread_count(conn, student_id):
+    row = conn.execute(queries.UNREAD_COUNT, (student_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def _format(row):
+    message_id, title, body, type, created_at, read_at = row
+    return {
+        'id': message_id,
+        'title': title,
+        'message': body,
+        'type': type,
+        'created_at': created_at,  # formatted by the query
+        'read': read_at is not None
+    }
+
+
+# Latest notifications for a student, newest first. Walks the student's
+# (student_id, message_id) key backwards, so the cost doesn't depend on how
+# many broadcasts exist.
+def notification_page(conn, student_id, before=None, limit=PAGE_SIZE):
+    if before is None:
+        rows = conn.execute(queries.NOTIFICATIONS_FIRST_PAGE, (student_id, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(queries.NOTIFICATIONS_PAGE, (student_id, before, limit + 1)).fetchall()
+    items = [_format(row) for row in rows[:limit]]
+    next_cursor = items[-1]['id'] if len(rows) > limit else None
+    return items, next_cursor
+
+
+# Mark the given messages (or everything) read and keep the counter in step
+def mark_read(conn, student_id, message_ids=None):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with conn:
+        if message_ids is None:
+            changed = conn.execute('''UPDATE notification_delivery SET read_at = ?
+                                      WHERE student_id = ? AND read_at IS NULL''',
+                                   (now, student_id)).rowcount
+        else:
+            placeholders = ','.join('?' * len(message_ids))
+            changed = conn.execute(f'''UPDATE notification_delivery SET read_at = ?
+                                       WHERE student_id = ? AND read_at IS NULL
+                                       AND message_id IN ({placeholders})''',
+                                   (now, student_id, *message_ids)).rowcount
+        if changed:
+            conn.execute('UPDATE notification_counter SET unread = max(unread - ?, 0) WHERE student_id = ?',
+                         (changed, student_id))
+    return changed
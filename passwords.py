@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from tenants import namespace
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class HashingPool:
+    # PBKDF2/scrypt in hashlib release the GIL, so a small thread pool gets
+    # real parallelism. The semaphore caps queued work so a login storm is
+    # turned away quickly instead of piling up behind every request thread.
+    def __init__(self, workers=2, max_queue=32, timeout=5.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pwhash')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy()
+        with self._lock:
+            self.submitted += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise HashingBusy()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+
+class LoginThrottle:
+    # Sliding window of attempt timestamps per key (roll number or IP).
+    # allow(key, record=False) only checks; attempts are then counted with
+    # record(), e.g. failures only.
+    def __init__(self, limit, window=60.0):
+        self.limit = limit
+        self.window = window
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.throttled = 0
+
+    def allow(self, key, record=True):
+        now = time.monotonic()
+        cutoff = now - self.window
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if attempts is not None:
+                while attempts and attempts[0] < cutoff:
+                    attempts.popleft()
+                if len(attempts) >= self.limit:
+                    self.throttled += 1
+                    return False
+            if record:
+                self._record(key, now, cutoff)
+            return True
+
+    def record(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._record(key, now, now - self.window)
+
+    def _record(self, key, now, cutoff):
+        self._attempts.setdefault(key, deque()).append(now)
+        self._calls += 1
+        if self._calls % 1000 == 0:
+            self._sweep(cutoff)
+
+    def _sweep(self, cutoff):
+        stale = [key for key, attempts in self._attempts.items() if not attempts or attempts[-1] < cutoff]
+        for key in stale:
+            del self._attempts[key]
+
+
+def _hash_prefix(pwhash):
+    # "pbkdf2:sha256:600000$salt$hash" -> "pbkdf2:sha256:600000"
+    return pwhash.split('$', 1)[0]
+
+
+def _method_prefix(method):
+    # Fully expanded parameters for a configured method ("scrypt" ->
+    # "scrypt:32768:8:1"), found by hashing a dummy value
+    return _hash_prefix(generate_password_hash('', method))
+
+
+def get_hashing_pool():
+    return current_app.extensions['hashing_pool']
+
+
+# Every attempt counts against the roll number. Only failures count against
+# the client address: behind a proxy or a school's NAT a whole school shares
+# one, and its successful logins at 8am must not lock everyone else out.
+# Keys carry the tenant, since roll numbers repeat across schools.
+def login_allowed(roll_number, ip):
+    throttles = current_app.extensions['login_throttles']
+    prefix = namespace()
+    return (throttles['ip'].allow(prefix + (ip or ''), record=False)
+            and throttles['roll_number'].allow(prefix + (roll_number or '')))
+
+
+def login_failed(ip):
+    current_app.extensions['login_throttles']['ip'].record(namespace() + (ip or ''))
+
+
+def verify_password(pwhash, password):
+    return get_hashing_pool().run(check_password_hash, pwhash, password)
+
+
+def hash_password(password):
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    return get_hashing_pool().run(generate_password_hash, password, method)
+
+
+# True when a stored hash was made with other parameters than the configured
+# method, so it can be upgraded transparently at the next successful login.
+# A string comparison: the configured prefix is worked out once at startup.
+def needs_rehash(pwhash):
+    return _hash_prefix(pwhash) != current_app.extensions['password_hash_prefix']
+
+
+def init_app(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)
+    app.config.setdefault('PASSWORD_HASH_QUEUE', 32)
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5.0)
+    app.config.setdefault('LOGIN_LIMIT_PER_ROLL_NUMBER', 5)
+    app.config.setdefault('LOGIN_LIMIT_PER_IP', 30)
+    app.config.setdefault('LOGIN_LIMIT_WINDOW', 60)
+
+    app.extensions['hashing_pool'] = HashingPool(
+        workers=int(app.config['PASSWORD_HASH_WORKERS']),
+        max_queue=int(app.config['PASSWORD_HASH_QUEUE']),
+        timeout=float(app.config['PASSWORD_HASH_TIMEOUT']),
+    )
+    app.extensions['password_hash_prefix'] = _method_prefix(app.config['PASSWORD_HASH_METHOD'])
+    window = float(app.config['LOGIN_LIMIT_WINDOW'])
+    app.extensions['login_throttles'] = {
+        'roll_number': LoginThrottle(int(app.config['LOGIN_LIMIT_PER_ROLL_NUMBER']), window),
+        'ip': LoginThrottle(int(app.config['LOGIN_LIMIT_PER_IP']), window),
+    }
@@ -0,0 +1,234 @@
+import json
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+
+from tenants import namespace
+
+try:
+    import redis
+except ImportError:  # optional backend
+    redis = None
+
+# Server-sent events. Each worker process keeps one Broker; every open
+# /api/events stream is a Subscription on a few channels:
+#
+#   school            announcements for everyone
+#   class:<name>      new assignments and class-wide notices
+#   student:<id>      personal notifications, attendance changes
+#
+# Channel names carry the tenant's namespace ('oakridge/class:10'), so
+# schools sharing a worker or a Redis server never see each other's events.
+#
+# An idle stream is a blocked wait on a Condition, so serve /api/events from
+# gevent workers (gunicorn_events.conf.py, `python bench.py events`) to hold
+# thousands of them; on a threaded server or the ASGI executor each stream
+# pins a thread. threading and time are cooperative once gevent has
+# monkey-patched them.
+
+RESET = object()
+
+
+def school_channel():
+    return f'{namespace()}school'
+
+
+def class_channel(class_name):
+    return f'{namespace()}class:{class_name}'
+
+
+def student_channel(student_id):
+    return f'{namespace()}student:{student_id}'
+
+
+def format_event(event, data, event_id=None):
+    frame = f'event: {event}\n'
+    if event_id is not None:
+        frame += f'id: {event_id}\n'
+    return frame + f'data: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+
+class Subscription:
+    # Bounded per-client buffer. A client that falls max_queue events behind
+    # is cut off with a reset event instead of buffering without limit; it
+    # reconnects and re-reads current state over the normal JSON endpoints.
+    def __init__(self, channels, max_queue=100):
+        self.channels = tuple(channels)
+        self.max_queue = max_queue
+        self.overflowed = False
+        self._frames = deque()
+        self._ready = threading.Condition(threading.Lock())
+
+    def push(self, frame):
+        with self._ready:
+            if self.overflowed:
+                return False
+            if len(self._frames) >= self.max_queue:
+                self._frames.clear()
+                self.overflowed = True
+            else:
+                self._frames.append(frame)
+            self._ready.notify()
+            return not self.overflowed
+
+    # Next frame, RESET once overflowed, or None if nothing arrived in time
+    def pop(self, timeout):
+        with self._ready:
+            if not self._frames and not self.overflowed:
+                self._ready.wait(timeout)
+            if self._frames:
+                return self._frames.popleft()
+            return RESET if self.overflowed else None
+
+
+class Broker:
+    def __init__(self, max_queue=100, max_subscribers=10000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.subscribers = 0
+        self.published = 0
+        self.delivered = 0
+        self.overflowed = 0
+        self.rejected = 0
+
+    # Returns None when the process is already holding max_subscribers streams
+    def subscribe(self, channels):
+        subscription = Subscription(channels, self.max_queue)
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                self.rejected += 1
+                return None
+            self.subscribers += 1
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            removed = False
+            for channel in subscription.channels:
+                members = self._channels.get(channel)
+                if members and subscription in members:
+                    members.discard(subscription)
+                    removed = True
+                    if not members:
+                        del self._channels[channel]
+            if removed:
+                self.subscribers -= 1
+
+    # The frame is encoded once and the same string handed to every
+    # subscriber, so fan-out cost is a deque append per client
+    def publish(self, channel, event, data):
+        with self._lock:
+            self._next_id += 1
+            frame = format_event(event, data, self._next_id)
+            members = list(self._channels.get(channel, ()))
+            self.published += 1
+        delivered = overflowed = 0
+        for subscription in members:
+            if subscription.overflowed:
+                continue  # already cut off, waiting for its stream to end
+            if subscription.push(frame):
+                delivered += 1
+            else:
+                overflowed += 1
+        with self._lock:
+            self.delivered += delivered
+            self.overflowed += overflowed
+        return delivered
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'memory',
+                'subscribers': self.subscribers,
+                'channels': len(self._channels),
+                'published': self.published,
+                'delivered': self.delivered,
+                'overflowed': self.overflowed,
+                'rejected': self.rejected,
+            }
+
+
+class RedisBroker(Broker):
+    # Several workers: publishes go through a redis channel and one listener
+    # thread per process fans them out to the local subscribers
+    def __init__(self, url='redis://localhost:6379/0', topic='school:events', **kwargs):
+        if redis is None:
+            raise RuntimeError('EVENTS_BACKEND=redis requires the redis package')
+        super().__init__(**kwargs)
+        self.client = redis.Redis.from_url(url)
+        self.topic = topic
+        self._listener = threading.Thread(target=self._listen, name='events-listener', daemon=True)
+        self._listener.start()
+
+    def publish(self, channel, event, data):
+        self.client.publish(self.topic, json.dumps([channel, event, data]))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.topic)
+                for message in pubsub.listen():
+                    channel, event, data = json.loads(message['data'])
+                    Broker.publish(self, channel, event, data)
+            except redis.RedisError:
+                time.sleep(1)
+
+    def stats(self):
+        stats = super().stats()
+        stats['backend'] = 'redis'
+        return stats
+
+
+# Generator for the response body. It only holds the subscription, never a
+# database connection or the request context.
+def stream(broker, subscription, heartbeat=15):
+    try:
+        # Tell EventSource how long to wait before reconnecting
+        yield 'retry: 5000\n\n'
+        while True:
+            frame = subscription.pop(heartbeat)
+            if frame is None:
+                # Comment line keeps proxies from timing out the idle stream
+                yield ': keepalive\n\n'
+            elif frame is RESET:
+                yield format_event('reset', {'reason': 'too far behind'})
+                return
+            else:
+                yield frame
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def get_broker(app=None):
+    app = app or current_app
+    return app.extensions['events']
+
+
+def publish(channel, event, data):
+    return get_broker().publish(channel, event, data)
+
+
+def init_app(app):
+    app.config.setdefault('EVENTS_BACKEND', 'memory')
+    app.config.setdefault('EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+    app.config.setdefault('EVENTS_MAX_QUEUE', 100)
+    app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', 10000)
+    app.config.setdefault('EVENTS_HEARTBEAT', 15)
+
+    options = {
+        'max_queue': int(app.config['EVENTS_MAX_QUEUE']),
+        'max_subscribers': int(app.config['EVENTS_MAX_SUBSCRIBERS']),
+    }
+    if app.config['EVENTS_BACKEND'] == 'redis':
+        broker = RedisBroker(app.config['EVENTS_REDIS_URL'], **options)
+    else:
+        broker = Broker(**options)
+    app.extensions['events'] = broker
@@ -0,0 +1,122 @@
+# SQL for the hot request paths. Views use these constants so that the
+# query-plan check below exercises exactly what production runs.
+
+# 'Oct 07, 2024' from an ISO date or timestamp column, same as Python's
+# strftime('%b %d, %Y') so rows come back ready to display
+def date_label(column):
+    return (f"substr('JanFebMarAprMayJunJulAugSepOctNovDec', strftime('%m', {column}) * 3 - 2, 3)"
+            f" || strftime(' %d, %Y', {column})")
+
+
+STUDENT_BY_ID = '''SELECT id, name, roll_number, class_name, section, email, profile_pic
+                   FROM student WHERE id = ?'''
+
+STUDENT_BY_ROLL_NUMBER = 'SELECT * FROM student WHERE roll_number = ?'
+
+STUDENT_ROLL_NUMBER = 'SELECT roll_number FROM student WHERE id = ?'
+
+NOTIFICATIONS_FIRST_PAGE = f'''SELECT m.id, m.title, m.body, m.type, {date_label('m.created_at')}, d.read_at
+                               FROM notification_delivery d JOIN message m ON m.id = d.message_id
+                               WHERE d.student_id = ? ORDER BY d.message_id DESC LIMIT ?'''
+
+NOTIFICATIONS_PAGE = f'''SELECT m.id, m.title, m.body, m.type, {date_label('m.created_at')}, d.read_at
+                         FROM notification_delivery d JOIN message m ON m.id = d.message_id
+                         WHERE d.student_id = ? AND d.message_id < ? ORDER BY d.message_id DESC LIMIT ?'''
+
+UNREAD_COUNT = 'SELECT unread FROM notification_counter WHERE student_id = ?'
+
+ATTENDANCE_SUMMARY = '''SELECT month, subject, present_count, absent_count
+                        FROM attendance_summary WHERE student_id = ?'''
+
+FEE_BALANCE = '''SELECT total_invoiced, total_paid FROM fee_balance
+                 WHERE student_id = ? AND academic_year = ?'''
+
+FEE_STRUCTURE = '''SELECT fee_type, amount FROM fee_structure
+                   WHERE class_name = ? AND academic_year = ? ORDER BY amount DESC'''
+
+NEXT_INVOICE_DUE = '''SELECT MIN(due_date) FROM invoice
+                      WHERE student_id = ? AND academic_year = ? AND due_date >= date('now')'''
+
+PAYMENTS_FIRST_PAGE = '''SELECT id, amount, paid_at, mode, receipt_no FROM payment
+                         WHERE student_id = ? ORDER BY id DESC LIMIT ?'''
+
+PAYMENTS_PAGE = '''SELECT id, amount, paid_at, mode, receipt_no FROM payment
+                   WHERE student_id = ? AND id < ? ORDER BY id DESC LIMIT ?'''
+
+LATEST_RESULTS = '''SELECT r.exam_id, e.name, r.total_obtained, r.total_marks, r.percentage,
+                           r.grade, r.rank, r.percentile, r.class_size
+                    FROM result r JOIN exam e ON e.id = r.exam_id
+                    WHERE r.student_id = ? AND e.published = 1
+                    ORDER BY e.exam_date DESC, e.id DESC LIMIT 2'''
+
+STUDENT_MARKS = '''SELECT subject, marks_obtained, total_marks FROM mark
+                   WHERE exam_id = ? AND student_id = ? ORDER BY subject'''
+
+COMPILED_SCHEDULE = 'SELECT data FROM compiled_schedule WHERE class_name = ? AND section = ?'
+
+RECENT_ACTIVITY = '''SELECT created_at, kind, detail FROM activity
+                     WHERE student_id = ? ORDER BY id DESC LIMIT ?'''
+
+
+# Everything the dashboard lists, in one statement. kind tells the branches
+# apart; flag is is_read for notifications and the count for 'unread'.
+DASHBOARD_FEED = f'''SELECT * FROM (
+    SELECT 'notification' AS kind, m.id, m.title, m.body, m.type AS detail,
+           {date_label('m.created_at')} AS date_label, d.read_at IS NOT NULL AS flag, -d.message_id AS seq
+    FROM notification_delivery d JOIN message m ON m.id = d.message_id
+    WHERE d.student_id = :student_id ORDER BY d.message_id DESC LIMIT :limit)
+UNION ALL
+SELECT * FROM (
+    SELECT 'assignment', a.id, a.title, a.description, a.subject,
+           {date_label('a.due_date')}, 0, julianday(a.due_date)
+    FROM assignments a
+    WHERE a.class_name = (SELECT class_name FROM student WHERE id = :student_id)
+    AND a.due_date >= date('now')
+    ORDER BY a.due_date LIMIT :limit)
+UNION ALL
+SELECT 'unread', NULL, NULL, NULL, NULL, NULL,
+       coalesce((SELECT unread FROM notification_counter WHERE student_id = :student_id), 0), 0
+ORDER BY kind, seq'''
+
+# name -> (sql, sample parameters) for every query on a hot path
+HOT_QUERIES = {
+    'student_by_id': (STUDENT_BY_ID, (1,)),
+    'student_by_roll_number': (STUDENT_BY_ROLL_NUMBER, ('DEMO001',)),
+    'student_roll_number': (STUDENT_ROLL_NUMBER, (1,)),
+    'notifications_first_page': (NOTIFICATIONS_FIRST_PAGE, (1, 6)),
+    'notifications_page': (NOTIFICATIONS_PAGE, (1, 100, 21)),
+    'unread_count': (UNREAD_COUNT, (1,)),
+    'dashboard_feed': (DASHBOARD_FEED, {'student_id': 1, 'limit': 5}),
+    'attendance_summary': (ATTENDANCE_SUMMARY, (1,)),
+    'fee_balance': (FEE_BALANCE, (1, '2024-2025')),
+    'fee_structure': (FEE_STRUCTURE, ('10', '2024-2025')),
+    'next_invoice_due': (NEXT_INVOICE_DUE, (1, '2024-2025')),
+    'payments_first_page': (PAYMENTS_FIRST_PAGE, (1, 21)),
+    'payments_page': (PAYMENTS_PAGE, (1, 100, 21)),
+    'latest_results': (LATEST_RESULTS, (1,)),
+    'student_marks': (STUDENT_MARKS, (1, 1)),
+    'compiled_schedule': (COMPILED_SCHEDULE, ('10', 'A')),
+    'recent_activity': (RECENT_ACTIVITY, (1, 10)),
+}
+
+
+def _is_full_scan(detail):
+    # "SCAN t" / "SCAN TABLE t" (older SQLite) walk every row. Scanning a
+    # covering index is still a full pass, so it counts too. Reading back a
+    # subquery's (already limited) result isn't a table scan.
+    return (detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW')
+            and not detail.startswith('SCAN (subquery'))
+
+
+def query_plan(conn, sql, params=()):
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+# Returns {name: [plan lines]} for every hot query that does a full scan
+def check_query_plans(conn, queries=None):
+    failures = {}
+    for name, (sql, params) in (queries or HOT_QUERIES).items():
+        plan = query_plan(conn, sql, params)
+        if any(_is_full_scan(detail) for detail in plan):
+            failures[name] = plan
+    return failures
@@ -0,0 +1,145 @@
+import csv
+import io
+import json
+from collections import namedtuple
+from datetime import datetime
+
+# School-wide exports for admins. Rows go from the sqlite cursor to the
+# response in fetchmany batches, so memory stays flat however big the
+# report is. CROSS JOIN pins student as the outer loop, walked in
+# (class_name, section, roll_number) index order, with each student's rows
+# found by index; SQLite only ever sorts one student's rows at a time.
+
+Report = namedtuple('Report', 'columns select order date_column filters')
+
+STUDENT_FILTERS = {'class_name': 's.class_name = ?', 'section': 's.section = ?'}
+
+REPORTS = {
+    'attendance': Report(
+        columns=['roll_number', 'name', 'class_name', 'section', 'date', 'subject', 'status'],
+        select='''SELECT s.roll_number, s.name, s.class_name, s.section, a.date, a.subject, a.status
+                  FROM student s CROSS JOIN attendance a ON a.student_id = s.id''',
+        order='s.class_name, s.section, s.roll_number, a.date, a.subject',
+        date_column='a.date',
+        filters={'subject': 'a.subject = ?', 'status': 'a.status = ?'},
+    ),
+    'fees': Report(
+        columns=['roll_number', 'name', 'class_name', 'section', 'academic_year',
+                 'total_invoiced', 'total_paid', 'outstanding', 'last_payment_at'],
+        select='''SELECT s.roll_number, s.name, s.class_name, s.section, b.academic_year,
+                         b.total_invoiced, b.total_paid, max(b.total_invoiced - b.total_paid, 0),
+                         b.last_payment_at
+                  FROM student s CROSS JOIN fee_balance b ON b.student_id = s.id''',
+        order='s.class_name, s.section, s.roll_number, b.academic_year',
+        date_column=None,
+        filters={'year': 'b.academic_year = ?'},
+    ),
+    'payments': Report(
+        columns=['roll_number', 'name', 'class_name', 'section', 'paid_at', 'amount', 'mode',
+                 'reference', 'receipt_no'],
+        select='''SELECT s.roll_number, s.name, s.class_name, s.section, p.paid_at, p.amount, p.mode,
+                         p.reference, coalesce(p.receipt_no, printf('REC%06d', p.id))
+                  FROM student s CROSS JOIN payment p ON p.student_id = s.id''',
+        order='s.class_name, s.section, s.roll_number, p.id',
+        date_column='substr(p.paid_at, 1, 10)',
+        filters={'year': 'p.academic_year = ?', 'mode': 'p.mode = ?'},
+    ),
+    'results': Report(
+        columns=['roll_number', 'name', 'class_name', 'section', 'exam', 'exam_date', 'total_obtained',
+                 'total_marks', 'percentage', 'grade', 'rank', 'percentile', 'class_size'],
+        select='''SELECT s.roll_number, s.name, s.class_name, s.section, e.name, e.exam_date,
+                         r.total_obtained, r.total_marks, r.percentage, r.grade, r.rank,
+                         r.percentile, r.class_size
+                  FROM student s CROSS JOIN result r ON r.student_id = s.id
+                  JOIN exam e ON e.id = r.exam_id''',
+        order='s.class_name, s.section, s.roll_number, r.exam_id',
+        date_column='e.exam_date',
+        filters={'exam_id': 'r.exam_id = ?'},
+    ),
+}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+
+class UnknownReport(LookupError):
+    pass
+
+
+def _date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'{name} must be YYYY-MM-DD')
+
+
+# SQL and parameters for a report, filtered by class_name, section, from/to
+# (inclusive dates) and whatever report-specific filters it has
+def build_query(name, args):
+    report = REPORTS.get(name)
+    if report is None:
+        raise UnknownReport(name)
+
+    where = []
+    params = []
+    for key, clause in {**STUDENT_FILTERS, **report.filters}.items():
+        value = args.get(key)
+        if value:
+            where.append(clause)
+            params.append(value)
+    if report.date_column:
+        if args.get('from'):
+            where.append(f'{report.date_column} >= ?')
+            params.append(_date(args['from'], 'from'))
+        if args.get('to'):
+            where.append(f'{report.date_column} <= ?')
+            params.append(_date(args['to'], 'to'))
+
+    sql = report.select
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return f'{sql} ORDER BY {report.order}', params
+
+
+# Yields lists of rows. The connection is checked out of the pool for the
+# length of the export and handed back when the generator finishes or the
+# client disconnects (the server closes the generator).
+def fetch_batches(pool, sql, params, batch_size=1000):
+    conn = pool.acquire()
+    try:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+    finally:
+        pool.release(conn)
+
+
+def to_csv(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def to_ndjson(columns, batches):
+    for rows in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n' for row in rows)
+
+
+def export(pool, name, args, fmt='csv', batch_size=1000):
+    sql, params = build_query(name, args)
+    batches = fetch_batches(pool, sql, params, batch_size)
+    columns = REPORTS[name].columns
+    return to_ndjson(columns, batches) if fmt == 'ndjson' else to_csv(columns, batches)
@@ -0,0 +1,133 @@
+import re
+from datetime import datetime
+
+# Assignments and notifications share one FTS5 index, search_index, which
+# triggers from migration 11 keep in sync. rowid is the source id times two,
+# plus one for assignments, so a trigger can find its own row again. scope
+# is 'all' or a class token. It goes into the MATCH, so BM25 only ranks
+# documents from the student's class or from the whole school. Notifications
+# are also checked against the student's deliveries.
+
+KINDS = ('notification', 'assignment')
+PAGE_SIZE = 20
+MAX_TERMS = 8
+
+_TERM = re.compile(r'\w+')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def class_token(class_name):
+    # Same as 'c' || lower(hex(class_name)) in the triggers; any class name
+    # becomes a single token
+    return 'c' + class_name.encode('utf-8').hex()
+
+
+# FTS5 query for what the user typed. Punctuation is dropped and every word
+# quoted, so input can't inject query syntax. While typing, the last word is
+# treated as a prefix ('alg' finds 'algebra'), once it is at least two
+# characters long so it can use the prefix index.
+def match_query(text, scope_tokens, columns='title body subject'):
+    terms = _TERM.findall(text or '')[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= 2 and not text.endswith(' '):
+        quoted[-1] += ' *'
+    scopes = ' OR '.join(f'"{token}"' for token in scope_tokens)
+    return f"{{{columns}}}: ({' AND '.join(quoted)}) AND scope: ({scopes})"
+
+
+def _scopes(class_name):
+    return ['all', class_token(class_name)] if class_name else ['all']
+
+
+def _cursor(value):
+    try:
+        rank, rowid = value.split(':')
+        return float(rank), int(rowid)
+    except (AttributeError, ValueError):
+        raise InvalidCursor('invalid cursor')
+
+
+# Results visible to a student, best match first. Returns (items,
+# next_cursor); pass next_cursor back as cursor for the following page.
+def search(conn, student_id, class_name, text, kind=None, cursor=None, limit=PAGE_SIZE):
+    match = match_query(text, _scopes(class_name))
+    if match is None:
+        return [], None
+
+    sql = '''SELECT rowid, title, snippet(search_index, 1, '', '', '...', 16), subject, date, rank
+             FROM search_index
+             WHERE search_index MATCH ?
+             AND (rowid % 2 = 1 OR EXISTS (SELECT 1 FROM notification_delivery
+                                           WHERE student_id = ? AND message_id = search_index.rowid / 2))'''
+    params = [match, student_id]
+    if kind is not None:
+        sql += ' AND rowid % 2 = ?'
+        params.append(KINDS.index(kind))
+    if cursor:
+        # Row-value comparison: FTS5 would take a plain "rank = ?" as a
+        # ranking function override
+        sql += ' AND (rank, rowid) > (?, ?)'
+        params.extend(_cursor(cursor))
+    sql += ' ORDER BY rank, rowid LIMIT ?'
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    items = [{
+        'kind': KINDS[rowid % 2],
+        'id': rowid // 2,
+        'title': title,
+        'snippet': snippet,
+        'subject': subject or None,
+        'date': _date_label(date),
+    } for rowid, title, snippet, subject, date, _ in rows[:limit]]
+    next_cursor = f'{rows[limit - 1][5]!r}:{rows[limit - 1][0]}' if len(rows) > limit else None
+    return items, next_cursor
+
+
+# Distinct titles for an autocomplete dropdown
+def suggest(conn, student_id, class_name, text, limit=8):
+    match = match_query(text, _scopes(class_name), columns='title')
+    if match is None:
+        return []
+    return [row[0] for row in conn.execute(
+        '''SELECT title FROM search_index
+           WHERE search_index MATCH ?
+           AND (rowid % 2 = 1 OR EXISTS (SELECT 1 FROM notification_delivery
+                                         WHERE student_id = ? AND message_id = search_index.rowid / 2))
+           GROUP BY title ORDER BY min(rank) LIMIT ?''', (match, student_id, limit))]
+
+
+def _date_label(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').strftime('%b %d, %Y')
+    except ValueError:
+        return value
+
+
+# Rebuild the index from the source tables (backfill or repair)
+def rebuild_index(conn):
+    with conn:
+        conn.execute('DELETE FROM search_index')
+        conn.execute(INDEX_MESSAGES)
+        conn.execute(INDEX_ASSIGNMENTS)
+        conn.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+    return conn.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]
+
+
+_SCOPE = "CASE WHEN {0}.class_name IS NULL THEN 'all' ELSE 'c' || lower(hex({0}.class_name)) END"
+
+INDEX_MESSAGES = f'''INSERT INTO search_index (rowid, title, body, subject, scope, date)
+                     SELECT m.id * 2, m.title, m.body, '', {_SCOPE.format('m')}, m.created_at
+                     FROM message m'''
+
+INDEX_ASSIGNMENTS = f'''INSERT INTO search_index (rowid, title, body, subject, scope, date)
+                        SELECT a.id * 2 + 1, a.title, coalesce(a.description, ''), coalesce(a.subject, ''),
+                               {_SCOPE.format('a')}, a.due_date
+                        FROM assignments a'''
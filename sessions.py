@@ -0,0 +1,256 @@
+import re
+import secrets
+import threading
+import time
+
+from flask import request
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+
+from cache import MISSING, LRUCache
+from db import get_db
+from tenants import namespace
+
+try:
+    import redis
+except ImportError:  # optional backend
+    redis = None
+
+_SID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+_serializer = TaggedJSONSerializer()
+
+
+def _new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSideSession(dict, SessionMixin):
+    # Only an opaque id travels in the cookie. The data is fetched from the
+    # store the first time the view actually reads or writes the session, so
+    # requests that never look at it cost nothing.
+    def __init__(self, sid, loader=None, new=False):
+        super().__init__()
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.previous_sid = None
+        self._loader = loader
+        self._loaded = loader is None
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            data = self._loader()
+            if data:
+                dict.update(self, data)
+
+    # Issue a new id for the same data, e.g. on login, so a session id
+    # picked up before authentication is useless afterwards
+    def regenerate(self):
+        self._load()
+        if not self.new and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = _new_sid()
+        self.modified = True
+
+
+def _reader(name):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        self.accessed = True
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+def _writer(name):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        self.accessed = True
+        self.modified = True
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('__getitem__', '__contains__', '__iter__', '__len__', '__repr__',
+              'get', 'keys', 'values', 'items', 'copy'):
+    setattr(ServerSideSession, _name, _reader(_name))
+for _name in ('__setitem__', '__delitem__', 'clear', 'pop', 'popitem', 'setdefault', 'update'):
+    setattr(ServerSideSession, _name, _writer(_name))
+
+
+class SQLiteSessionStore:
+    # Runs on the request's own connection (get_db()), so a request never
+    # needs a second connection from the pool while the view holds one
+    def get(self, sid):
+        row = get_db().execute('SELECT data FROM session_store WHERE id = ? AND expires_at > ?',
+                               (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, expires_at):
+        self._write('INSERT OR REPLACE INTO session_store (id, data, expires_at) VALUES (?, ?, ?)',
+                    (sid, data, expires_at))
+
+    def delete(self, sid):
+        self._write('DELETE FROM session_store WHERE id = ?', (sid,))
+
+    # Removes at most `limit` expired sessions, so one sweep stays short
+    def sweep(self, limit=500):
+        return self._write('''DELETE FROM session_store WHERE id IN (
+                                  SELECT id FROM session_store WHERE expires_at <= ? LIMIT ?)''',
+                           (time.time(), limit))
+
+    def _write(self, sql, params):
+        conn = get_db()
+        if conn.in_transaction:
+            # Whatever the view left uncommitted would be rolled back when
+            # the connection goes back to the pool; the session write must
+            # not commit it instead
+            conn.rollback()
+        with conn:
+            return conn.execute(sql, params).rowcount
+
+
+class RedisSessionStore:
+    def __init__(self, url='redis://localhost:6379/0', prefix='session:'):
+        if redis is None:
+            raise RuntimeError('SESSION_BACKEND=redis requires the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, sid):
+        data = self.client.get(self.prefix + sid)
+        return data.decode('utf-8') if data is not None else None
+
+    def set(self, sid, data, expires_at):
+        self.client.set(self.prefix + sid, data, ex=max(int(expires_at - time.time()), 1))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def sweep(self, limit=500):
+        return 0  # redis expires keys itself
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store, cache_size=10000, cache_ttl=5, sweep_interval=300):
+        self.store = store
+        # Read-through cache of serialized session data. Other workers may
+        # see a change up to cache_ttl seconds late, so keep it short.
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl else None
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+        self._sweep_lock = threading.Lock()
+        self.loads = 0
+        self.saves = 0
+        self.swept = 0
+
+    # Stored under the tenant's namespace: a session id from one school is
+    # unknown at every other school, even on a shared store or cache
+    def _read(self, sid):
+        key = namespace() + sid
+        data = self.cache.get(key) if self.cache else MISSING
+        if data is MISSING:
+            self.loads += 1
+            data = self.store.get(key)
+            if self.cache and data is not None:
+                self.cache.set(key, data)
+        return _serializer.loads(data) if data else None
+
+    # Schools served under /t/<slug>/ on a shared host each get their own
+    # cookie instead of overwriting one another's
+    def get_cookie_path(self, app):
+        return request.script_root or super().get_cookie_path(app)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not _SID.match(sid):
+            return ServerSideSession(_new_sid(), new=True)
+        return ServerSideSession(sid, loader=lambda: self._read(sid))
+
+    def _forget(self, sid):
+        key = namespace() + sid
+        self.store.delete(key)
+        if self.cache:
+            self.cache.delete(key)
+
+    def save_session(self, app, session, response):
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.modified:
+            self._maybe_sweep()
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self._forget(session.previous_sid)
+
+        if not session:
+            # Emptied (e.g. logout): drop it server-side and clear the cookie
+            if not session.new:
+                self._forget(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        data = _serializer.dumps(dict(session))
+        expires_at = time.time() + app.permanent_session_lifetime.total_seconds()
+        key = namespace() + session.sid
+        self.store.set(key, data, expires_at)
+        if self.cache:
+            self.cache.set(key, data)
+        self.saves += 1
+
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+        self._maybe_sweep()
+
+    def _maybe_sweep(self):
+        if time.monotonic() < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.swept += self.store.sweep()
+        finally:
+            self._sweep_lock.release()
+
+    def stats(self):
+        stats = {'store_loads': self.loads, 'saves': self.saves, 'swept': self.swept}
+        if self.cache:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+
+def init_app(app):
+    app.config.setdefault('SESSION_BACKEND', 'sqlite')
+    app.config.setdefault('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+    app.config.setdefault('SESSION_CACHE_TTL', 5)
+    app.config.setdefault('SESSION_SWEEP_INTERVAL', 300)
+
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return  # Flask's default signed cookie
+    if backend == 'redis':
+        store = RedisSessionStore(app.config['SESSION_REDIS_URL'])
+    else:
+        store = SQLiteSessionStore()
+    app.session_interface = ServerSideSessionInterface(
+        store,
+        cache_ttl=int(app.config['SESSION_CACHE_TTL']),
+        sweep_interval=int(app.config['SESSION_SWEEP_INTERVAL']),
+    )
@@ -1,20 +1,28 @@
 import os
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
-import io
+
+# Bump when the drawing code changes so existing placeholders get redrawn
+GENERATOR_VERSION = 2
+MANIFEST_NAME = '.placeholders.json'
+
+def gradient_background(width, height):
+    # Same colours as painting row by row: each channel is int(y / height * max).
+    # One column is computed and stretched across the width, so the cost is
+    # O(height) Python work instead of a draw call per pixel.
+    def channel(maximum):
+        column = bytes(int((y / height) * maximum) for y in range(height))
+        return Image.frombytes('L', (1, height), column).resize((width, height), Image.NEAREST)
+    
+    return Image.merge('RGB', (channel(0), channel(100), channel(255)))
 
 def create_placeholder_image(width, height, text, filename):
     # Create a new image with a gradient background
-    image = Image.new('RGB', (width, height))
+    image = gradient_background(width, height)
     draw = ImageDraw.Draw(image)
     
-    # Create gradient background
-    for y in range(height):
-        r = int((y / height) * 0)  # Start with dark
-        g = int((y / height) * 100)  # Add some green
-        b = int((y / height) * 255)  # More blue at bottom
-        for x in range(width):
-            draw.point((x, y), fill=(r, g, b))
-    
     # Add text
     try:
         font = ImageFont.truetype("arial.ttf", 40)
@@ -34,6 +42,44 @@ def create_placeholder_image(width, height, text, filename):
     # Save the image
     image.save(filename)
 
+def spec_hash(width, height, text):
+    key = json.dumps([GENERATOR_VERSION, width, height, text])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+def _create_from_spec(spec):
+    filepath, width, height, text = spec
+    create_placeholder_image(width, height, text, filepath)
+
+# Generate every placeholder whose spec changed since the last run (or whose
+# file is missing), in parallel across processes
+def generate_placeholders(specs, manifest_path, workers=None):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    
+    manifest_dir = os.path.dirname(manifest_path)
+    def key(spec):
+        return os.path.relpath(spec[0], manifest_dir)
+    
+    pending = [spec for spec in specs
+               if not os.path.exists(spec[0]) or manifest.get(key(spec)) != spec_hash(*spec[1:])]
+    
+    if len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_create_from_spec, pending))
+    else:
+        for spec in pending:
+            _create_from_spec(spec)
+    
+    if pending:
+        for spec in pending:
+            manifest[key(spec)] = spec_hash(*spec[1:])
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+    return len(pending)
+
 def setup_images():
     base_dir = os.path.dirname(os.path.abspath(__file__))
     static_dir = os.path.join(base_dir, 'static')
@@ -55,18 +101,19 @@ def setup_images():
         'lang-head.jpg': (300, 400, 'Language Head'),
         'social-head.jpg': (300, 400, 'Social Science Head')
     }
-    
-    for filename, (width, height, text) in placeholders.items():
-        filepath = os.path.join(leadership_dir, filename)
-        create_placeholder_image(width, height, text, filepath)
+    specs = [(os.path.join(leadership_dir, filename), width, height, text)
+             for filename, (width, height, text) in placeholders.items()]
     
     # Create school logo placeholder
     logo_path = os.path.join(images_dir, 'logo.png')
-    create_placeholder_image(200, 200, 'LOGO', logo_path)
+    specs.append((logo_path, 200, 200, 'LOGO'))
     
     # Create favicon
     favicon_path = os.path.join(images_dir, 'favicon.png')
-    create_placeholder_image(32, 32, '', favicon_path)
+    specs.append((favicon_path, 32, 32, ''))
+    
+    created = generate_placeholders(specs, os.path.join(images_dir, MANIFEST_NAME))
+    print(f"{created} placeholder image(s) generated, {len(specs) - created} already up to date.")
     
     print("All placeholder images have been created successfully!")
     print("\nTo add your school's real logo:")
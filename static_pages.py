@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import current_app, render_template, request
+
+from tenants import current_tenant
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# (tenant, template name) -> rendered page, filled on first hit and kept
+# until the templates change (i.e. once per deploy)
+_pages = {}
+
+
+class RenderedPage:
+    def __init__(self, html, mtime):
+        identity = html.encode('utf-8')
+        self.last_modified = datetime.fromtimestamp(int(mtime), tz=timezone.utc)
+        self.mtime = mtime
+        self.bodies = {'identity': identity, 'gzip': gzip.compress(identity, 9)}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(identity)
+
+        digest = hashlib.sha256(identity).hexdigest()[:32]
+        self.etags = {encoding: digest if encoding == 'identity' else f'{digest}-{encoding}'
+                      for encoding in self.bodies}
+
+
+def _templates_mtime(app):
+    # Pages extend and include each other, so any template change counts
+    latest = 0
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for root, _, files in os.walk(template_dir):
+        for name in files:
+            latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+    return latest
+
+
+def _get_page(template):
+    app = current_app._get_current_object()
+    key = (current_tenant().slug, template)
+    page = _pages.get(key)
+    if page is not None and not (app.debug or app.config.get('TEMPLATES_AUTO_RELOAD')):
+        return page
+
+    mtime = _templates_mtime(app)
+    if page is None or page.mtime != mtime:
+        page = _pages[key] = RenderedPage(render_template(template), mtime)
+    return page
+
+
+def _choose_encoding(page):
+    accepted = request.accept_encodings
+    best, best_quality = 'identity', 0
+    for encoding in ('br', 'gzip'):
+        quality = accepted[encoding]
+        if encoding in page.bodies and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+# Serve a template with no per-request data from the pre-rendered copy, with
+# validators and cache headers. Visitors with a session cookie (logged in, or
+# a pending flash message) get a normal render since the layout may differ.
+# Only the cookie is checked, so anonymous hits never load the session.
+def static_page(template):
+    if request.cookies.get(current_app.config['SESSION_COOKIE_NAME']):
+        return render_template(template)
+
+    page = _get_page(template)
+    encoding = _choose_encoding(page)
+
+    response = current_app.response_class(page.bodies[encoding], mimetype='text/html')
+    if encoding != 'identity':
+        response.content_encoding = encoding
+    response.set_etag(page.etags[encoding])
+    response.last_modified = page.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('STATIC_PAGE_MAX_AGE', 300)
+    response.vary.add('Accept-Encoding')
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+def clear():
+    _pages.clear()
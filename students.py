@@ -0,0 +1,79 @@
+import sqlite3
+from dataclasses import dataclass
+
+from flask import g, session
+
+import cache
+import queries
+from db import get_db
+
+PLACEHOLDER_PIC = 'images/profile-placeholder.jpg'
+
+
+# What views need to know about the logged-in student. No password hash, so
+# it is safe to keep in the shared cache.
+@dataclass
+class Student:
+    __slots__ = ('id', 'name', 'roll_number', 'class_name', 'section', 'email', 'profile_pic')
+    id: int
+    name: str
+    roll_number: str
+    class_name: str
+    section: str
+    email: str
+    profile_pic: str
+
+    @property
+    def profile_pic_or_placeholder(self):
+        return self.profile_pic or PLACEHOLDER_PIC
+
+
+def load_student(student_id):
+    def fetch():
+        row = get_db().execute(queries.STUDENT_BY_ID, (student_id,)).fetchone()
+        return Student(*row) if row else None
+    return cache.cached(cache.student_key(student_id), fetch)
+
+
+# The logged-in student, loaded at most once per request
+def current_student():
+    if 'student' not in g:
+        student_id = session.get('student_id')
+        g.student = load_student(student_id) if student_id is not None else None
+    return g.student
+
+
+# Who a class-wide write affects, for cache invalidation; the whole school
+# when class_name is None
+def class_student_ids(conn, class_name=None):
+    if class_name is None:
+        return [row[0] for row in conn.execute('SELECT id FROM student')]
+    return [row[0] for row in conn.execute('SELECT id FROM student WHERE class_name = ?', (class_name,))]
+
+
+# Latest notifications, upcoming class assignments and the unread count in
+# one round trip. Dates arrive already formatted by the query.
+def dashboard_feed(conn, student_id, limit=5):
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    feed = {'notifications': [], 'assignments': [], 'unread': 0}
+    for row in cursor.execute(queries.DASHBOARD_FEED, {'student_id': student_id, 'limit': limit}):
+        if row['kind'] == 'notification':
+            feed['notifications'].append({
+                'id': row['id'],
+                'title': row['title'],
+                'message': row['body'],
+                'type': row['detail'],
+                'created_at': row['date_label'],
+                'read': bool(row['flag'])
+            })
+        elif row['kind'] == 'assignment':
+            feed['assignments'].append({
+                'title': row['title'],
+                'description': row['body'],
+                'due_date': row['date_label'],
+                'subject': row['detail']
+            })
+        else:
+            feed['unread'] = row['flag']
+    return feed
@@ -0,0 +1,167 @@
+import json
+import os
+from dataclasses import dataclass
+
+from flask import current_app, g, has_app_context, has_request_context, request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# One deployment, many schools. Every school (tenant) has its own SQLite
+# file, static/upload root, cache namespace and event channels. The tenant is
+# picked per request, before Flask sees it, from:
+#
+#   /t/<slug>/...          path prefix, moved into SCRIPT_NAME so url_for()
+#                          keeps generating prefixed links
+#   Host: school.example   any host listed for the tenant
+#
+# and otherwise falls back to TENANT_FALLBACK (the 'default' tenant, i.e.
+# DATABASE and static/, unless set to '' to answer 404). Tenants come from
+# the JSON file named by TENANTS_FILE:
+#
+#   {"stmariams": {"name": "ST MARIAM'S SCHOOL", "hosts": ["stmariams.example.com"]},
+#    "oakridge": {"name": "Oakridge High", "database": "/data/oakridge.db"}}
+#
+# database and static_folder default to TENANT_ROOT/<slug>/school.db and
+# TENANT_ROOT/<slug>/static. With no TENANTS_FILE the app is single-school
+# exactly as before.
+
+DEFAULT = 'default'
+ENVIRON_KEY = 'school.tenant'
+PATH_PREFIX = '/t/'
+
+
+@dataclass(frozen=True)
+class Tenant:
+    slug: str
+    name: str
+    database: str
+    static_folder: str
+    hosts: tuple = ()
+
+
+class TenantDirectory:
+    def __init__(self, tenants, fallback=DEFAULT):
+        self.tenants = {tenant.slug: tenant for tenant in tenants}
+        self.by_host = {host.lower(): tenant for tenant in tenants for host in tenant.hosts}
+        self.fallback = self.tenants.get(fallback) if fallback else None
+
+    def __iter__(self):
+        return iter(self.tenants.values())
+
+    def __len__(self):
+        return len(self.tenants)
+
+    def get(self, slug):
+        return self.tenants.get(slug)
+
+    @property
+    def default(self):
+        return self.tenants[DEFAULT]
+
+    # The tenant for a WSGI environ, rewriting SCRIPT_NAME/PATH_INFO when it
+    # came from the path. None if nothing matches and there is no fallback.
+    def resolve(self, environ):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(PATH_PREFIX):
+            slug, _, rest = path[len(PATH_PREFIX):].partition('/')
+            tenant = self.tenants.get(slug)
+            if tenant is not None:
+                environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + PATH_PREFIX + slug
+                environ['PATH_INFO'] = '/' + rest
+                return tenant
+
+        host = environ.get('HTTP_HOST') or environ.get('SERVER_NAME', '')
+        tenant = self.by_host.get(host.rsplit(':', 1)[0].lower())
+        return tenant if tenant is not None else self.fallback
+
+
+class TenantMiddleware:
+    def __init__(self, wsgi_app, directory):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+
+    def __call__(self, environ, start_response):
+        tenant = self.directory.resolve(environ)
+        if tenant is None:
+            return NotFound('Unknown school')(environ, start_response)
+        environ[ENVIRON_KEY] = tenant
+        return self.wsgi_app(environ, start_response)
+
+
+def get_directory(app=None):
+    app = app or current_app
+    return app.extensions['tenants']
+
+
+# The tenant being served. Background work that runs in a bare app context
+# (e.g. image processing) sets g.tenant to the tenant that queued it.
+def current_tenant(app=None):
+    if has_app_context() and 'tenant' in g:
+        return g.tenant
+    if has_request_context():
+        tenant = request.environ.get(ENVIRON_KEY)
+        if tenant is not None:
+            return tenant
+    return get_directory(app).default
+
+
+# Namespace for shared, process-wide structures (cache keys, event channels,
+# session ids); empty for the default tenant so single-school keys stay as
+# they were
+def namespace():
+    if not has_app_context() and not has_request_context():
+        return ''
+    slug = current_tenant().slug
+    return '' if slug == DEFAULT else f'{slug}/'
+
+
+# The static endpoint: the tenant's own files (logos, uploads) first, then
+# the shared static/ folder for CSS and JS
+def send_static_file(filename):
+    app = current_app
+    tenant = current_tenant()
+    if tenant.static_folder != app.static_folder:
+        path = safe_join(tenant.static_folder, filename)
+        if path is not None and os.path.isfile(path):
+            return send_from_directory(tenant.static_folder, filename,
+                                       max_age=app.get_send_file_max_age(filename))
+    return app.send_static_file(filename)
+
+
+def load_tenants(path, root):
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    tenants = []
+    for slug, options in config.items():
+        if slug == DEFAULT or not slug.replace('-', '').isalnum():
+            raise ValueError(f'invalid tenant slug {slug!r}')
+        tenants.append(Tenant(
+            slug=slug,
+            name=options.get('name', slug),
+            database=options.get('database') or os.path.join(root, slug, 'school.db'),
+            static_folder=os.path.abspath(options.get('static_folder') or os.path.join(root, slug, 'static')),
+            hosts=tuple(options.get('hosts', ())),
+        ))
+    return tenants
+
+
+def init_app(app):
+    app.config.setdefault('SCHOOL_NAME', "ST MARIAM'S SCHOOL")
+    app.config.setdefault('TENANTS_FILE', None)
+    app.config.setdefault('TENANT_ROOT', os.path.join(app.instance_path, 'tenants'))
+    app.config.setdefault('TENANT_FALLBACK', DEFAULT)
+
+    tenants = [Tenant(DEFAULT, app.config['SCHOOL_NAME'], app.config['DATABASE'], app.static_folder)]
+    if app.config['TENANTS_FILE']:
+        tenants += load_tenants(app.config['TENANTS_FILE'], app.config['TENANT_ROOT'])
+    for tenant in tenants[1:]:
+        os.makedirs(os.path.dirname(os.path.abspath(tenant.database)), exist_ok=True)
+
+    directory = TenantDirectory(tenants, app.config['TENANT_FALLBACK'])
+    app.extensions['tenants'] = directory
+    app.wsgi_app = TenantMiddleware(app.wsgi_app, directory)
+    app.view_functions['static'] = send_static_file
+
+    @app.context_processor
+    def school():
+        return {'school_name': current_tenant().name}
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrations  # noqa: E402
+
+
+@pytest.fixture
+def migrated_db(tmp_path):
+    path = str(tmp_path / 'school.db')
+    conn = sqlite3.connect(path)
+    migrations.migrate(conn)
+    conn.close()
+    return path
+
+
+def pytest_addoption(parser):
+    parser.addoption('--run-slow', action='store_true', help='also run tests marked slow')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: takes minutes; skipped unless --run-slow is given')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-slow'):
+        return
+    skip = pytest.mark.skip(reason='slow; pass --run-slow to run it')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,66 @@
+import asyncio
+import importlib
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def asgi(tmp_path_factory):
+    # Importing asgi imports the app, which creates its database
+    monkeypatch = pytest.MonkeyPatch()
+    monkeypatch.setenv('SCHOOL_DB', str(tmp_path_factory.mktemp('asgi') / 'school.db'))
+    try:
+        yield importlib.import_module('asgi')
+    finally:
+        monkeypatch.undo()
+
+
+def _call(application, path='/', headers=()):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+             'http_version': '1.1', 'headers': list(headers)}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        await application(scope, receive, send)
+        return sent
+    return run()
+
+
+def _run(*calls):
+    async def gather():
+        return await asyncio.gather(*calls)
+    return asyncio.run(gather())
+
+
+def test_requests_run_side_by_side(asgi):
+    # Both requests must be inside the app at once; on asgiref's single
+    # shared thread the barrier would time out
+    barrier = threading.Barrier(2, timeout=5)
+
+    def wsgi_app(environ, start_response):
+        barrier.wait()
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+        return [b'ok', b'ignored']
+
+    application = asgi._WsgiToAsgi(wsgi_app)
+    for sent in _run(_call(application), _call(application)):
+        assert sent[0]['type'] == 'http.response.start'
+        assert sent[0]['status'] == 200
+        assert b''.join(message.get('body', b'') for message in sent[1:]) == b'ok'
+        assert sent[-1] == {'type': 'http.response.body'}
+
+
+def test_too_many_duplicate_headers(asgi):
+    def wsgi_app(environ, start_response):
+        raise AssertionError('the app must not be called')
+
+    application = asgi._WsgiToAsgi(wsgi_app, duplicate_header_limit=2)
+    sent, = _run(_call(application, headers=[(b'x-a', b'1')] * 3))
+    assert sent[0]['status'] == 400
@@ -0,0 +1,35 @@
+import sqlite3
+
+import pytest
+
+import queries
+
+
+def _sql_constants():
+    return {name: value for name, value in vars(queries).items()
+            if name.isupper() and isinstance(value, str)}
+
+
+@pytest.fixture
+def conn(migrated_db):
+    conn = sqlite3.connect(migrated_db)
+    yield conn
+    conn.close()
+
+
+def test_every_query_is_checked():
+    checked = {sql for sql, _ in queries.HOT_QUERIES.values()}
+    unchecked = sorted(name for name, sql in _sql_constants().items() if sql not in checked)
+    assert not unchecked, f'add these to queries.HOT_QUERIES: {unchecked}'
+
+
+@pytest.mark.parametrize('name', sorted(queries.HOT_QUERIES))
+def test_hot_query_uses_an_index(conn, name):
+    sql, params = queries.HOT_QUERIES[name]
+    plan = queries.query_plan(conn, sql, params)
+    assert not any(queries._is_full_scan(detail) for detail in plan), '\n'.join(plan)
+
+
+def test_full_scan_is_reported(conn):
+    unindexed = {'by_name': ('SELECT id FROM student WHERE name = ?', ('Demo Student',))}
+    assert list(queries.check_query_plans(conn, unindexed)) == ['by_name']
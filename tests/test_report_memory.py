@@ -0,0 +1,47 @@
+import tracemalloc
+
+import pytest
+
+import db
+import reports
+from init_db import DEFAULT_SUBJECTS, seed
+
+DAYS = 50
+CEILING_BYTES = 2 * 1024 * 1024
+
+
+# Students x DAYS days x 4 subjects: 200,000 attendance rows (about 10 MB of CSV) on
+# every run, and the full 1,000,000 rows with --run-slow
+@pytest.fixture(scope='module', params=[
+    pytest.param(1000, id='200k'),
+    pytest.param(5000, id='1m', marks=pytest.mark.slow),
+])
+def students(request):
+    return request.param
+
+
+@pytest.fixture(scope='module')
+def pool(tmp_path_factory, students):
+    path = str(tmp_path_factory.mktemp('reports') / 'school.db')
+    seed(path, students, DEFAULT_SUBJECTS, DAYS, 0.05, 42, 50000)
+    pool = db.ConnectionPool(path, size=1)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize('fmt', sorted(reports.FORMATS))
+def test_export_memory_stays_flat(pool, students, fmt):
+    tracemalloc.start()
+    try:
+        rows = size = 0
+        for chunk in reports.export(pool, 'attendance', {}, fmt):
+            rows += chunk.count('\n')
+            size += len(chunk)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert rows >= students * DAYS * len(DEFAULT_SUBJECTS)
+    # Holding the report, or even a fraction of it, would blow the ceiling
+    assert size > 4 * CEILING_BYTES
+    assert peak < CEILING_BYTES, f'peak {peak / 1024:.0f} KB exporting {size / 1e6:.1f} MB'
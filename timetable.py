@@ -0,0 +1,313 @@
+import json
+from bisect import bisect_left, insort
+from datetime import date, datetime, timedelta
+
+import queries
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+ICAL_DAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+# The timetable is edited as rows in timetable_entry, but read as one
+# compiled JSON document per class and section (compiled_schedule). Saving a
+# timetable or an exam date sheet recompiles the affected classes, so
+# /routine, the dashboard and the iCal feed do a single key lookup.
+
+
+class TimetableClash(ValueError):
+    def __init__(self, clashes):
+        super().__init__(f'{len(clashes)} clash(es)')
+        self.clashes = clashes
+
+
+class InvalidTimetable(ValueError):
+    pass
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+# '9:00' -> '09:00', so stored times sort and compare as strings
+def _hhmm(value):
+    return datetime.strptime(str(value).strip(), '%H:%M').strftime('%H:%M')
+
+
+class IntervalIndex:
+    # Booked [start, end) minutes per key, e.g. ('teacher', 7, 0) for
+    # teacher 7 on Monday, kept sorted by start. Bookings under one key never
+    # overlap, so a new interval can only collide with the booking that
+    # starts last before it ends: one bisect instead of comparing pairs.
+    def __init__(self):
+        self._starts = {}
+        self._slots = {}
+
+    def find(self, key, start, end):
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+        i = bisect_left(starts, end)
+        if i and self._slots[key][i - 1][1] > start:
+            return self._slots[key][i - 1][2]
+        return None
+
+    def add(self, key, start, end, owner):
+        insort(self._starts.setdefault(key, []), start)
+        insort(self._slots.setdefault(key, []), (start, end, owner))
+
+
+def _periods(conn):
+    return {period_id: (name, start, end, _minutes(start), _minutes(end))
+            for period_id, name, start, end in conn.execute(
+                'SELECT id, name, start_time, end_time FROM period')}
+
+
+# Replace a class's timetable. entries are dicts with day (0 = Monday),
+# period_id, subject and optional teacher_id and room_id. A teacher or room
+# already booked at an overlapping time, or two entries for the class at
+# once, raise TimetableClash and nothing is saved.
+def save_timetable(conn, class_name, section, entries):
+    periods = _periods(conn)
+    teachers = {row[0] for row in conn.execute('SELECT id FROM teacher')}
+    rooms = {row[0] for row in conn.execute('SELECT id FROM room')}
+
+    rows = []
+    for n, entry in enumerate(entries, start=1):
+        try:
+            day = int(entry['day'])
+            period_id = int(entry['period_id'])
+            subject = str(entry['subject']).strip()
+            teacher_id = int(entry['teacher_id']) if entry.get('teacher_id') is not None else None
+            room_id = int(entry['room_id']) if entry.get('room_id') is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise InvalidTimetable(f'entry {n}: day, period_id and subject are required')
+        if not 0 <= day <= 6 or period_id not in periods or not subject:
+            raise InvalidTimetable(f'entry {n}: unknown day or period, or empty subject')
+        if teacher_id is not None and teacher_id not in teachers:
+            raise InvalidTimetable(f'entry {n}: unknown teacher {teacher_id}')
+        if room_id is not None and room_id not in rooms:
+            raise InvalidTimetable(f'entry {n}: unknown room {room_id}')
+        rows.append((day, period_id, subject, teacher_id, room_id))
+
+    # BEGIN IMMEDIATE takes the write lock before other classes' bookings are
+    # read, so two concurrent saves can't both pass the clash check and
+    # double-book a teacher or room
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        clashes = _clashes(conn, class_name, section, periods, rows)
+        if clashes:
+            raise TimetableClash(clashes)
+        conn.execute('DELETE FROM timetable_entry WHERE class_name = ? AND section = ?', (class_name, section))
+        conn.executemany('''INSERT INTO timetable_entry
+                            (class_name, section, day, period_id, subject, teacher_id, room_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                         [(class_name, section) + row for row in rows])
+        compile_schedule(conn, class_name, section)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _clashes(conn, class_name, section, periods, rows):
+    # Everyone else's bookings, then this class's entries one by one
+    index = IntervalIndex()
+    for other_class, other_section, day, period_id, teacher_id, room_id in conn.execute(
+            '''SELECT class_name, section, day, period_id, teacher_id, room_id FROM timetable_entry
+               WHERE NOT (class_name = ? AND section = ?)''', (class_name, section)):
+        _, _, _, start, end = periods[period_id]
+        owner = f'{other_class} {other_section}'
+        if teacher_id is not None:
+            index.add(('teacher', teacher_id, day), start, end, owner)
+        if room_id is not None:
+            index.add(('room', room_id, day), start, end, owner)
+
+    clashes = []
+    this_class = f'{class_name} {section}'
+    for day, period_id, subject, teacher_id, room_id in rows:
+        name, _, _, start, end = periods[period_id]
+        keys = [('class', None, day)]
+        if teacher_id is not None:
+            keys.append(('teacher', teacher_id, day))
+        if room_id is not None:
+            keys.append(('room', room_id, day))
+        for key in keys:
+            owner = index.find(key, start, end)
+            if owner is None:
+                index.add(key, start, end, this_class)
+            else:
+                clashes.append({'day': DAYS[day], 'period': name, 'subject': subject,
+                                'clash': key[0], 'with': owner})
+    return clashes
+
+
+# Replace the date sheet of an exam: dicts with subject, date (YYYY-MM-DD),
+# start and end (HH:MM) and optional topic and room_id. Returns the
+# (class_name, section) pairs that were recompiled.
+def save_exam_papers(conn, exam_id, papers):
+    exam = conn.execute('SELECT class_name FROM exam WHERE id = ?', (exam_id,)).fetchone()
+    if exam is None:
+        raise InvalidTimetable(f'unknown exam {exam_id}')
+    rooms = {row[0] for row in conn.execute('SELECT id FROM room')}
+    rows = []
+    for n, paper in enumerate(papers, start=1):
+        try:
+            subject = str(paper['subject']).strip()
+            paper_date = datetime.strptime(paper['date'], '%Y-%m-%d').strftime('%Y-%m-%d')
+            start, end = _hhmm(paper['start']), _hhmm(paper['end'])
+            if start >= end or not subject:
+                raise ValueError
+            room_id = int(paper['room_id']) if paper.get('room_id') is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise InvalidTimetable(f'paper {n}: subject, date, start and end are required')
+        if room_id is not None and room_id not in rooms:
+            raise InvalidTimetable(f'paper {n}: unknown room {room_id}')
+        rows.append((exam_id, subject, paper.get('topic'),
+                     paper_date, start, end, room_id))
+
+    with conn:
+        conn.execute('DELETE FROM exam_paper WHERE exam_id = ?', (exam_id,))
+        conn.executemany('''INSERT INTO exam_paper (exam_id, subject, topic, paper_date, start_time, end_time, room_id)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        return compile_class(conn, exam[0])
+
+
+def class_sections(conn, class_name):
+    return [row[0] for row in conn.execute(
+        '''SELECT section FROM student WHERE class_name = ? AND section IS NOT NULL
+           UNION SELECT section FROM timetable_entry WHERE class_name = ?''', (class_name, class_name))]
+
+
+def compile_class(conn, class_name):
+    compiled = []
+    for section in class_sections(conn, class_name):
+        compile_schedule(conn, class_name, section)
+        compiled.append((class_name, section))
+    return compiled
+
+
+# Resolve one class's week and upcoming exams into the stored document:
+#   {"week": [[[start, end, period, subject, teacher, room], ...] x 7],
+#    "exams": [[date, start, end, subject, topic, exam, room], ...]}
+# The caller commits.
+def compile_schedule(conn, class_name, section):
+    week = [[] for _ in DAYS]
+    for day, start, end, period, subject, teacher, room in conn.execute(
+            '''SELECT t.day, p.start_time, p.end_time, p.name, t.subject, te.name, r.name
+               FROM timetable_entry t
+               JOIN period p ON p.id = t.period_id
+               LEFT JOIN teacher te ON te.id = t.teacher_id
+               LEFT JOIN room r ON r.id = t.room_id
+               WHERE t.class_name = ? AND t.section = ?
+               ORDER BY t.day, p.start_time''', (class_name, section)):
+        week[day].append([start, end, period, subject, teacher, room])
+
+    exams = [list(row) for row in conn.execute(
+        '''SELECT ep.paper_date, ep.start_time, ep.end_time, ep.subject, ep.topic, e.name, r.name
+           FROM exam e
+           JOIN exam_paper ep ON ep.exam_id = e.id
+           LEFT JOIN room r ON r.id = ep.room_id
+           WHERE e.class_name = ? AND ep.paper_date >= date('now')
+           ORDER BY ep.paper_date, ep.start_time''', (class_name,))]
+
+    conn.execute('''INSERT OR REPLACE INTO compiled_schedule (class_name, section, data, compiled_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)''',
+                 (class_name, section, json.dumps({'week': week, 'exams': exams}, separators=(',', ':'))))
+
+
+def compile_all(conn):
+    classes = [row[0] for row in conn.execute(
+        '''SELECT class_name FROM student WHERE class_name IS NOT NULL
+           UNION SELECT class_name FROM timetable_entry''')]
+    with conn:
+        return sum(len(compile_class(conn, class_name)) for class_name in classes)
+
+
+# The compiled document for a class, expanded for templates
+def get_schedule(conn, class_name, section):
+    row = conn.execute(queries.COMPILED_SCHEDULE, (class_name, section)).fetchone()
+    data = json.loads(row[0]) if row else {'week': [[] for _ in DAYS], 'exams': []}
+    return {
+        'week': [
+            {
+                'day': DAYS[day],
+                'slots': [
+                    {'start': start, 'end': end, 'period': period, 'subject': subject,
+                     'teacher': teacher, 'room': room}
+                    for start, end, period, subject, teacher, room in slots
+                ]
+            }
+            for day, slots in enumerate(data['week'])
+        ],
+        'exams': [
+            {'date': paper_date, 'start': start, 'end': end, 'subject': subject, 'topic': topic,
+             'exam': exam, 'room': room}
+            for paper_date, start, end, subject, topic, exam, room in data['exams']
+        ],
+    }
+
+
+def upcoming_exams(schedule, limit=3, today=None):
+    today = (today or date.today()).isoformat()
+    return [paper for paper in schedule['exams'] if paper['date'] >= today][:limit]
+
+
+def _ical_text(value):
+    return (str(value or '').replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def _fold(line):
+    # Content lines are limited to 75 octets; continuation lines start with a space
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        cut = 75 if not parts else 74
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1  # don't split a UTF-8 sequence
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts)
+
+
+# Weekly recurring events for the timetable plus one event per exam paper,
+# starting from the Monday of the current week (floating local times).
+# school_name and uid_domain are the tenant's, for the calendar's PRODID and
+# event UIDs that don't collide with another school's same class.
+def to_ical(schedule, class_name, section, school_name, uid_domain, today=None):
+    today = today or date.today()
+    monday = today - timedelta(days=today.weekday())
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    uid_base = f'{class_name}-{section}'.replace(' ', '_')
+
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:-//{_ical_text(school_name)}//Routine//EN',
+             'CALSCALE:GREGORIAN', f'X-WR-CALNAME:{_ical_text(f"Class {class_name} {section} routine")}']
+
+    def event(uid, day, start, end, summary, location, rrule=None):
+        stamp_day = day.strftime('%Y%m%d')
+        lines.extend(['BEGIN:VEVENT', f'UID:{uid}@{uid_domain}', f'DTSTAMP:{stamp}',
+                      f'DTSTART:{stamp_day}T{start.replace(":", "")}00',
+                      f'DTEND:{stamp_day}T{end.replace(":", "")}00',
+                      f'SUMMARY:{_ical_text(summary)}'])
+        if location:
+            lines.append(f'LOCATION:{_ical_text(location)}')
+        if rrule:
+            lines.append(f'RRULE:{rrule}')
+        lines.append('END:VEVENT')
+
+    for day_index, day in enumerate(schedule['week']):
+        for slot in day['slots']:
+            summary = slot['subject'] + (f" ({slot['teacher']})" if slot['teacher'] else '')
+            event(f"{uid_base}-{ICAL_DAYS[day_index]}-{slot['start'].replace(':', '')}",
+                  monday + timedelta(days=day_index), slot['start'], slot['end'], summary, slot['room'],
+                  f'FREQ=WEEKLY;BYDAY={ICAL_DAYS[day_index]}')
+    for paper in schedule['exams']:
+        summary = f"{paper['exam']}: {paper['subject']}" + (f" - {paper['topic']}" if paper['topic'] else '')
+        event(f"{uid_base}-exam-{paper['date']}-{paper['start'].replace(':', '')}",
+              datetime.strptime(paper['date'], '%Y-%m-%d').date(), paper['start'], paper['end'],
+              summary, paper['room'])
+
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'